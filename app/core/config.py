@@ -5,20 +5,134 @@ from functools import lru_cache
 class Settings(BaseSettings):
     # OpenAI settings
     OPENAI_API_KEY: str
+    # Empty uses the OpenAI API; set to point at a compatible endpoint or a local stub
+    OPENAI_BASE_URL: str = ""
+    OPENAI_MAX_CONCURRENCY: int = 8
+    FUNCTION_CALL_CACHE_MAX_ENTRIES: int = 1024
+    FUNCTION_CALL_CACHE_TTL_SECONDS: float = 300.0
     
     # Twilio settings
     TWILIO_ACCOUNT_SID: str
     TWILIO_AUTH_TOKEN: str
     TWILIO_PHONE_NUMBER: str
+    TWILIO_OUTBOUND_BATCHING: bool = True
+    TWILIO_OUTBOUND_MAX_FRAME_BYTES: int = 8000
+    TWILIO_OUTBOUND_QUEUE_MAX_BYTES: int = 160000
+    TWILIO_OUTBOUND_QUEUE_PUT_TIMEOUT_SECONDS: float = 1.0
+    TWILIO_API_BASE_URL: str = "https://api.twilio.com"
+    
+    # Voice activity detection on inbound audio: speech and the hangover after it (long enough
+    # for the agent's end-of-turn detection) go upstream, longer silence is thinned to one
+    # comfort frame every VAD_COMFORT_INTERVAL_FRAMES 20 ms frames
+    VAD_ENABLED: bool = False
+    VAD_HANGOVER_MS: int = 1000
+    VAD_COMFORT_INTERVAL_FRAMES: int = 5
+    
+    # SMS settings: per-sender rate (a Twilio long code sends about one message per second),
+    # retries and the delivery status callback URL (empty disables status callbacks)
+    SMS_RATE_PER_SECOND: float = 1.0
+    SMS_BURST: int = 1
+    SMS_MAX_RETRIES: int = 3
+    SMS_RETRY_BACKOFF_SECONDS: float = 1.0
+    SMS_TIMEOUT_SECONDS: float = 10.0
+    SMS_QUEUE_PATH: str = "sms_jobs.sqlite3"
+    SMS_QUEUE_WORKERS: int = 2
+    SMS_QUEUE_MAX_ATTEMPTS: int = 5
+    SMS_QUEUE_RETRY_BACKOFF_SECONDS: float = 30.0
+    SMS_STATUS_CALLBACK_URL: str = ""
+    
+    # Human handoff: the ring group dialed at once on a warm transfer, the first staff member to
+    # answer takes the call; e.g. HUMAN_HANDOFF_NUMBERS='["+15551234567", "+15557654321"]'
+    HUMAN_HANDOFF_NUMBERS: list[str] = []
+    HUMAN_HANDOFF_RING_SECONDS: int = 20
+    HUMAN_HANDOFF_TIMEOUT_SECONDS: float = 5.0
+    # ElevenLabs voice that tells the caller when a transfer fails
+    HUMAN_HANDOFF_FALLBACK_VOICE_ID: str = "21m00Tcm4TlvDq8ikWAM"
     
     # ElevenLabs settings
     ELEVENLABS_API_KEY: str
     ELEVENLABS_AGENT_ID: str
+    ELEVENLABS_API_BASE_URL: str = ""
+    # Must match the agent's user input and agent output audio formats, e.g. pcm_16000;
+    # anything but ulaw_8000 is converted to and from Twilio's 8 kHz mu-law per call
+    ELEVENLABS_INPUT_AUDIO_FORMAT: str = "ulaw_8000"
+    ELEVENLABS_OUTPUT_AUDIO_FORMAT: str = "ulaw_8000"
+    ELEVENLABS_SESSION_POOL_SIZE: int = 0
+    ELEVENLABS_SIGNED_URL_MAX_AGE_SECONDS: float = 600.0
+    ELEVENLABS_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    ELEVENLABS_TIMEOUT_SECONDS: float = 10.0
     
     # Oystehr settings
     OYSTEHR_API_URL: str = "https://fhir-api.zapehr.com/r4b"
     OYSTEHR_AUTH_TOKEN: str
     OYSTEHR_PROJECT_ID: str
+    OYSTEHR_MAX_CONNECTIONS: int = 20
+    OYSTEHR_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    OYSTEHR_MAX_CONCURRENCY_PER_HOST: int = 10
+    OYSTEHR_TIMEOUT_SECONDS: float = 10.0
+    OYSTEHR_MAX_RETRIES: int = 3
+    OYSTEHR_RETRY_BACKOFF_SECONDS: float = 0.5
+    # Transaction Bundles for bookings and chained searches for reschedules, instead of one request per resource
+    OYSTEHR_BATCHED_REQUESTS: bool = True
+    # Key callers of POST /appointments/batch send in the X-API-Key header (empty disables the route)
+    APPOINTMENTS_API_KEY: str = ""
+    PATIENT_CACHE_MAX_ENTRIES: int = 10000
+    PATIENT_CACHE_TTL_SECONDS: float = 900.0
+    CALLER_PREFETCH_ENABLED: bool = True
+    
+    # Practice settings: IANA timezone appointments are booked in (empty uses the server timezone)
+    PRACTICE_TIMEZONE: str = ""
+    PRACTICE_OPEN_HOUR: int = 9
+    PRACTICE_CLOSE_HOUR: int = 17
+    PRACTICE_OPEN_WEEKDAYS: list[int] = [0, 1, 2, 3, 4]
+    APPOINTMENT_SLOT_MINUTES: int = 30
+    AVAILABILITY_REFRESH_SECONDS: float = 300.0
+    AVAILABILITY_LOAD_DAYS: int = 60
+    
+    # Tracing settings: JSONL file path (empty disables) and OpenTelemetry export
+    TRACE_JSONL_PATH: str = ""
+    TRACE_OTEL_ENABLED: bool = False
+    
+    # Call capture for replay (benchmarks/replay_call.py): one file per call in CALL_CAPTURE_DIR
+    # with the caller's audio, transcripts and patient records, so only enable it on test lines
+    # or where that data may be stored
+    CALL_CAPTURE_ENABLED: bool = False
+    CALL_CAPTURE_DIR: str = "call_captures"
+    
+    # Intent detection settings
+    INTENT_DETECTION_DEBOUNCE_SECONDS: float = 0.3
+    INTENT_CLASSIFIER_TIERED: bool = True
+    INTENT_LOCAL_MIN_MARGIN: float = 2.0
+    
+    # Prompt context settings: token budget for the transcript part of per-turn prompts
+    TRANSCRIPT_MAX_PROMPT_TOKENS: int = 1500
+    
+    # Incremental appointment slot extraction settings
+    SLOT_EXTRACTION_DEBOUNCE_SECONDS: float = 0.5
+    
+    # Post-call job queue settings
+    POST_CALL_QUEUE_PATH: str = "post_call_jobs.sqlite3"
+    POST_CALL_QUEUE_WORKERS: int = 4
+    POST_CALL_QUEUE_MAX_ATTEMPTS: int = 3
+    POST_CALL_QUEUE_RETRY_BACKOFF_SECONDS: float = 5.0
+    
+    # Post-call extraction: one LLM call for both the action and the details, or one call per function
+    COMBINED_POST_CALL_EXTRACTION: bool = True
+    
+    # Server settings: `python manage.py --production` runs SERVER_WORKERS processes without reload,
+    # each accepting at most SERVER_LIMIT_CONCURRENCY connections (0 is unlimited)
+    SERVER_HOST: str = "0.0.0.0"
+    SERVER_PORT: int = 5000
+    SERVER_WORKERS: int = 1
+    SERVER_LIMIT_CONCURRENCY: int = 0
+    
+    # Call state shared by the workers handling a call: memory (one process), sqlite (one host) or redis
+    CALL_STATE_BACKEND: str = "memory"
+    CALL_STATE_SQLITE_PATH: str = "call_state.sqlite3"
+    CALL_STATE_REDIS_URL: str = "redis://localhost:6379/0"
+    CALL_STATE_TTL_SECONDS: float = 14400.0
+    # How long a booking's claim on its slots outlives a worker that died before releasing it
+    SLOT_HOLD_TTL_SECONDS: float = 120.0
     
     class Config:
         env_file = ".env"
@@ -23,15 +23,15 @@ function_list = [
                             },
                             "phone_number": {
                                 "type": "string",
-                                "description": "Patient's phone number (XXX-XXX-XXXX)"
+                                "description": "Patient's phone number as the caller gave it"
                             },
                             "appointment_date": {
                                 "type": "string",
-                                "description": "Appointment date (YYYY-MM-DD)"
+                                "description": "Appointment date as the caller said it, e.g. 'next Tuesday' or 'March 14'"
                             },
                             "appointment_time": {
                                 "type": "string",
-                                "description": "Appointment time (HH:MM AM/PM)"
+                                "description": "Appointment time as the caller said it, e.g. '3:30 PM' or 'tomorrow morning'"
                             },
                             "notes": {
                                 "type": "string",
@@ -58,11 +58,11 @@ function_list = [
                     },
                     "rescheduled_appointment_date": {
                         "type": "string",
-                        "description": "Rescheduled appointment date (YYYY-MM-DD)"
+                        "description": "Rescheduled appointment date as the caller said it, e.g. 'next Tuesday' or 'March 14'"
                     },
                     "rescheduled_appointment_time": {
                         "type": "string",
-                        "description": "Rescheduled appointment time (HH:MM AM/PM)"
+                        "description": "Rescheduled appointment time as the caller said it, e.g. '3:30 PM'"
                     },
                 },
                 "required": ["name", "rescheduled_appointment_date", "rescheduled_appointment_time"]
@@ -94,6 +94,84 @@ function_list = [
                 "required": ["action_type", "reason", "existing_appointment_mentioned"]
             }
         }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "update_appointment_slots",
+            "description": "Update the appointment details collected so far with information from the newest conversation turns. Only include details that the new turns add or correct",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "patient_name": {
+                        "type": "string",
+                        "description": "Full name of the patient"
+                    },
+                    "phone_number": {
+                        "type": "string",
+                        "description": "Patient's phone number as the caller gave it"
+                    },
+                    "appointment_date": {
+                        "type": "string",
+                        "description": "Requested appointment date as the caller said it, e.g. 'next Tuesday'. For a reschedule, the new date"
+                    },
+                    "appointment_time": {
+                        "type": "string",
+                        "description": "Requested appointment time as the caller said it, e.g. '3:30 PM'. For a reschedule, the new time"
+                    },
+                    "notes": {
+                        "type": "string",
+                        "description": "Some notes about the appointment"
+                    }
+                }
+            }
+        }
+    },
+    {
+        "type": "function",
+        "function": {
+            "name": "extract_call_outcome",
+            "description": "Determine what the call needs (new appointment, rescheduling, or human handoff) and extract the appointment details for it in one pass",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "action_type": {
+                        "type": "string",
+                        "enum": ["new_appointment", "reschedule", "human_handoff"],
+                        "description": "The type of action needed based on the conversation"
+                    },
+                    "reason": {
+                        "type": "string",
+                        "description": "Explanation for the detected action type"
+                    },
+                    "has_appointment_info": {
+                        "type": "boolean",
+                        "description": "Whether the conversation contains enough details to book or reschedule the appointment"
+                    },
+                    "patient_name": {
+                        "type": "string",
+                        "description": "Full name of the patient"
+                    },
+                    "phone_number": {
+                        "type": "string",
+                        "description": "Patient's phone number as the caller gave it"
+                    },
+                    "appointment_date": {
+                        "type": "string",
+                        "description": "Requested appointment date as the caller said it, e.g. 'next Tuesday'. For a reschedule, the new date"
+                    },
+                    "appointment_time": {
+                        "type": "string",
+                        "description": "Requested appointment time as the caller said it, e.g. '3:30 PM'. For a reschedule, the new time"
+                    },
+                    "notes": {
+                        "type": "string",
+                        "description": "Some notes about the appointment"
+                    }
+                },
+                "required": ["action_type", "reason", "has_appointment_info"]
+            }
+        }
     }
 ]
 
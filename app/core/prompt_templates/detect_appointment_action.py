@@ -1,4 +1,8 @@
-detect_appointment_action_prompt = """
+from app.core.prompts import prompt_registry
+
+detect_appointment_action_prompt = prompt_registry.register(
+    "detect_appointment_action",
+    instructions="""
 As an AI assistant, analyze the conversation to determine if this is a new appointment request, a rescheduling request, or requires human handoff.
 
 Key Detection Criteria:
@@ -21,9 +25,11 @@ Key Detection Criteria:
    - No mention of existing appointments
    - General scheduling inquiries
 
-Conversation History:
-{conversation_history}
-
 Determine the appropriate action based on the conversation content.
 Remember: Only use human handoff when absolutely necessary. In most cases, you can simply tell the user to schedule or reschedule.
-"""
\ No newline at end of file
+""",
+    context="""
+Conversation History:
+{conversation_history}
+"""
+)
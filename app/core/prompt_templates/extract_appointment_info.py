@@ -1,4 +1,8 @@
-extract_appointment_info_prompt = """
+from app.core.prompts import prompt_registry
+
+extract_appointment_info_prompt = prompt_registry.register(
+    "extract_appointment_info",
+    instructions="""
 You are a medical office assistant. Extract appointment details from the conversation.
 appointment details include:
 - patient name
@@ -6,11 +10,13 @@ appointment details include:
 - appointment date and time
 - appointment notes
 
-The current date and time is:
-    {current_datetime}
-
+If the conversation history does not contain any appointment details, return None.
+""",
+    context="""
 Conversation History:
     {conversation_history}
 
-If the conversation history does not contain any appointment details, return None.
+The current date and time is:
+    {current_datetime}
 """
+)
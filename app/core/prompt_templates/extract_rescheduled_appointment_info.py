@@ -1,9 +1,15 @@
-extract_rescheduled_appointment_info_prompt = """
+from app.core.prompts import prompt_registry
+
+extract_rescheduled_appointment_info_prompt = prompt_registry.register(
+    "extract_rescheduled_appointment_info",
+    instructions="""
 Extract the patient's name and rescheduled appointment date and time from the conversation history.
+""",
+    context="""
+Conversation History:
+    {conversation_history}
 
 The current date and time is:
     {current_datetime}
-
-Conversation History:
-    {conversation_history}
-"""
\ No newline at end of file
+"""
+)
@@ -0,0 +1,25 @@
+from app.core.prompts import prompt_registry
+
+update_appointment_slots_prompt = prompt_registry.register(
+    "update_appointment_slots",
+    instructions="""
+You are a medical office assistant keeping track of appointment details while a call is in progress.
+appointment details include:
+- patient name
+- phone number
+- appointment date and time (for a reschedule, the new date and time)
+- appointment notes
+
+Only return the details that the new turns add or correct. Leave out anything the new turns do not mention.
+""",
+    context="""
+The current date and time is:
+    {current_datetime}
+
+Appointment details collected so far:
+    {current_slots}
+
+New conversation turns:
+    {new_turns}
+"""
+)
@@ -0,0 +1,68 @@
+import textwrap
+from string import Formatter
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
+
+class Prompt:
+    """A rendered prompt: the template's fixed instructions and this request's context."""
+
+    __slots__ = ("template", "context")
+
+    def __init__(self, template: "PromptTemplate", context: str):
+        self.template = template
+        self.context = context
+
+    def messages(self) -> list[BaseMessage]:
+        # The system message is shared by every request for this template, so the request
+        # starts with the same tokens each time and the provider can serve them from its cache
+        return [self.template.system_message, HumanMessage(self.context)]
+
+    def __str__(self) -> str:
+        return f"{self.template.instructions}\n\n{self.context}"
+
+class PromptTemplate:
+    """A prompt split into static `instructions` and a `context` template of volatile values.
+
+    OpenAI caches prompt prefixes: tools first, then messages in order. Keeping the
+    date, slots and transcript out of the instructions means every request for the same
+    function shares the tools and system message as a cacheable prefix. Compiled once: the
+    instructions are checked for placeholders and their system message is built up front.
+    """
+
+    def __init__(self, name: str, instructions: str, context: str):
+        self.name = name
+        self.instructions = textwrap.dedent(instructions).strip()
+        self.context = textwrap.dedent(context).strip()
+        if self.fields(self.instructions):
+            raise ValueError(f"Prompt {name!r} has placeholders in its instructions, move them to the context")
+        self.context_fields = self.fields(self.context)
+        self.system_message = SystemMessage(self.instructions)
+
+    @staticmethod
+    def fields(text: str) -> tuple[str, ...]:
+        return tuple(field for _, field, _, _ in Formatter().parse(text) if field)
+
+    def format(self, **values) -> Prompt:
+        missing = set(self.context_fields) - values.keys()
+        if missing:
+            raise KeyError(f"Prompt {self.name!r} is missing {', '.join(sorted(missing))}")
+        return Prompt(self, self.context.format(**values))
+
+class PromptRegistry:
+    """Every prompt template, by the name of the function it is sent with."""
+
+    def __init__(self):
+        self._templates: dict[str, PromptTemplate] = {}
+
+    def register(self, name: str, instructions: str, context: str) -> PromptTemplate:
+        if name in self._templates:
+            raise ValueError(f"Prompt {name!r} is already registered")
+        template = self._templates[name] = PromptTemplate(name, instructions, context)
+        return template
+
+    def get(self, name: str) -> PromptTemplate:
+        return self._templates[name]
+
+    def __iter__(self):
+        return iter(self._templates.values())
+
+prompt_registry = PromptRegistry()
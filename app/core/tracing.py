@@ -0,0 +1,157 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+
+class CallTrace:
+    """Per-call trace state. The CallSid is filled in once Twilio's start event arrives."""
+
+    def __init__(self, call_sid: Optional[str] = None):
+        self.call_sid = call_sid
+
+_current_call: ContextVar[Optional[CallTrace]] = ContextVar("current_call", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+class Span:
+    def __init__(self, tracer: "Tracer", name: str, attributes: dict):
+        parent = _current_span.get()
+        self.tracer = tracer
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.call = _current_call.get()
+        self.attributes = attributes
+        self.status = "ok"
+        self.start_time = time.time()
+        self.end_time: Optional[float] = None
+        self._start_perf = time.perf_counter()
+        self.duration: Optional[float] = None
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: dict):
+        self.attributes.update(attributes)
+
+    def set_error(self, error: BaseException):
+        self.status = "error"
+        self.attributes["error"] = f"{type(error).__name__}: {error}"
+
+    def end(self):
+        if self.end_time is not None:
+            return
+        self.duration = time.perf_counter() - self._start_perf
+        self.end_time = self.start_time + self.duration
+        self.tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "call_sid": self.call.call_sid if self.call else None,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start_time,
+            "end": self.end_time,
+            "duration_ms": round(self.duration * 1000, 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+class JsonlSpanExporter:
+    """Append finished spans to a local JSONL file, one span per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+class OpenTelemetrySpanExporter:
+    """Re-emit finished spans through the OpenTelemetry API.
+
+    Configure the OpenTelemetry SDK and exporter (e.g. OTLP) the usual way; without an SDK
+    installed this is a no-op.
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._tracer = trace.get_tracer("medical-voice-agent")
+
+    def export(self, span: Span):
+        data = span.to_dict()
+        attributes = {
+            key: value if isinstance(value, (str, bool, int, float)) else json.dumps(value, default=str)
+            for key, value in span.attributes.items() if value is not None
+        }
+        attributes.update({"call_sid": data["call_sid"] or "", "span_id": span.span_id, "parent_id": span.parent_id or ""})
+        otel_span = self._tracer.start_span(span.name, start_time=int(span.start_time * 1e9), attributes=attributes)
+        if span.status == "error":
+            from opentelemetry.trace import Status, StatusCode
+            otel_span.set_status(Status(StatusCode.ERROR, span.attributes.get("error")))
+        otel_span.end(end_time=int(span.end_time * 1e9))
+
+class Tracer:
+    """Latency spans keyed by CallSid, exported to any configured exporters."""
+
+    def __init__(self, exporters: Optional[list] = None):
+        self.exporters = exporters or []
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def bind_call(self, call_sid: Optional[str] = None) -> CallTrace:
+        """Attach a call to the current context; tasks and threads started from it inherit it."""
+        call = CallTrace(call_sid)
+        _current_call.set(call)
+        return call
+
+    def current_call(self) -> Optional[CallTrace]:
+        return _current_call.get()
+
+    def start_span(self, name: str, **attributes) -> Span:
+        """Start a span that is ended explicitly. It does not become the parent of other spans."""
+        return Span(self, name, attributes)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(self, name, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end()
+
+    def export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                logger.error(f"Error exporting span {span.name}: {e}")
+
+def _configure_exporters() -> list:
+    exporters = []
+    if settings.TRACE_JSONL_PATH:
+        exporters.append(JsonlSpanExporter(settings.TRACE_JSONL_PATH))
+    if settings.TRACE_OTEL_ENABLED:
+        try:
+            exporters.append(OpenTelemetrySpanExporter())
+        except ImportError:
+            logger.error("TRACE_OTEL_ENABLED is set but opentelemetry-api is not installed")
+    return exporters
+
+tracer = Tracer(_configure_exporters())
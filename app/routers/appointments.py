@@ -0,0 +1,34 @@
+import secrets
+from fastapi import APIRouter, Depends, Header, HTTPException
+from fastapi.responses import JSONResponse
+
+from app.core.config import settings
+from app.schemas.appointment import Appointment
+from app.services.appointment import AppointmentService
+from app.utils.normalization import normalize_phone_number, practice_timezone
+
+router = APIRouter()
+
+appointment_service = AppointmentService()
+
+def require_api_key(x_api_key: str = Header("")):
+    """Only let callers holding APPOINTMENTS_API_KEY in; without a key configured, nobody."""
+    if not settings.APPOINTMENTS_API_KEY:
+        raise HTTPException(status_code=403, detail="APPOINTMENTS_API_KEY is not set")
+    if not secrets.compare_digest(x_api_key.encode(), settings.APPOINTMENTS_API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+@router.post("/appointments/batch", dependencies=[Depends(require_api_key)])
+async def create_appointments(appointments: list[Appointment]):
+    """Book many appointments at once (e.g. when replaying calls that failed to book) in one
+    Oystehr transaction. Returns whether each was booked, in request order."""
+    for appointment in appointments:
+        phone_number = normalize_phone_number(appointment.phone_number)
+        if phone_number is None:
+            return JSONResponse({"error": f"Could not parse phone number {appointment.phone_number!r}"}, status_code=400)
+        appointment.phone_number = phone_number
+        if appointment.datetime.tzinfo is None:
+            appointment.datetime = appointment.datetime.replace(tzinfo=practice_timezone())
+
+    booked = await appointment_service.schedule_appointments(appointments)
+    return {"booked": booked}
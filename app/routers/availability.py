@@ -0,0 +1,40 @@
+from datetime import datetime, time
+from typing import Optional
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+
+from app.services.availability import DEFAULT_PROVIDER, availability_index
+from app.utils.normalization import now_in_practice, parse_date, parse_datetime, practice_timezone
+
+router = APIRouter()
+
+def _spoken(slot: datetime) -> str:
+    return slot.strftime("%A, %B %d at %I:%M %p")
+
+@router.get("/availability")
+async def get_availability(date: str, time_of_day: Optional[str] = None, count: int = 3, provider: str = DEFAULT_PROVIDER):
+    """Check a requested time and offer the next free slots, answered from the local index.
+
+    Meant to be registered as a server tool of the ElevenLabs agent; `date` and `time_of_day`
+    take what the caller said ("next Tuesday", "3 PM").
+    """
+    requested = parse_datetime(date, time_of_day) if time_of_day else None
+    if requested is None:
+        requested_date = parse_date(date)
+        if requested_date is None:
+            return JSONResponse({"error": f"Could not understand the date {date!r}"}, status_code=400)
+        search_from = datetime.combine(requested_date, time(0), tzinfo=practice_timezone())
+    else:
+        search_from = requested
+    search_from = max(search_from, now_in_practice())
+
+    available = None
+    if requested is not None:
+        available = availability_index.is_open(requested) and availability_index.is_free(requested, provider=provider)
+    next_free = [] if available else availability_index.next_free_slots(search_from, count, provider)
+    return {
+        "requested": requested.isoformat() if requested else None,
+        "available": available,
+        "next_free": [slot.isoformat() for slot in next_free],
+        "next_free_spoken": [_spoken(slot) for slot in next_free],
+    }
@@ -1,27 +1,36 @@
+import asyncio
 import json
+import time
 import traceback
-import asyncio
+from typing import Optional
 from fastapi import APIRouter, Request, WebSocket
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response
 from langchain_core.messages import AIMessage, HumanMessage
 from langchain_community.chat_message_histories import ChatMessageHistory
+from twilio.request_validator import RequestValidator
 from twilio.twiml.voice_response import VoiceResponse, Connect
-from twilio.rest import Client
-from elevenlabs import ElevenLabs
-from elevenlabs.conversational_ai.conversation import Conversation
 from starlette.websockets import WebSocketDisconnect
 
 from app.services.twilio_audio_interface import TwilioAudioInterface
-from app.services.appointment import AppointmentService
+from app.services.twilio_media_codec import extract_media_payload
+from app.services.call_capture import RecordKind, start_capture
+from app.services.call_context import call_contexts
+from app.services.call_state import call_state
+from app.services.elevenlabs_sessions import create_conversation, synthesize_speech
+from app.services.intent_detection import IntentDetectionWorker
+from app.services.post_call import enqueue_post_call_job
+from app.services.slot_extraction import IncrementalSlotExtractor
+from app.services.twilio_sms import sms_dispatcher
+from app.services.warm_transfer import TRANSFER_FAILED_MESSAGE, warm_transfer_service
+from app.utils.normalization import now_in_practice
+from app.utils.transcript_context import TranscriptContext
 from app.core.config import settings
 from app.core.logger import logger
-from app.utils.utils import format_conversation_history
-from app.utils.function_call import function_call
-from app.core.prompt_templates.detect_appointment_action import detect_appointment_action_prompt
+from app.core.tracing import tracer
 
 router = APIRouter()
 
-appointment_service = AppointmentService()
+twilio_request_validator = RequestValidator(settings.TWILIO_AUTH_TOKEN)
 
 def handle_agent_response(conversation_history: ChatMessageHistory, text: str):
     conversation_history.add_ai_message(AIMessage(content=text))
@@ -31,80 +40,50 @@ def handle_user_transcript(conversation_history: ChatMessageHistory, text: str):
     conversation_history.add_user_message(HumanMessage(content=text))
     logger.info(f"User: {text}")
 
-async def warm_transfer_to_human_services(websocket: WebSocket):
+async def warm_transfer_to_human_services(call_sid: Optional[str], status_callback_url: str) -> bool:
+    """Move the caller into a conference and ring the staff ring group into it.
+
+    Everything it needs comes from the call state store, so any worker can run it; the
+    `transferred` claim makes sure only one of them does. Returns False if the transfer
+    failed and the caller is still on the media stream.
+    """
     try:
-        # Get the call SID from the websocket
-        call_sid = getattr(websocket, "call_sid", None)
         if not call_sid:
             logger.error("Error: No call SID available for transfer")
-            return
-            
-        # TODO: Inform the caller
-        await websocket.send_json({
-            "event": "message",
-            "message": "We've detected a potential human service. Transferring you to a human. Please stay on the line."
-        })
-        
-        client = Client(
-            settings.TWILIO_ACCOUNT_SID,
-            settings.TWILIO_AUTH_TOKEN
-        )
-        
-        # Create a conference for the warm transfer
-        conference_name = f"human_handoff_{call_sid}"
-        
-        # Update the call to join the conference
-        client.calls(call_sid).update(
-            twiml=f'<Response><Dial><Conference>{conference_name}</Conference></Dial></Response>'
-        )
-        
-        # Get the emergency reason to send to medical services
-        emergency_reason = getattr(websocket, "human_handoff_text", "Potential human handoff")
-        
-        # TODO: Configure this in your settings
-        human_handoff_number = '+19095767898'
-        
-        # Create TwiML that first plays a message explaining the situation before joining the conference
-        twiml = f"""
-        <Response>
-            <Say>This is an automated transfer from an AI assistant that has detected a potential human service.</Say>
-            <Pause length="1"/>
-            <Say>The caller reported: {emergency_reason}</Say>
-            <Pause length="1"/>
-            <Say>You will now be connected to the caller. Please provide assistance.</Say>
-            <Dial>
-                <Conference>{conference_name}</Conference>
-            </Dial>
-        </Response>
-        """
-        
-        client.calls.create(
-            to=human_handoff_number,
-            from_=settings.TWILIO_PHONE_NUMBER,
-            twiml=twiml
+            return False
+        if not await call_state.claim(call_sid, "transferred"):
+            logger.info(f"Call {call_sid} is already being transferred")
+            return True
+        state = await call_state.get(call_sid)
+        return await warm_transfer_service.transfer(
+            call_sid,
+            reason=state.get("human_handoff_reason") or "Potential human handoff",
+            detected_at=state.get("human_handoff_detected_at") or time.time(),
+            status_callback_url=status_callback_url
         )
-        
-        logger.info(f"Call transferred to human handoff. Conference: {conference_name}")
-        
     except Exception as e:
-        logger.info(f"Error transferring call to human handoff: {str(e)}")
+        logger.error(f"Error transferring call to human handoff: {str(e)}")
         traceback.print_exc()
+        return False
 
-async def detect_conversation_action(conversation_history: ChatMessageHistory) -> dict:
-    """Detect whether the conversation requires new appointment, rescheduling, or human handoff."""
+async def tell_caller(audio_interface: TwilioAudioInterface, text: str):
+    """Say `text` to the caller over the media stream, outside the agent's conversation."""
     try:
-        result = function_call(
-            detect_appointment_action_prompt.format(
-                conversation_history=format_conversation_history(conversation_history)
-            ),
-            "detect_appointment_action"
-        )
-        logger.info(f"Conversation action detected: {result['action_type']}")
-        return result
+        audio = await asyncio.to_thread(synthesize_speech, text, settings.HUMAN_HANDOFF_FALLBACK_VOICE_ID)
+        # output() blocks while the outbound queue is full, which must not stall the event loop
+        await asyncio.to_thread(audio_interface.output, audio)
     except Exception as e:
-        logger.error(f"Error in conversation action detection: {str(e)}")
-        traceback.print_exc()
-        return {"action_type": "new_appointment", "reason": "Error in detection", "existing_appointment_mentioned": False}
+        logger.error(f"Could not tell the caller {text!r}: {e}")
+
+async def signed_twilio_form(request: Request):
+    """The form of a Twilio callback, or None if it is not signed with our auth token."""
+    form_data = await request.form()
+    # Twilio signs the https URL it was given; TLS usually ends at a proxy in front of the app
+    url = str(request.url.replace(scheme="https"))
+    if not twilio_request_validator.validate(url, dict(form_data), request.headers.get("X-Twilio-Signature", "")):
+        logger.warning(f"Rejected a callback to {request.url.path} without a valid Twilio signature")
+        return None
+    return form_data
 
 @router.post("/twilio/inbound_call")
 async def handle_incoming_call(request: Request):
@@ -112,85 +91,165 @@ async def handle_incoming_call(request: Request):
     call_sid = form_data.get("CallSid", "Unknown")
     from_number = form_data.get("From", "Unknown")
     logger.info(f"Incoming call: CallSid={call_sid}, From={from_number}")
+    tracer.bind_call(call_sid)
+
+    with tracer.span("twilio.inbound_call"):
+        if call_sid != "Unknown":
+            await call_state.update(call_sid, {"from_number": from_number})
+        # Look the caller up while the greeting plays
+        if settings.CALLER_PREFETCH_ENABLED and call_sid != "Unknown" and from_number != "Unknown":
+            call_contexts.start_prefetch(call_sid, from_number)
 
-    response = VoiceResponse()
-    connect = Connect()
-    connect.stream(url=f"wss://{request.url.hostname}/media-stream")
-    response.append(connect)
+        response = VoiceResponse()
+        connect = Connect()
+        connect.stream(url=f"wss://{request.url.hostname}/media-stream")
+        response.append(connect)
     return HTMLResponse(content=str(response), media_type="application/xml")
 
+@router.post("/twilio/sms_status")
+async def handle_sms_status(request: Request):
+    """Delivery status callback for confirmation SMS (set SMS_STATUS_CALLBACK_URL to this route)."""
+    form_data = await signed_twilio_form(request)
+    if form_data is None:
+        return Response(status_code=403)
+    sms_dispatcher.record_status(form_data.get("MessageSid"), form_data.get("MessageStatus"), form_data.get("ErrorCode"))
+    return Response(status_code=204)
+
+@router.post("/twilio/handoff_status")
+async def handle_handoff_status(request: Request):
+    """Status callbacks of the staff legs of a warm transfer and of their conference."""
+    form_data = await signed_twilio_form(request)
+    if form_data is None:
+        return Response(status_code=403)
+    await warm_transfer_service.handle_status(request.query_params.get("call_sid"), form_data)
+    return Response(status_code=204)
+
 @router.websocket("/media-stream")
 async def handle_media_stream(websocket: WebSocket):
     await websocket.accept()
     logger.info("WebSocket connection opened")
 
+    # Bound before anything else starts so the workers, tasks and threads below inherit it;
+    # the CallSid is filled in from Twilio's start event
+    call_trace = tracer.bind_call()
+    capture = start_capture()
+    stream_span = tracer.start_span("twilio.media_stream")
     audio_interface = TwilioAudioInterface(websocket)
-    eleven_labs_client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
+    conversation = None
     conversation_history = ChatMessageHistory()
-    action_needed = {"human_handoff": False, "reschedule_requested": False}
+    action_needed = {"action_type": None, "human_handoff": False, "reschedule_requested": False}
+    call_sid = None
     call_transferred = False
+    transfer_failed = False
+    call_started_at = now_in_practice()
+
+    async def publish_action(action: dict):
+        action_needed["action_type"] = action["action_type"]
+        fields = {}
+        if action["action_type"] == "human_handoff":
+            logger.info(f"HUMAN HANDOFF DETECTED: {action['reason']}")
+            action_needed["human_handoff"] = True
+            fields["human_handoff_reason"] = action["reason"]
+            fields["human_handoff_detected_at"] = time.time()
+        elif action["action_type"] == "reschedule":
+            logger.info(f"RESCHEDULE DETECTED: {action['reason']}")
+            action_needed["reschedule_requested"] = True
+            fields["reschedule_reason"] = action["reason"]
+        # Shared so that other workers (e.g. the one running the transfer) see the detected action
+        if call_sid:
+            await call_state.update(call_sid, {"action": action_needed, **fields})
+
+    slot_extractor = IncrementalSlotExtractor(conversation_history)
+    # Long calls are trimmed to recent turns plus the details already confirmed
+    transcript_context = TranscriptContext(
+        conversation_history,
+        summary=lambda: {**slot_extractor.slots, "detected_action": action_needed["action_type"]}
+    )
+    intent_worker = IntentDetectionWorker(conversation_history, publish_action, context=transcript_context)
+
+    def user_transcript_callback(text):
+        # Runs on the ElevenLabs thread: record the transcript and hand the work to the background workers
+        handle_user_transcript(conversation_history, text)
+        if capture:
+            capture.record_text(RecordKind.USER_TRANSCRIPT, text)
+        intent_worker.notify()
+        slot_extractor.notify()
 
-    # Create a simpler callback that just checks and logs
-    def user_followup_callback(conversation_history, websocket):
-        def enhanced_callback(text):
-            # Call the original callback
-            handle_user_transcript(conversation_history, text)
-            
-            # Check conversation action
-            action = asyncio.run(detect_conversation_action(conversation_history))
-            
-            if action["action_type"] == "human_handoff":
-                logger.info(f"HUMAN HANDOFF DETECTED: {action['reason']}")
-                action_needed["human_handoff"] = True
-                websocket.human_handoff_text = action["reason"]
-            elif action["action_type"] == "reschedule":
-                logger.info(f"RESCHEDULE DETECTED: {action['reason']}")
-                action_needed["reschedule_requested"] = True
-                websocket.reschedule_reason = action["reason"]
-        
-        return enhanced_callback
+    def agent_response_callback(text):
+        handle_agent_response(conversation_history, text)
+        if capture:
+            capture.record_text(RecordKind.AGENT_RESPONSE, text)
 
     try:
-        websocket.stream_sid = None
-        websocket.human_handoff_text = None
-        websocket.reschedule_reason = None
-
-        conversation = Conversation(
-            client=eleven_labs_client,
-            agent_id=settings.ELEVENLABS_AGENT_ID,
-            requires_auth=True, # Security > Enable authentication
-            audio_interface=audio_interface,
-            callback_agent_response=lambda text: handle_agent_response(conversation_history, text),
-            callback_user_transcript=user_followup_callback(conversation_history, websocket),
+        conversation = create_conversation(
+            audio_interface,
+            callback_agent_response=agent_response_callback,
+            callback_user_transcript=user_transcript_callback,
         )
 
-        conversation.start_session()
-        logger.info("Conversation started")
+        # Without a pooled signed URL this makes an HTTP round trip, keep it off the event loop
+        session_started_at = time.monotonic()
+        with tracer.span("elevenlabs.start_session") as span:
+            await asyncio.to_thread(conversation.start_session)
+            span.set_attribute("pooled_signed_url", conversation.used_pooled_url)
+        logger.info(
+            f"Conversation started in {(time.monotonic() - session_started_at) * 1000:.0f}ms "
+            f"(pooled signed URL: {conversation.used_pooled_url})"
+        )
 
         async for message in websocket.iter_text():
             if not message:
                 continue
             try:
-                data = json.loads(message)
+                # Media frames are the hot path: decode the audio without building a dict
+                audio = extract_media_payload(message)
+                data = json.loads(message) if audio is None else {}
+                if capture:
+                    if audio is not None:
+                        capture.record(RecordKind.INBOUND_AUDIO, audio)
+                    else:
+                        capture.record_text(RecordKind.TWILIO_EVENT, message)
 
                 # Store the stream SID when it's received in the start event
                 if data.get("event") == "start" and "start" in data:
-                    websocket.stream_sid = data["start"].get("streamSid")
-                    websocket.call_sid = data["start"].get("callSid")
-                    logger.info(f"Stored stream SID: {websocket.stream_sid}")
-                    logger.info(f"Stored call SID: {websocket.call_sid}")
+                    stream_sid = data["start"].get("streamSid")
+                    call_sid = data["start"].get("callSid")
+                    call_trace.call_sid = call_sid
+                    if capture and call_sid:
+                        capture.attach(call_sid)
+                    logger.info(f"Stored stream SID: {stream_sid}")
+                    logger.info(f"Stored call SID: {call_sid}")
+                    if call_sid:
+                        await call_state.update(call_sid, {"stream_sid": stream_sid, "action": action_needed})
+                    call_context = await call_contexts.get(call_sid)
+                    if call_context and call_context["patient"]:
+                        logger.info(f"Returning patient: {call_context['patient']['id']}")
                 elif data.get("event") == "stop" and "stop" in data:
-                    if action_needed["reschedule_requested"]:
-                        await appointment_service.reschedule_appointment(conversation_history)
-                    else:
-                        await appointment_service.schedule_appointment(conversation_history)
+                    if capture:
+                        # The post-call job appends to the same capture
+                        capture.flush()
+                    await enqueue_post_call_job(
+                        call_sid,
+                        conversation_history,
+                        action_needed,
+                        intent_worker,
+                        slot_extractor,
+                        call_started_at
+                    )
 
                 # Check for human handoff or handle the message
                 if action_needed["human_handoff"] and not call_transferred:
                     call_transferred = True
-                    await warm_transfer_to_human_services(websocket)
-                elif not action_needed["human_handoff"]:
-                    await audio_interface.handle_twilio_message(data)
+                    # The caller is told they are being transferred by the TwiML the transfer redirects them to
+                    if not await warm_transfer_to_human_services(call_sid, f"https://{websocket.url.hostname}/twilio/handoff_status"):
+                        # The caller is still here: keep the agent on the line and point them to emergency services
+                        transfer_failed = True
+                        await tell_caller(audio_interface, TRANSFER_FAILED_MESSAGE)
+                elif not action_needed["human_handoff"] or transfer_failed:
+                    if audio is not None:
+                        audio_interface.handle_media(audio)
+                    else:
+                        await audio_interface.handle_twilio_message(data)
                 
             except Exception as e:
                 logger.error(f"Error processing message: {e}")
@@ -198,18 +257,41 @@ async def handle_media_stream(websocket: WebSocket):
 
     except WebSocketDisconnect:
         logger.info("WebSocket disconnected")
-        # Process conversation after disconnect
-        if not action_needed["human_handoff"]:
-            await appointment_service.schedule_appointment(conversation_history)
+        # Queue the conversation for processing; a no-op if the stop event already did
+        await enqueue_post_call_job(
+            call_sid,
+            conversation_history,
+            action_needed,
+            intent_worker,
+            slot_extractor,
+            call_started_at
+        )
 
     except Exception:
         logger.error("Error occurred in WebSocket handler:")
         traceback.print_exc()
     finally:
+        await audio_interface.close()
+        intent_worker.close()
+        slot_extractor.close()
+        call_contexts.cancel(call_sid)
+        if call_sid:
+            await call_state.delete(call_sid)
+        if capture:
+            capture.close()
+            if capture.path:
+                logger.info(f"Call captured to {capture.path}")
+        time_to_first_audio = audio_interface.time_to_first_audio()
+        if time_to_first_audio is not None:
+            logger.info(f"Time to first agent audio: {time_to_first_audio * 1000:.0f}ms")
+            stream_span.set_attribute("time_to_first_audio_ms", round(time_to_first_audio * 1000, 1))
+        stream_span.set_attributes({"turns": len(conversation_history.messages), **action_needed})
+        stream_span.end()
         try:
-            conversation.end_session()
-            conversation.wait_for_session_end()
-            logger.info("Conversation ended")
+            if conversation is not None:
+                conversation.end_session()
+                await asyncio.to_thread(conversation.wait_for_session_end)
+                logger.info("Conversation ended")
         except Exception:
             logger.error("Error ending conversation session:")
             traceback.print_exc()
\ No newline at end of file
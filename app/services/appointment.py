@@ -1,58 +1,113 @@
+from datetime import datetime
 from langchain_community.chat_message_histories import ChatMessageHistory
 from typing import Optional
-from datetime import datetime
 
 from app.schemas.appointment import Appointment
 from app.core.logger import logger
 from app.core.prompt_templates.extract_appointment_info import extract_appointment_info_prompt
+from app.core.prompt_templates.extract_call_outcome import extract_call_outcome_prompt
 from app.core.prompt_templates.extract_rescheduled_appointment_info import extract_rescheduled_appointment_info_prompt
-from app.utils.function_call import function_call
+from app.utils.function_call import afunction_call
+from app.utils.normalization import normalize_phone_number, parse_datetime
 from app.utils.utils import format_conversation_history, get_current_datetime
+from app.services.job_queue import PermanentJobError
 from app.services.twilio_sms import SMSService
-from app.services.oystehr import OystehrService
+from app.services.oystehr import OystehrService, SlotUnavailableError
 
 class AppointmentService:
     def __init__(self):
         self.sms_service = SMSService()
         self.oystehr_service = OystehrService()
 
-    def extract_appointment_details(self, conversation_history: ChatMessageHistory) -> Optional[Appointment]:
-        """Extract appointment details from conversation text using OpenAI function calling."""
-        try:
-            extracted_info = function_call(extract_appointment_info_prompt.format(conversation_history=format_conversation_history(conversation_history), current_datetime=get_current_datetime()), "extract_appointment_info")
-
-            # Extract the function call arguments
-            if extracted_info["has_appointment_info"]:
-                # Parse the datetime
-                date_time_str = f"{extracted_info["appointment_details"]["appointment_date"]} {extracted_info["appointment_details"]["appointment_time"]}"
-                appointment_datetime = datetime.strptime(date_time_str, "%Y-%m-%d %I:%M %p")
-
-                # Create and return the appointment
-                return Appointment(
-                    patient_name=extracted_info["appointment_details"]["patient_name"],
-                    phone_number=extracted_info["appointment_details"]["phone_number"].replace("-", " "),
-                    datetime=appointment_datetime
-                )
-            
-            return None
+    @staticmethod
+    def build_appointment(details: dict, now: Optional[datetime] = None) -> Appointment:
+        """Build an appointment from extracted details, resolving the date, time and phone number
+        locally, relative dates against `now` (the call's start). Raises ValueError if any of them
+        cannot be resolved."""
+        appointment_datetime = parse_datetime(details["appointment_date"], details.get("appointment_time"), now)
+        if appointment_datetime is None:
+            raise ValueError(f"Could not resolve appointment time from {details['appointment_date']!r} {details.get('appointment_time')!r}")
+        phone_number = normalize_phone_number(details["phone_number"])
+        if phone_number is None:
+            raise ValueError(f"Could not parse phone number {details['phone_number']!r}")
 
-        except Exception as e:
-            logger.error(f"Error extracting appointment details: {e}")
-            return None
+        return Appointment(
+            patient_name=details["patient_name"],
+            phone_number=phone_number,
+            datetime=appointment_datetime,
+            notes=details.get("notes") or None
+        )
+
+    async def extract_appointment_details(self, conversation_history: ChatMessageHistory, now: Optional[datetime] = None) -> Optional[Appointment]:
+        """Extract appointment details from conversation text using OpenAI function calling.
+
+        Returns None if the call has nothing to book; raises if the extraction fails or its details are unusable.
+        """
+        extracted_info = await afunction_call(extract_appointment_info_prompt.format(conversation_history=format_conversation_history(conversation_history), current_datetime=get_current_datetime(now)), "extract_appointment_info")
+
+        # Extract the function call arguments
+        if extracted_info["has_appointment_info"]:
+            return self.build_appointment(extracted_info["appointment_details"], now)
+
+        return None
     
-    def extract_rescheduled_appointment_info(self, conversation_history: ChatMessageHistory):
+    async def extract_rescheduled_appointment_info(self, conversation_history: ChatMessageHistory, now: Optional[datetime] = None):
         """Extract patient name and rescheduled appointment date and time from conversation text using OpenAI function calling."""
         try:
-            extracted_info = function_call(extract_rescheduled_appointment_info_prompt.format(conversation_history=format_conversation_history(conversation_history), current_datetime=get_current_datetime()), "extract_rescheduled_appointment_info")
+            extracted_info = await afunction_call(extract_rescheduled_appointment_info_prompt.format(conversation_history=format_conversation_history(conversation_history), current_datetime=get_current_datetime(now)), "extract_rescheduled_appointment_info")
             return extracted_info
         except Exception as e:
             logger.error(f"Error extracting name: {e}")
             return None
     
-    async def schedule_appointment(self, conversation_history: ChatMessageHistory):
+    async def extract_call_outcome(self, conversation_history: ChatMessageHistory, now: Optional[datetime] = None) -> Optional[dict]:
+        """Detect the action and extract the appointment details in a single function call."""
+        try:
+            return await afunction_call(extract_call_outcome_prompt.format(conversation_history=format_conversation_history(conversation_history), current_datetime=get_current_datetime(now)), "extract_call_outcome")
+        except Exception as e:
+            logger.error(f"Error extracting call outcome: {e}")
+            return None
+
+    async def handle_call_outcome(
+        self,
+        conversation_history: ChatMessageHistory,
+        outcome: dict,
+        patient_context: Optional[dict] = None,
+        now: Optional[datetime] = None
+    ):
+        """Run the workflow chosen by `extract_call_outcome`, using the details it extracted."""
+        if outcome["action_type"] == "human_handoff":
+            logger.info(f"Call needs staff follow-up, skipping booking: {outcome.get('reason')}")
+            return True
+        if outcome["action_type"] == "reschedule":
+            return await self.reschedule_appointment(conversation_history, outcome, patient_context, now)
+
+        if not outcome.get("has_appointment_info"):
+            logger.info("No appointment details could be extracted from conversation")
+            return True
+        try:
+            appointment = self.build_appointment(outcome, now)
+        except (ValueError, KeyError) as e:
+            raise PermanentJobError(f"Unusable appointment details in call outcome: {e}") from e
+        return await self.schedule_appointment(conversation_history, appointment, now)
+
+    async def schedule_appointment(
+        self,
+        conversation_history: ChatMessageHistory,
+        appointment: Optional[Appointment] = None,
+        now: Optional[datetime] = None
+    ):
+        """Book the appointment, extracting it from the transcript unless it was already assembled during the call.
+
+        Returns True if there is nothing to book, and raises PermanentJobError if it can never be booked.
+        """
         logger.info(f"Scheduling appointment...")
-        appointment = self.extract_appointment_details(conversation_history)
-        
+        if appointment is None:
+            try:
+                appointment = await self.extract_appointment_details(conversation_history, now)
+            except (ValueError, KeyError) as e:
+                raise PermanentJobError(f"Unusable appointment details in conversation: {e}") from e
+
         if appointment:
             try:
                 # Create appointment in Oystehr
@@ -61,17 +116,38 @@ class AppointmentService:
                     appointment_details = self.format_appointment_details(appointment)
                     await self.sms_service.send_confirmation(
                         appointment.phone_number,
-                        appointment_details
+                        appointment_details,
+                        dedupe_key=self.confirmation_key(appointment)
                     )
-                    logger.info(f"SMS confirmation sent to {appointment.phone_number}")
+                    logger.info(f"SMS confirmation queued for {appointment.phone_number}")
                     return True
                 return False
+            except SlotUnavailableError as e:
+                raise PermanentJobError(str(e)) from e
             except Exception as e:
                 logger.error(f"Error in appointment scheduling workflow: {e}")
                 return False
         else:
             logger.info("No appointment details could be extracted from conversation")
-            return False
+            return True
+
+    async def schedule_appointments(self, appointments: list[Appointment]) -> list[bool]:
+        """Book many appointments in one Oystehr transaction and confirm each booked one by SMS."""
+        logger.info(f"Scheduling {len(appointments)} appointments...")
+        booked = await self.oystehr_service.create_appointments(appointments)
+        for appointment, success in zip(appointments, booked):
+            if success:
+                await self.sms_service.send_confirmation(
+                    appointment.phone_number,
+                    self.format_appointment_details(appointment),
+                    dedupe_key=self.confirmation_key(appointment)
+                )
+        return booked
+
+    @staticmethod
+    def confirmation_key(appointment: Appointment, kind: str = "confirmation") -> str:
+        """Identifies one appointment's confirmation, so a retried job doesn't text the patient twice."""
+        return f"{kind}:{appointment.phone_number}:{appointment.datetime.isoformat()}"
 
     @staticmethod
     def format_appointment_details(appointment: Appointment) -> str:
@@ -83,34 +159,66 @@ class AppointmentService:
             f"Time: {appointment.datetime.strftime('%I:%M %p')}\n"
         )
 
-    async def reschedule_appointment(self, conversation_history: ChatMessageHistory):
-        """Handle appointment rescheduling workflow."""
+    async def reschedule_appointment(
+        self,
+        conversation_history: ChatMessageHistory,
+        slots: Optional[dict] = None,
+        patient_context: Optional[dict] = None,
+        now: Optional[datetime] = None
+    ):
+        """Handle appointment rescheduling workflow.
+
+        `patient_context` is the caller-ID prefetch for this call; it is used when the
+        extracted name matches the caller's record, saving the EHR lookups. Relative dates
+        are resolved against `now`, the call's start.
+        """
         logger.info("Processing rescheduling request...")
         
-        # Extract patient name and rescheduled appointment date and time
-        rescheduled_appointment_info = self.extract_rescheduled_appointment_info(conversation_history)
+        # Extract patient name and rescheduled appointment date and time, unless collected during the call
+        if slots and all(slots.get(name) for name in ("patient_name", "appointment_date", "appointment_time")):
+            rescheduled_appointment_info = {
+                "name": slots["patient_name"],
+                "rescheduled_appointment_date": slots["appointment_date"],
+                "rescheduled_appointment_time": slots["appointment_time"]
+            }
+        else:
+            rescheduled_appointment_info = await self.extract_rescheduled_appointment_info(conversation_history, now)
         if not rescheduled_appointment_info:
             logger.error("Could not extract patient name and rescheduled appointment date and time")
             return False
 
         try:
-            # Search for existing patient
-            patient = await self.oystehr_service.search_patient(rescheduled_appointment_info["name"])
+            known_patient = patient_context.get("patient") if patient_context else None
+            if known_patient and self.oystehr_service.patient_has_name(known_patient, rescheduled_appointment_info["name"]):
+                patient = known_patient
+                existing_appointment = patient_context["schedules"][0] if patient_context["schedules"] else None
+            else:
+                # Search for the existing patient and their appointment
+                patient, existing_appointment = await self.oystehr_service.search_patient_appointment(rescheduled_appointment_info["name"])
             if not patient:
                 logger.error("Could not find existing patient for rescheduling")
                 return False
 
             # Get existing appointment
-            existing_appointment = await self.oystehr_service.search_appointment(patient["id"])
+            if not existing_appointment:
+                existing_appointment = await self.oystehr_service.search_appointment(patient["id"])
             if not existing_appointment:
                 logger.error("Could not find existing appointment for rescheduling")
                 return False
 
+            new_datetime = parse_datetime(
+                rescheduled_appointment_info["rescheduled_appointment_date"],
+                rescheduled_appointment_info["rescheduled_appointment_time"],
+                now
+            )
+            if new_datetime is None:
+                raise PermanentJobError(f"Could not resolve the rescheduled appointment time: {rescheduled_appointment_info}")
+
             # Update the appointment in Oystehr
             new_appointment = Appointment(
                 patient_name=patient["name"][0]["text"],
-                phone_number="not needed for rescheduling",
-                datetime=datetime.strptime(f"{rescheduled_appointment_info["rescheduled_appointment_date"]} {rescheduled_appointment_info["rescheduled_appointment_time"]}", "%Y-%m-%d %I:%M %p"),
+                phone_number=next((t["value"] for t in patient.get("telecom", []) if t.get("system") == "phone"), ""),
+                datetime=new_datetime,
                 notes=f"Rescheduled from {existing_appointment['planningHorizon']['start']}"
             )
             if await self.oystehr_service.update_appointment(existing_appointment["id"], patient["id"], new_appointment):
@@ -118,11 +226,16 @@ class AppointmentService:
                 appointment_details = self.format_appointment_details(new_appointment)
                 await self.sms_service.send_confirmation(
                     new_appointment.phone_number,
-                    f"Your appointment has been rescheduled:\n{appointment_details}"
+                    f"Your appointment has been rescheduled:\n{appointment_details}",
+                    dedupe_key=self.confirmation_key(new_appointment, f"reschedule:{existing_appointment['id']}")
                 )
-                logger.info(f"Rescheduling confirmation sent to {new_appointment.phone_number}")
+                logger.info(f"Rescheduling confirmation queued for {new_appointment.phone_number}")
                 return True
             return False
+        except PermanentJobError:
+            raise
+        except SlotUnavailableError as e:
+            raise PermanentJobError(str(e)) from e
         except Exception as e:
             logger.error(f"Error in rescheduling workflow: {e}")
             return False
@@ -0,0 +1,151 @@
+from fractions import Fraction
+import numpy as np
+
+TWILIO_SAMPLE_RATE = 8000
+
+def _build_ulaw_decode_table() -> np.ndarray:
+    """G.711 mu-law byte -> 16-bit PCM sample, for all 256 bytes."""
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    return np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+
+def _build_ulaw_encode_table() -> np.ndarray:
+    """16-bit PCM sample (indexed as uint16) -> G.711 mu-law byte, for all 65536 samples.
+
+    Rounds like audioop.lin2ulaw: the sample is first floored to 14 bits.
+    """
+    samples = np.arange(65536, dtype=np.int32)
+    samples = np.where(samples >= 32768, samples - 65536, samples) >> 2
+    mask = np.where(samples < 0, 0x7F, 0xFF)
+    magnitude = np.minimum(np.abs(samples), 8159) + 33
+    segment = np.floor(np.log2(magnitude)).astype(np.int32) - 5
+    mantissa = (magnitude >> (segment + 1)) & 0x0F
+    # Beyond the last segment the code saturates
+    codes = np.where(segment > 7, 0x7F, (segment << 4) | mantissa)
+    return (codes ^ mask).astype(np.uint8)
+
+ULAW_DECODE = _build_ulaw_decode_table()
+ULAW_ENCODE = _build_ulaw_encode_table()
+
+def ulaw_to_pcm16(data: bytes) -> np.ndarray:
+    return ULAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+def pcm16_to_ulaw(samples: np.ndarray) -> bytes:
+    return ULAW_ENCODE[samples.astype(np.int16, copy=False).view(np.uint16)].tobytes()
+
+class StreamingResampler:
+    """Polyphase FIR resampler for a continuous stream fed in arbitrary chunks.
+
+    Resamples by the rational factor up/down (e.g. 160/441 for 22.05 kHz -> 8 kHz). The last
+    input samples and the output position are carried between chunks, so the output has no
+    discontinuities at chunk boundaries. Each phase of the windowed-sinc filter has
+    `taps_per_phase` coefficients.
+    """
+
+    def __init__(self, from_rate: int, to_rate: int, taps_per_phase: int = 16):
+        ratio = Fraction(to_rate, from_rate)
+        self.up, self.down = ratio.numerator, ratio.denominator
+        self.taps = taps_per_phase
+        # Low-pass at the lower of the two Nyquist frequencies, relative to the upsampled rate
+        cutoff = 0.5 / max(self.up, self.down) * 0.9
+        length = self.taps * self.up
+        t = np.arange(length) - (length - 1) / 2
+        prototype = 2 * cutoff * np.sinc(2 * cutoff * t) * np.kaiser(length, 8.0) * self.up
+        # kernels[p] holds the taps for output positions p/up past an input sample
+        self.kernels = np.ascontiguousarray(prototype.reshape(self.taps, self.up).T, dtype=np.float32)
+        self.history = np.zeros(self.taps - 1, dtype=np.float32)
+        self.consumed = 0
+        self.produced = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """Resample the next chunk of the stream, returning float32 samples."""
+        if not len(samples):
+            return np.zeros(0, dtype=np.float32)
+        buffer = np.concatenate((self.history, samples.astype(np.float32, copy=False)))
+        total = self.consumed + len(samples)
+        end = -(-total * self.up // self.down)
+
+        # Window i of the buffer ends at input sample consumed + i
+        if self.down == 1:
+            # Integer upsampling: every phase at every input sample, interleaved
+            output = np.empty((len(samples), self.up), dtype=np.float32)
+            for phase, kernel in enumerate(self.kernels):
+                output[:, phase] = np.convolve(buffer, kernel, "valid")
+            output = output.ravel()
+        elif self.up == 1:
+            # Integer downsampling: filter at the input rate and keep every down-th sample
+            first = self.produced * self.down - self.consumed
+            output = np.convolve(buffer, self.kernels[0], "valid")[first::self.down]
+        else:
+            positions = np.arange(self.produced, end, dtype=np.int64) * self.down
+            windows = np.lib.stride_tricks.sliding_window_view(buffer, self.taps)
+            output = np.einsum(
+                "ij,ij->i",
+                windows[positions // self.up - self.consumed],
+                self.kernels[positions % self.up, ::-1]
+            )
+
+        self.history = buffer[len(buffer) - self.taps + 1:]
+        self.consumed = total
+        self.produced = end
+        return output
+
+def _to_pcm16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+def parse_audio_format(audio_format: str) -> tuple[str, int]:
+    """Split an ElevenLabs audio format such as `pcm_16000` into encoding and sample rate."""
+    encoding, _, rate = audio_format.partition("_")
+    if encoding not in ("ulaw", "pcm") or not rate.isdigit():
+        raise ValueError(f"Unsupported audio format {audio_format!r}")
+    return encoding, int(rate)
+
+class AgentAudioCodec:
+    """Converts between Twilio's 8 kHz mu-law and the agent's audio formats, chunk by chunk.
+
+    The formats are the user input and agent output audio formats the ElevenLabs agent is
+    configured with, e.g. `ulaw_8000` (passed through unchanged) or `pcm_16000`. Each
+    direction keeps its own resampler state, so one codec serves one call.
+    """
+
+    def __init__(self, input_format: str = "ulaw_8000", output_format: str = "ulaw_8000", taps_per_phase: int = 16):
+        self.input_encoding, input_rate = parse_audio_format(input_format)
+        self.output_encoding, output_rate = parse_audio_format(output_format)
+        self.input_passthrough = input_format == "ulaw_8000"
+        self.output_passthrough = output_format == "ulaw_8000"
+        self._inbound = self._resampler(TWILIO_SAMPLE_RATE, input_rate, taps_per_phase)
+        self._outbound = self._resampler(output_rate, TWILIO_SAMPLE_RATE, taps_per_phase)
+        # A PCM chunk can end in the middle of a sample
+        self._pending = b""
+
+    @staticmethod
+    def _resampler(from_rate: int, to_rate: int, taps_per_phase: int):
+        return StreamingResampler(from_rate, to_rate, taps_per_phase) if from_rate != to_rate else None
+
+    def to_agent(self, ulaw: bytes) -> bytes:
+        """Caller audio from Twilio, in the agent's input format."""
+        if self.input_passthrough:
+            return ulaw
+        samples = ulaw_to_pcm16(ulaw)
+        if self._inbound:
+            samples = _to_pcm16(self._inbound.process(samples))
+        if self.input_encoding == "ulaw":
+            return pcm16_to_ulaw(samples)
+        return samples.astype("<i2", copy=False).tobytes()
+
+    def from_agent(self, audio: bytes) -> bytes:
+        """Agent audio in its output format, as 8 kHz mu-law for Twilio."""
+        if self.output_passthrough:
+            return audio
+        if self.output_encoding == "ulaw":
+            samples = ulaw_to_pcm16(audio)
+        else:
+            audio = self._pending + audio
+            usable = len(audio) - len(audio) % 2
+            self._pending = audio[usable:]
+            samples = np.frombuffer(audio[:usable], dtype="<i2")
+        if self._outbound:
+            samples = _to_pcm16(self._outbound.process(samples))
+        return pcm16_to_ulaw(samples)
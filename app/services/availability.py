@@ -0,0 +1,250 @@
+import asyncio
+import threading
+import uuid
+from bisect import bisect_left
+from datetime import date, datetime, time, timedelta
+from typing import Awaitable, Callable, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.utils.normalization import practice_timezone
+
+DEFAULT_PROVIDER = "practice"
+
+def schedule_interval(schedule: dict) -> Optional[tuple[datetime, datetime]]:
+    """The booked interval of a FHIR Schedule, in the practice timezone."""
+    horizon = schedule.get("planningHorizon") or {}
+    if not horizon.get("start"):
+        return None
+    start = datetime.fromisoformat(horizon["start"])
+    end = datetime.fromisoformat(horizon["end"]) if horizon.get("end") else start + timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES)
+    if start.tzinfo is None:
+        start, end = start.replace(tzinfo=practice_timezone()), end.replace(tzinfo=practice_timezone())
+    return start.astimezone(practice_timezone()), end.astimezone(practice_timezone())
+
+def schedule_provider(schedule: dict) -> str:
+    """Bookings are per practitioner when the Schedule names one, else for the practice as a whole."""
+    for actor in schedule.get("actor", []):
+        if actor.get("reference", "").startswith("Practitioner/"):
+            return actor["reference"]
+    return DEFAULT_PROVIDER
+
+class _DayBookings:
+    """Booked intervals of one provider on one day, as sorted parallel arrays of epoch seconds."""
+
+    def __init__(self):
+        self.starts: list[float] = []
+        self.ends: list[float] = []
+        self.ids: list[str] = []
+        self.max_duration = 0.0
+
+    def add(self, start: float, end: float, booking_id: str):
+        i = bisect_left(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        self.ids.insert(i, booking_id)
+        self.max_duration = max(self.max_duration, end - start)
+
+    def remove(self, start: float, booking_id: str):
+        i = bisect_left(self.starts, start)
+        while i < len(self.starts) and self.starts[i] == start:
+            if self.ids[i] == booking_id:
+                del self.starts[i], self.ends[i], self.ids[i]
+                return
+            i += 1
+
+    def overlaps(self, start: float, end: float, ignore: Optional[str] = None) -> bool:
+        # Only bookings starting before `end`, and no earlier than the longest booking could reach back
+        i = bisect_left(self.starts, end) - 1
+        while i >= 0 and self.starts[i] > start - self.max_duration:
+            if self.ends[i] > start and self.ids[i] != ignore:
+                return True
+            i -= 1
+        return False
+
+class AvailabilityIndex:
+    """In-process index of booked intervals per provider and day.
+
+    Bulk-loaded from Oystehr Schedule searches and refreshed periodically to pick up bookings
+    made elsewhere; our own writes go through `reserve`/`confirm`/`release`, so the index never
+    lags behind them. Free/busy checks are a bisect on one day's sorted bookings.
+    """
+
+    def __init__(
+        self,
+        slot_minutes: int,
+        open_hour: int,
+        close_hour: int,
+        open_weekdays: list[int],
+        refresh_interval: float,
+        load_days: int,
+    ):
+        self.slot = timedelta(minutes=slot_minutes)
+        self.open_hour = open_hour
+        self.close_hour = close_hour
+        self.open_weekdays = set(open_weekdays)
+        self.refresh_interval = refresh_interval
+        self.load_days = load_days
+        self.loaded_at: Optional[datetime] = None
+        self._days: dict[tuple[str, date], _DayBookings] = {}
+        self._bookings: dict[str, tuple[str, date, float]] = {}
+        self._holds: dict[str, tuple[str, datetime, datetime]] = {}
+        # Our own writes, kept briefly so a reload fetched before them doesn't drop them
+        self._recent_writes: dict[str, tuple[datetime, Optional[dict]]] = {}
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def _add(self, days: dict, bookings: dict, provider: str, start: datetime, end: datetime, booking_id: str):
+        key = (provider, start.date())
+        if key not in days:
+            days[key] = _DayBookings()
+        days[key].add(start.timestamp(), end.timestamp(), booking_id)
+        bookings[booking_id] = (provider, start.date(), start.timestamp())
+
+    def _remove(self, booking_id: str):
+        entry = self._bookings.pop(booking_id, None)
+        if entry:
+            provider, day, start = entry
+            self._days[(provider, day)].remove(start, booking_id)
+
+    def _add_schedule(self, days: dict, bookings: dict, schedule: dict):
+        interval = schedule_interval(schedule)
+        if interval is not None and schedule.get("active") is not False:
+            self._add(days, bookings, schedule_provider(schedule), *interval, schedule["id"])
+
+    def load(self, schedules: list[dict], fetched_at: Optional[datetime] = None):
+        """Replace the index with these Schedules, keeping reservations still in flight and any
+        of our writes made after `fetched_at`, which the search could not have seen."""
+        fetched_at = fetched_at or datetime.now(practice_timezone())
+        schedules_by_id = {schedule["id"]: schedule for schedule in schedules}
+        with self._lock:
+            for schedule_id, (written_at, schedule) in list(self._recent_writes.items()):
+                if written_at < fetched_at:
+                    del self._recent_writes[schedule_id]
+                elif schedule is None:
+                    schedules_by_id.pop(schedule_id, None)
+                else:
+                    schedules_by_id[schedule_id] = schedule
+
+            days: dict[tuple[str, date], _DayBookings] = {}
+            bookings: dict[str, tuple[str, date, float]] = {}
+            for schedule in schedules_by_id.values():
+                self._add_schedule(days, bookings, schedule)
+            for hold_id, (provider, start, end) in self._holds.items():
+                self._add(days, bookings, provider, start, end, hold_id)
+            self._days, self._bookings = days, bookings
+            self.loaded_at = fetched_at
+        logger.info(f"Availability index loaded: {len(bookings)} bookings")
+
+    def is_free(
+        self,
+        start: datetime,
+        end: Optional[datetime] = None,
+        provider: str = DEFAULT_PROVIDER,
+        ignore: Optional[str] = None,
+    ) -> bool:
+        """Whether nothing is booked in [start, end), not counting the booking `ignore` (e.g. the
+        appointment being rescheduled)."""
+        start = start.astimezone(practice_timezone())
+        end = end or start + self.slot
+        day = self._days.get((provider, start.date()))
+        return day is None or not day.overlaps(start.timestamp(), end.timestamp(), ignore)
+
+    def is_open(self, start: datetime, end: Optional[datetime] = None) -> bool:
+        start = start.astimezone(practice_timezone())
+        end = (end or start + self.slot).astimezone(practice_timezone())
+        return (
+            start.weekday() in self.open_weekdays
+            and start.date() == end.date()
+            and time(self.open_hour) <= start.time()
+            and end.time() <= time(self.close_hour)
+        )
+
+    def next_free_slots(
+        self,
+        after: datetime,
+        count: int = 3,
+        provider: str = DEFAULT_PROVIDER,
+        search_days: int = 30,
+    ) -> list[datetime]:
+        """The first `count` free slots on the slot grid, within opening hours, starting at `after`."""
+        tz = practice_timezone()
+        after = after.astimezone(tz)
+        slots = []
+        day = after.date()
+        while len(slots) < count and day <= after.date() + timedelta(days=search_days):
+            if day.weekday() in self.open_weekdays:
+                opens = datetime.combine(day, time(self.open_hour), tzinfo=tz)
+                closes = datetime.combine(day, time(self.close_hour), tzinfo=tz)
+                candidate = opens
+                if after > opens:
+                    # Round up onto the slot grid
+                    candidate = opens + -((opens - after) // self.slot) * self.slot
+                bookings = self._days.get((provider, day))
+                while candidate + self.slot <= closes and len(slots) < count:
+                    end = candidate + self.slot
+                    if bookings is None or not bookings.overlaps(candidate.timestamp(), end.timestamp()):
+                        slots.append(candidate)
+                    candidate = end
+            day += timedelta(days=1)
+        return slots
+
+    def reserve(
+        self,
+        start: datetime,
+        end: datetime,
+        provider: str = DEFAULT_PROVIDER,
+        ignore: Optional[str] = None,
+    ) -> Optional[str]:
+        """Atomically claim an interval if it is free. Returns a hold to `confirm` or `release`."""
+        start, end = start.astimezone(practice_timezone()), end.astimezone(practice_timezone())
+        with self._lock:
+            if not self.is_free(start, end, provider, ignore):
+                return None
+            hold_id = f"hold:{uuid.uuid4()}"
+            self._holds[hold_id] = (provider, start, end)
+            self._add(self._days, self._bookings, provider, start, end, hold_id)
+            return hold_id
+
+    def confirm(self, hold_id: str, schedule: dict):
+        """Replace a hold with the Schedule that was created or updated for it."""
+        with self._lock:
+            self._holds.pop(hold_id, None)
+            self._remove(hold_id)
+            self._remove(schedule["id"])
+            self._add_schedule(self._days, self._bookings, schedule)
+            self._recent_writes[schedule["id"]] = (datetime.now(practice_timezone()), schedule)
+
+    def release(self, hold_id: str):
+        with self._lock:
+            self._holds.pop(hold_id, None)
+            self._remove(hold_id)
+
+    async def _keep_loaded(self, fetch: Callable[[datetime, datetime], Awaitable[Optional[list[dict]]]]):
+        while True:
+            fetched_at = datetime.now(practice_timezone())
+            start = fetched_at.replace(hour=0, minute=0, second=0, microsecond=0)
+            schedules = await fetch(start, start + timedelta(days=self.load_days))
+            if schedules is not None:
+                self.load(schedules, fetched_at)
+            await asyncio.sleep(self.refresh_interval)
+
+    def start(self, fetch: Callable[[datetime, datetime], Awaitable[Optional[list[dict]]]]):
+        """Load in the background and refresh every `refresh_interval` seconds."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._keep_loaded(fetch))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+availability_index = AvailabilityIndex(
+    slot_minutes=settings.APPOINTMENT_SLOT_MINUTES,
+    open_hour=settings.PRACTICE_OPEN_HOUR,
+    close_hour=settings.PRACTICE_CLOSE_HOUR,
+    open_weekdays=settings.PRACTICE_OPEN_WEEKDAYS,
+    refresh_interval=settings.AVAILABILITY_REFRESH_SECONDS,
+    load_days=settings.AVAILABILITY_LOAD_DAYS,
+)
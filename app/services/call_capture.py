@@ -0,0 +1,159 @@
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Iterator, NamedTuple, Optional
+
+from app.core.config import settings
+from app.core.logger import logger
+
+MAGIC = b"VMACAP1\n"
+# kind, wall-clock timestamp, payload length
+RECORD_HEADER = struct.Struct("<BdI")
+# The CallSid names the capture file, so anything else is refused rather than put in a path
+CALL_SID_PATTERN = re.compile(r"CA[0-9a-f]{32}")
+
+def is_valid_call_sid(call_sid: Optional[str]) -> bool:
+    return bool(call_sid) and CALL_SID_PATTERN.fullmatch(call_sid) is not None
+
+class RecordKind(IntEnum):
+    INBOUND_AUDIO = 1      # raw mu-law from Twilio
+    OUTBOUND_AUDIO = 2     # raw mu-law sent to Twilio
+    TWILIO_EVENT = 3       # any other Twilio message, as received
+    USER_TRANSCRIPT = 4
+    AGENT_RESPONSE = 5
+    FUNCTION_CALL = 6      # JSON: function, model, result, latency
+    OYSTEHR_RESPONSE = 7   # JSON: method, path, status, body, latency
+
+class Record(NamedTuple):
+    kind: RecordKind
+    timestamp: float
+    payload: bytes
+
+    def text(self) -> str:
+        return self.payload.decode()
+
+    def json(self):
+        return json.loads(self.payload)
+
+class CallCaptureWriter:
+    """Appends the records of one call to `<directory>/<CallSid>.vcap`.
+
+    The file is a magic header followed by records of (kind, timestamp, length) and the
+    payload, so it can only grow and is read back without parsing through a memory map. The
+    CallSid is only known once Twilio's start event arrives, so records are held in memory
+    until `attach`. Records are buffered and written whole, in one append each time the buffer
+    fills, so the post-call job can append to the same file while the call is still closing.
+    Thread-safe: transcripts arrive on the ElevenLabs thread.
+    """
+
+    def __init__(self, directory: str, buffer_bytes: int = 1 << 16):
+        self.directory = directory
+        self.buffer_bytes = buffer_bytes
+        self.path: Optional[str] = None
+        self._file = None
+        self._buffer = bytearray()
+        self._discarded = False
+        self._lock = threading.Lock()
+
+    def attach(self, call_sid: str):
+        """Start writing to the call's file. A malformed CallSid discards the capture instead."""
+        if not is_valid_call_sid(call_sid):
+            logger.warning(f"Not capturing call with malformed CallSid {call_sid!r}")
+            with self._lock:
+                self._discarded = True
+                self._buffer.clear()
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self.path = os.path.join(self.directory, f"{call_sid}.vcap")
+            self._file = open(self.path, "ab", buffering=0)
+            if self._file.tell() == 0:
+                self._file.write(MAGIC)
+            self._flush()
+
+    def record(self, kind: RecordKind, payload: bytes):
+        with self._lock:
+            if self._discarded:
+                return
+            self._buffer += RECORD_HEADER.pack(kind, time.time(), len(payload))
+            self._buffer += payload
+            if len(self._buffer) >= self.buffer_bytes:
+                self._flush()
+
+    def record_text(self, kind: RecordKind, text: str):
+        self.record(kind, text.encode())
+
+    def record_json(self, kind: RecordKind, value):
+        self.record(kind, json.dumps(value, separators=(",", ":"), default=str).encode())
+
+    def _flush(self):
+        if self._file is not None and self._buffer:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._buffer.clear()
+
+_current_capture: ContextVar[Optional[CallCaptureWriter]] = ContextVar("current_capture", default=None)
+
+def start_capture() -> Optional[CallCaptureWriter]:
+    """Start capturing the current call if CALL_CAPTURE_ENABLED. Tasks started afterwards
+    (detection, extraction) record into the same capture."""
+    if not settings.CALL_CAPTURE_ENABLED:
+        return None
+    writer = CallCaptureWriter(settings.CALL_CAPTURE_DIR)
+    _current_capture.set(writer)
+    return writer
+
+@contextmanager
+def resume_capture(call_sid: Optional[str]):
+    """Append to a call's existing capture, e.g. from the post-call booking job."""
+    if not settings.CALL_CAPTURE_ENABLED or not is_valid_call_sid(call_sid):
+        yield None
+        return
+    if not os.path.exists(os.path.join(settings.CALL_CAPTURE_DIR, f"{call_sid}.vcap")):
+        yield None
+        return
+    writer = CallCaptureWriter(settings.CALL_CAPTURE_DIR)
+    writer.attach(call_sid)
+    token = _current_capture.set(writer)
+    try:
+        yield writer
+    finally:
+        _current_capture.reset(token)
+        writer.close()
+
+def current_capture() -> Optional[CallCaptureWriter]:
+    """The capture of the call being handled, if it is being captured."""
+    return _current_capture.get()
+
+def read_capture(path: str) -> Iterator[Record]:
+    """Iterate over the records of a capture file through a memory map."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a call capture")
+        offset = len(MAGIC)
+        # A record cut short by a crash ends the capture
+        while offset + RECORD_HEADER.size <= len(data):
+            kind, timestamp, length = RECORD_HEADER.unpack_from(data, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > len(data):
+                break
+            yield Record(RecordKind(kind), timestamp, data[offset:offset + length])
+            offset += length
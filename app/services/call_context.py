@@ -0,0 +1,55 @@
+import asyncio
+from typing import Optional
+
+from app.core.logger import logger
+from app.services.call_state import CallStateStore, call_state
+from app.services.oystehr import OystehrService
+
+class CallContextRegistry:
+    """Per-call patient context keyed by CallSid, prefetched from the caller ID at call setup.
+
+    The inbound webhook starts the EHR lookup as soon as the call arrives, so it overlaps
+    with the greeting instead of adding to post-call processing. The result is kept in the
+    call state store, where the media stream can read it even when another worker handles it.
+    """
+
+    def __init__(self, oystehr_service: Optional[OystehrService] = None, store: CallStateStore = call_state):
+        self.oystehr_service = oystehr_service or OystehrService()
+        self.store = store
+        self._prefetch_tasks: dict[str, asyncio.Task] = {}
+
+    def start_prefetch(self, call_sid: str, from_number: str):
+        """Start looking up the caller in the background. Returns immediately."""
+        task = asyncio.create_task(self._prefetch(call_sid, from_number))
+        self._prefetch_tasks[call_sid] = task
+        task.add_done_callback(lambda _: self._prefetch_tasks.pop(call_sid, None))
+
+    async def _prefetch(self, call_sid: str, from_number: str):
+        try:
+            await self.store.update(call_sid, {"patient_context": {"from_number": from_number, "patient": None, "schedules": []}})
+            patient = await self.oystehr_service.search_patient_by_phone(from_number)
+            if not patient:
+                logger.info(f"No existing patient found for caller {from_number} ({call_sid})")
+                return
+            schedules = await self.oystehr_service.search_upcoming_appointments(patient["id"])
+            await self.store.update(
+                call_sid,
+                {"patient_context": {"from_number": from_number, "patient": patient, "schedules": schedules}}
+            )
+            logger.info(f"Prefetched patient {patient['id']} with {len(schedules)} upcoming appointments ({call_sid})")
+        except Exception as e:
+            logger.error(f"Error prefetching patient context for {call_sid}: {e}")
+
+    async def get(self, call_sid: Optional[str]) -> Optional[dict]:
+        """Return whatever has been prefetched so far, without waiting."""
+        if not call_sid:
+            return None
+        return (await self.store.get(call_sid)).get("patient_context")
+
+    def cancel(self, call_sid: Optional[str]):
+        """Stop a prefetch still running on this worker; the context itself ends with the call state."""
+        task = self._prefetch_tasks.pop(call_sid, None) if call_sid else None
+        if task is not None:
+            task.cancel()
+
+call_contexts = CallContextRegistry()
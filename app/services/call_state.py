@@ -0,0 +1,191 @@
+import asyncio
+import json
+import sqlite3
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable
+
+from app.core.config import settings
+from app.utils.cache import TTLCache
+
+class CallStateStore(ABC):
+    """Per-call state keyed by CallSid, shared by whichever workers handle the call.
+
+    The state of a call is a flat mapping of fields to JSON values. Writes merge fields
+    instead of replacing the whole state, so the webhook, the media stream and the transfer
+    can each update their own fields without coordinating. Every write extends the call's
+    expiry by `ttl_seconds`.
+    """
+
+    @abstractmethod
+    async def get(self, call_sid: str) -> dict:
+        ...
+
+    @abstractmethod
+    async def update(self, call_sid: str, fields: dict):
+        ...
+
+    @abstractmethod
+    async def claim(self, call_sid: str, field: str, value: Any = True) -> bool:
+        """Set `field` unless it is already set. Returns whether this caller set it."""
+
+    @abstractmethod
+    async def delete(self, call_sid: str):
+        ...
+
+    async def close(self):
+        pass
+
+class MemoryCallStateStore(CallStateStore):
+    """Single-process store, for development and tests."""
+
+    def __init__(self, ttl_seconds: float = 14400.0, max_calls: int = 10000):
+        self._calls = TTLCache(max_calls, ttl_seconds)
+
+    async def get(self, call_sid: str) -> dict:
+        return dict(self._calls.get(call_sid) or {})
+
+    async def update(self, call_sid: str, fields: dict):
+        self._calls.set(call_sid, {**(self._calls.get(call_sid) or {}), **fields})
+
+    async def claim(self, call_sid: str, field: str, value: Any = True) -> bool:
+        state = self._calls.get(call_sid) or {}
+        if field in state:
+            return False
+        self._calls.set(call_sid, {**state, field: value})
+        return True
+
+    async def delete(self, call_sid: str):
+        self._calls.pop(call_sid)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS call_state (
+    call_sid TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (call_sid, field)
+);
+CREATE INDEX IF NOT EXISTS call_state_expires_at ON call_state (expires_at);
+"""
+
+class SQLiteCallStateStore(CallStateStore):
+    """Store shared by all worker processes on one host, one row per call and field."""
+
+    def __init__(self, path: str, ttl_seconds: float = 14400.0):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._initialized = True
+        return connection
+
+    def _execute(self, fn: Callable[[sqlite3.Connection], Any]) -> Any:
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(connection)
+                connection.execute("COMMIT")
+                return result
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        finally:
+            connection.close()
+
+    def _write(self, connection: sqlite3.Connection, call_sid: str, fields: dict):
+        expires_at = time.time() + self.ttl_seconds
+        connection.executemany(
+            "INSERT OR REPLACE INTO call_state (call_sid, field, value, expires_at) VALUES (?, ?, ?, ?)",
+            [(call_sid, field, json.dumps(value), expires_at) for field, value in fields.items()]
+        )
+        connection.execute("UPDATE call_state SET expires_at = ? WHERE call_sid = ?", (expires_at, call_sid))
+
+    async def get(self, call_sid: str) -> dict:
+        def select(connection: sqlite3.Connection) -> dict:
+            rows = connection.execute(
+                "SELECT field, value FROM call_state WHERE call_sid = ? AND expires_at > ?",
+                (call_sid, time.time())
+            ).fetchall()
+            return {field: json.loads(value) for field, value in rows}
+
+        return await asyncio.to_thread(self._execute, select)
+
+    async def update(self, call_sid: str, fields: dict):
+        await asyncio.to_thread(self._execute, lambda connection: self._write(connection, call_sid, fields))
+
+    async def claim(self, call_sid: str, field: str, value: Any = True) -> bool:
+        def insert(connection: sqlite3.Connection) -> bool:
+            exists = connection.execute(
+                "SELECT 1 FROM call_state WHERE call_sid = ? AND field = ? AND expires_at > ?",
+                (call_sid, field, time.time())
+            ).fetchone()
+            if exists:
+                return False
+            self._write(connection, call_sid, {field: value})
+            return True
+
+        return await asyncio.to_thread(self._execute, insert)
+
+    async def delete(self, call_sid: str):
+        def delete(connection: sqlite3.Connection):
+            # Also sweep calls that ended without cleaning up (e.g. a worker that died)
+            connection.execute("DELETE FROM call_state WHERE call_sid = ? OR expires_at <= ?", (call_sid, time.time()))
+
+        await asyncio.to_thread(self._execute, delete)
+
+class RedisCallStateStore(CallStateStore):
+    """Store shared across hosts, one Redis hash per call. Requires the `redis` package."""
+
+    def __init__(self, url: str, ttl_seconds: float = 14400.0, prefix: str = "call-state:"):
+        import redis.asyncio as redis
+        self.redis = redis.from_url(url)
+        self.ttl_seconds = int(ttl_seconds)
+        self.prefix = prefix
+
+    async def get(self, call_sid: str) -> dict:
+        data = await self.redis.hgetall(self.prefix + call_sid)
+        return {field.decode(): json.loads(value) for field, value in data.items()}
+
+    async def update(self, call_sid: str, fields: dict):
+        key = self.prefix + call_sid
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.hset(key, mapping={field: json.dumps(value) for field, value in fields.items()})
+            pipeline.expire(key, self.ttl_seconds)
+            await pipeline.execute()
+
+    async def claim(self, call_sid: str, field: str, value: Any = True) -> bool:
+        key = self.prefix + call_sid
+        async with self.redis.pipeline(transaction=True) as pipeline:
+            pipeline.hsetnx(key, field, json.dumps(value))
+            pipeline.expire(key, self.ttl_seconds)
+            created, _ = await pipeline.execute()
+        return bool(created)
+
+    async def delete(self, call_sid: str):
+        await self.redis.delete(self.prefix + call_sid)
+
+    async def close(self):
+        await self.redis.aclose()
+
+def _configure_store(ttl_seconds: float) -> CallStateStore:
+    if settings.CALL_STATE_BACKEND == "redis":
+        try:
+            return RedisCallStateStore(settings.CALL_STATE_REDIS_URL, ttl_seconds)
+        except ImportError as e:
+            # Falling back to a per-host store would let workers on different hosts claim the same call or slot
+            raise RuntimeError("CALL_STATE_BACKEND is redis but the redis package is not installed") from e
+    if settings.CALL_STATE_BACKEND == "sqlite":
+        return SQLiteCallStateStore(settings.CALL_STATE_SQLITE_PATH, ttl_seconds)
+    return MemoryCallStateStore(ttl_seconds)
+
+call_state = _configure_store(settings.CALL_STATE_TTL_SECONDS)
+# Slots claimed by a booking in flight, in the same backend but expiring much sooner than a
+# call, so a worker that dies mid-booking doesn't hold the slot for hours
+slot_holds = _configure_store(settings.SLOT_HOLD_TTL_SECONDS)
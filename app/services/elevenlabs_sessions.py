@@ -0,0 +1,135 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import Optional
+import httpx
+from elevenlabs import ElevenLabs
+from elevenlabs.conversational_ai.conversation import AudioInterface, Conversation
+
+from app.core.config import settings
+from app.core.logger import logger
+
+@lru_cache()
+def get_elevenlabs_client() -> ElevenLabs:
+    """Return the process-wide ElevenLabs client, reusing its HTTP connections across calls."""
+    return ElevenLabs(
+        api_key=settings.ELEVENLABS_API_KEY,
+        base_url=settings.ELEVENLABS_API_BASE_URL or None,
+        httpx_client=httpx.Client(
+            limits=httpx.Limits(max_keepalive_connections=settings.ELEVENLABS_MAX_KEEPALIVE_CONNECTIONS),
+            timeout=httpx.Timeout(settings.ELEVENLABS_TIMEOUT_SECONDS)
+        )
+    )
+
+@lru_cache(maxsize=8)
+def synthesize_speech(text: str, voice_id: str) -> bytes:
+    """Text to speech in the agent's output audio format, for messages outside the agent's
+    conversation. Cached, so a fixed message is only synthesized once per process."""
+    return b"".join(get_elevenlabs_client().text_to_speech.convert(
+        voice_id,
+        text=text,
+        output_format=settings.ELEVENLABS_OUTPUT_AUDIO_FORMAT,
+    ))
+
+class SignedUrlPool:
+    """Warm pool of signed conversation URLs for the configured agent.
+
+    Fetching a signed URL is the only network round trip before a conversation can connect,
+    so keeping a few ready takes it off the path from answer to first audio. URLs older
+    than `max_age` are discarded before they expire on the ElevenLabs side.
+    """
+
+    def __init__(self, agent_id: str, size: int, max_age: float, refill_interval: float = 5.0):
+        self.agent_id = agent_id
+        self.size = size
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self.hits = 0
+        self.misses = 0
+        self._urls: deque[tuple[float, str]] = deque()
+        self._lock = threading.Lock()
+        self._refill: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _discard_stale(self):
+        cutoff = time.monotonic() - self.max_age
+        with self._lock:
+            while self._urls and self._urls[0][0] < cutoff:
+                self._urls.popleft()
+
+    def take(self) -> Optional[str]:
+        """Return a ready signed URL, or None if the pool is empty. Safe to call from any thread."""
+        self._discard_stale()
+        with self._lock:
+            if self._urls:
+                _, url = self._urls.popleft()
+                self.hits += 1
+            else:
+                url = None
+                self.misses += 1
+        if self._refill is not None and self._task is not None:
+            self._task.get_loop().call_soon_threadsafe(self._refill.set)
+        return url
+
+    def _fetch(self) -> str:
+        return get_elevenlabs_client().conversational_ai.get_signed_url(agent_id=self.agent_id).signed_url
+
+    async def _keep_filled(self):
+        while True:
+            self._discard_stale()
+            while len(self._urls) < self.size:
+                try:
+                    url = await asyncio.to_thread(self._fetch)
+                    with self._lock:
+                        self._urls.append((time.monotonic(), url))
+                except Exception as e:
+                    logger.error(f"Error fetching ElevenLabs signed URL: {e}")
+                    break
+            self._refill.clear()
+            try:
+                await asyncio.wait_for(self._refill.wait(), timeout=self.refill_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self.size <= 0 or self._task is not None:
+            return
+        self._refill = asyncio.Event()
+        self._task = asyncio.create_task(self._keep_filled())
+        logger.info(f"ElevenLabs signed URL pool started (size={self.size})")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+signed_url_pool = SignedUrlPool(
+    agent_id=settings.ELEVENLABS_AGENT_ID,
+    size=settings.ELEVENLABS_SESSION_POOL_SIZE,
+    max_age=settings.ELEVENLABS_SIGNED_URL_MAX_AGE_SECONDS,
+)
+
+class PooledConversation(Conversation):
+    """Conversation that takes its signed URL from the warm pool when one is available."""
+
+    used_pooled_url = False
+
+    def _get_signed_url(self):
+        url = signed_url_pool.take()
+        if url:
+            self.used_pooled_url = True
+            return url
+        return super()._get_signed_url()
+
+def create_conversation(audio_interface: AudioInterface, **callbacks) -> Conversation:
+    """Create a conversation with the configured agent on the shared client."""
+    return PooledConversation(
+        client=get_elevenlabs_client(),
+        agent_id=settings.ELEVENLABS_AGENT_ID,
+        requires_auth=True, # Security > Enable authentication
+        audio_interface=audio_interface,
+        **callbacks
+    )
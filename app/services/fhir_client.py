@@ -0,0 +1,153 @@
+import asyncio
+import random
+from functools import lru_cache
+from typing import Optional
+import httpx
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import tracer
+from app.services.call_capture import RecordKind, current_capture
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# A POST creates a resource: only retry it when the server cannot have processed it
+POST_RETRY_STATUS_CODES = {429}
+POST_RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Longer Retry-After waits are cut short: the caller (a booking holding its slot, a post-call job) can retry later
+MAX_RETRY_AFTER_SECONDS = 10.0
+
+class FHIRClient:
+    """Asynchronous FHIR client sharing one keep-alive connection pool across all callers."""
+
+    def __init__(
+        self,
+        base_url: str,
+        headers: dict,
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        max_concurrency_per_host: int = 10,
+        timeout: float = 10.0,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.timeout = httpx.Timeout(timeout)
+        self.max_concurrency_per_host = max_concurrency_per_host
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self._client: Optional[httpx.AsyncClient] = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self.open()
+
+    def open(self) -> httpx.AsyncClient:
+        """Create the pooled HTTP client if needed. Building the TLS context is slow, so do it at startup."""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                headers=self.headers,
+                limits=self.limits,
+                timeout=self.timeout,
+            )
+        return self._client
+
+    def _semaphore(self, host: str) -> asyncio.Semaphore:
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.max_concurrency_per_host)
+        return self._host_semaphores[host]
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after and retry_after.isdigit():
+                return min(float(retry_after), MAX_RETRY_AFTER_SECONDS)
+        delay = self.retry_backoff * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+    async def request(self, method: str, path: str, **kwargs) -> httpx.Response:
+        """Send a request, retrying with backoff on 429/5xx responses and transport errors.
+
+        POSTs are not idempotent, so they are only retried when the request never reached the
+        server (connection errors) or was rejected with a 429; a timeout or 5xx after the server
+        may have committed the write is returned or raised instead of creating a duplicate.
+
+        `path` is relative to the base URL, or absolute as in a search bundle's `next` link.
+        """
+        url = path if path.startswith(("http://", "https://")) else f"{self.base_url}/{path.lstrip('/')}"
+        with tracer.span("oystehr.request", method=method, path=path) as span:
+            response = await self._request(method, url, span, **kwargs)
+        capture = current_capture()
+        if capture:
+            capture.record_json(RecordKind.OYSTEHR_RESPONSE, {
+                "method": method,
+                "path": path,
+                "status": response.status_code,
+                "body": response.text,
+            })
+        return response
+
+    async def _request(self, method: str, url: str, span, **kwargs) -> httpx.Response:
+        retry_errors = POST_RETRY_ERRORS if method == "POST" else httpx.TransportError
+        retry_status_codes = POST_RETRY_STATUS_CODES if method == "POST" else RETRY_STATUS_CODES
+        semaphore = self._semaphore(httpx.URL(url).host)
+        for attempt in range(self.max_retries + 1):
+            span.set_attribute("attempts", attempt + 1)
+            # Only held for the request itself, so a request backing off doesn't keep others waiting
+            try:
+                async with semaphore:
+                    response = await self.client.request(method, url, **kwargs)
+            except httpx.TransportError as e:
+                if attempt >= self.max_retries or not isinstance(e, retry_errors):
+                    raise
+                delay = self._retry_delay(attempt)
+                logger.warning(f"FHIR {method} {url} failed ({e!r}), retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            if response.status_code in retry_status_codes and attempt < self.max_retries:
+                delay = self._retry_delay(attempt, response)
+                logger.warning(f"FHIR {method} {url} returned {response.status_code}, retrying in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+
+            span.set_attribute("status_code", response.status_code)
+            return response
+
+    async def get(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", path, **kwargs)
+
+    async def post(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", path, **kwargs)
+
+    async def put(self, path: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", path, **kwargs)
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+@lru_cache()
+def get_fhir_client() -> FHIRClient:
+    """Return the process-wide Oystehr FHIR client."""
+    return FHIRClient(
+        base_url=settings.OYSTEHR_API_URL,
+        headers={
+            "accept": "application/json",
+            "Content-Type": "application/json",
+            "authorization": f"Bearer {settings.OYSTEHR_AUTH_TOKEN}",
+            "x-zapehr-project-id": settings.OYSTEHR_PROJECT_ID
+        },
+        max_connections=settings.OYSTEHR_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.OYSTEHR_MAX_KEEPALIVE_CONNECTIONS,
+        max_concurrency_per_host=settings.OYSTEHR_MAX_CONCURRENCY_PER_HOST,
+        timeout=settings.OYSTEHR_TIMEOUT_SECONDS,
+        max_retries=settings.OYSTEHR_MAX_RETRIES,
+        retry_backoff=settings.OYSTEHR_RETRY_BACKOFF_SECONDS,
+    )
@@ -0,0 +1,208 @@
+import re
+import time
+from typing import Awaitable, Callable, Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from app.core.config import settings, ModelType
+from app.core.logger import logger
+from app.core.prompt_templates.detect_appointment_action import detect_appointment_action_prompt
+from app.core.prompts import Prompt
+from app.utils.function_call import afunction_call
+from app.utils.transcript_context import TranscriptContext
+
+# Weighted patterns for the criteria listed in detect_appointment_action_prompt
+HANDOFF_RULES = [
+    # Medical emergencies or urgent symptoms
+    (r"\b(chest pains?|can'?t breathe|trouble breathing|short(ness)? of breath|bleeding|unconscious|passed out|"
+     r"faint(ed|ing)?|seizures?|stroke|overdos\w*|suicid\w*|kill myself|allergic reaction|emergency|911)\b", 3.0),
+    (r"\b(heart attack|collaps\w*|(not|isn'?t|stopped|no longer) (breathing|responding|responsive)|unresponsive)\b", 3.0),
+    (r"\b(fever|pain|hurts?|swollen|injur\w*|vomit\w*|dizzy)\b", 1.0),
+    # Explicit requests for human staff
+    (r"\b(speak|talk)\s+(to|with)\s+(an?\s+)?(human|person|someone|somebody|representative|receptionist|staff|nurse|doctor)\b", 3.0),
+    (r"\b(real person|human being|operator)\b", 2.0),
+    # Requests for medical advice
+    (r"\b(should i (take|stop|keep)|is it (safe|normal)|dosage|side effects?|prescription|medication|diagnos\w*)\b", 1.5),
+    # Distressed patients or technical issues
+    (r"\b(ridiculous|useless|stupid|furious|angry|can'?t hear you|you'?re not listening)\b", 1.0),
+]
+
+RESCHEDULE_RULES = [
+    (r"\breschedul\w*\b", 3.0),
+    (r"\b(change|move|switch|push|postpone|shift)\b.{0,30}\b(appointment|appt|visit|booking)\b", 2.5),
+    (r"\b(my|existing|current|upcoming|next|scheduled)\s+(appointment|appt|visit)\b", 1.5),
+    (r"\b(can'?t|cannot|won'?t be able to|unable to)\s+(make|come|attend)\b", 2.0),
+    (r"\balready (have|booked|scheduled)\b", 2.0),
+    (r"\b(different|another|other|new)\s+(day|time|date)\b", 1.0),
+]
+
+NEW_APPOINTMENT_RULES = [
+    (r"\b(book|schedule|make|set up|need|want|get)\b.{0,20}\b(an?|new)\s+(appointment|appt|visit|check-?up|consultation)\b", 2.5),
+    (r"\b(new patient|first time|first visit|never been)\b", 2.0),
+    (r"\b(check-?up|physical|cleaning)\b", 0.5),
+]
+
+# Words a turn may contain besides the rules' matches and still be decided locally: greetings,
+# function words and dates or times. Anything else (a symptom, what happened to someone) may be
+# an emergency the rules don't cover, so the turn goes to an LLM
+EXPLAINED_WORDS = set("""
+hi hello hey yes yeah ok okay um uh oh so well please thanks thank you sorry
+i i'd i'm i've i'll me my we we'd our us it it's is am are was be been do does did can could would will
+like love need want wanted get have had to a an the for with and or but just also actually really if
+possible that this there some any in on at of from by about around as soon sometime again anything
+time times day days week weeks month today tomorrow tonight morning afternoon evening noon next this coming
+monday tuesday wednesday thursday friday saturday sunday
+january february march april may june july august september october november december
+one two three four five six seven eight nine ten eleven twelve am pm o'clock
+""".split())
+
+EXISTING_APPOINTMENT_PATTERN = re.compile(RESCHEDULE_RULES[2][0] + "|" + RESCHEDULE_RULES[0][0], re.IGNORECASE)
+
+def _compile(rules: list[tuple[str, float]]) -> list[tuple[re.Pattern, float]]:
+    return [(re.compile(pattern, re.IGNORECASE), weight) for pattern, weight in rules]
+
+class LocalIntentResult:
+    def __init__(
+        self, scores: dict, matches: dict, existing_appointment_mentioned: bool, latest_explained: bool, min_margin: float
+    ):
+        self.scores = scores
+        self.matches = matches
+        self.existing_appointment_mentioned = existing_appointment_mentioned
+        self.urgent = scores["human_handoff"] > 0
+        ranked = sorted(("reschedule", "new_appointment"), key=lambda action: scores[action], reverse=True)
+        self.hint = ranked[0] if scores[ranked[0]] > 0 else "new_appointment"
+        # Confident only on a positive match with a clear lead, and only if the rules explain the
+        # whole latest turn: the local tier may never rule out a handoff ("I need to book an
+        # appointment, my baby is not breathing" matches a booking rule too)
+        lead = scores[ranked[0]] - scores[ranked[1]]
+        self.confident = not self.urgent and latest_explained and scores[ranked[0]] > 0 and lead >= min_margin
+
+    @property
+    def reason(self) -> str:
+        matched = [match for action in (self.hint, "human_handoff") for match in self.matches[action]]
+        return f"Local rules: {', '.join(matched)}"
+
+class LocalIntentScorer:
+    """Tier 0: a weighted keyword/regex scorer over the caller's turns. Runs in microseconds."""
+
+    def __init__(self, min_margin: float):
+        self.min_margin = min_margin
+        self.rules = {
+            "human_handoff": _compile(HANDOFF_RULES),
+            "reschedule": _compile(RESCHEDULE_RULES),
+            "new_appointment": _compile(NEW_APPOINTMENT_RULES),
+        }
+
+    def score(self, messages: list[BaseMessage]) -> LocalIntentResult:
+        turns = [message.content for message in messages if message.type == "human"]
+        text = "\n".join(turns)
+        scores = {}
+        matches = {}
+        for action, rules in self.rules.items():
+            scores[action] = 0.0
+            matches[action] = []
+            for pattern, weight in rules:
+                match = pattern.search(text)
+                if match:
+                    scores[action] += weight
+                    matches[action].append(match.group(0).lower())
+        existing = bool(EXISTING_APPOINTMENT_PATTERN.search(text))
+        return LocalIntentResult(scores, matches, existing, self._explains(turns[-1] if turns else ""), self.min_margin)
+
+    def _explains(self, turn: str) -> bool:
+        """Whether rule matches and EXPLAINED_WORDS account for every word of the turn."""
+        rest = turn
+        matched = False
+        for rules in self.rules.values():
+            for pattern, _ in rules:
+                rest, count = pattern.subn(" ", rest)
+                matched = matched or count > 0
+        return matched and all(word in EXPLAINED_WORDS for word in re.findall(r"[a-z']+", rest.lower()))
+
+class TierStats:
+    def __init__(self):
+        self.calls = 0
+        self.decided = 0
+        self.total_seconds = 0.0
+
+    def record(self, seconds: float, decided: bool):
+        self.calls += 1
+        self.decided += int(decided)
+        self.total_seconds += seconds
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "decided": self.decided,
+            "mean_latency_ms": round(self.total_seconds / self.calls * 1000, 3) if self.calls else 0.0,
+        }
+
+class TieredIntentClassifier:
+    """Classify the conversation action cheaply first and escalate only when it matters.
+
+    Tier 0 (`local`) decides clear new-appointment and reschedule conversations on its own, and
+    only when its rules account for every word of the caller's latest turn. Ambiguous conversations, turns the rules
+    say nothing about, and anything that might need a human handoff go to the small model. The large model is consulted only if the small model picks a handoff, or if it
+    disagrees with the local tier on a conversation the local tier flagged as urgent or
+    leaned one way on.
+    """
+
+    def __init__(
+        self,
+        small_model: ModelType = ModelType.GPT4O_MINI,
+        large_model: ModelType = ModelType.GPT4O,
+        min_margin: Optional[float] = None,
+        function_caller: Callable[..., Awaitable[dict]] = afunction_call,
+    ):
+        self.function_caller = function_caller
+        self.small_model = small_model
+        self.large_model = large_model
+        self.scorer = LocalIntentScorer(settings.INTENT_LOCAL_MIN_MARGIN if min_margin is None else min_margin)
+        self.stats = {"local": TierStats(), "small": TierStats(), "large": TierStats()}
+
+    def _needs_large_model(self, local: LocalIntentResult, small: dict) -> bool:
+        if small["action_type"] == "human_handoff":
+            return True
+        if local.urgent:
+            return True
+        return local.scores[local.hint] > 0 and small["action_type"] != local.hint
+
+    async def _llm_tier(self, tier: str, prompt: Prompt, model_type: ModelType) -> tuple[dict, float]:
+        started = time.perf_counter()
+        result = await self.function_caller(prompt, "detect_appointment_action", model_type)
+        result["tier"] = tier
+        return result, time.perf_counter() - started
+
+    async def classify(self, conversation_history: ChatMessageHistory, context: Optional[TranscriptContext] = None) -> dict:
+        started = time.perf_counter()
+        local = self.scorer.score(conversation_history.messages)
+        self.stats["local"].record(time.perf_counter() - started, local.confident)
+        if local.confident:
+            return {
+                "action_type": local.hint,
+                "reason": local.reason,
+                "existing_appointment_mentioned": local.existing_appointment_mentioned,
+                "tier": "local",
+            }
+
+        context = context or TranscriptContext(conversation_history)
+        prompt = detect_appointment_action_prompt.format(conversation_history=context.format())
+        small, seconds = await self._llm_tier("small", prompt, self.small_model)
+        escalate = self._needs_large_model(local, small)
+        self.stats["small"].record(seconds, not escalate)
+        if not escalate:
+            return small
+        logger.info(f"Escalating intent detection: local={local.scores}, small={small['action_type']}")
+        large, seconds = await self._llm_tier("large", prompt, self.large_model)
+        self.stats["large"].record(seconds, True)
+        return large
+
+    def summary(self) -> dict:
+        total = self.stats["local"].calls
+        return {
+            "escalation_rate_small": round(self.stats["small"].calls / total, 3) if total else 0.0,
+            "escalation_rate_large": round(self.stats["large"].calls / total, 3) if total else 0.0,
+            **{tier: stats.summary() for tier, stats in self.stats.items()},
+        }
+
+intent_classifier = TieredIntentClassifier()
@@ -0,0 +1,87 @@
+import asyncio
+import inspect
+import traceback
+from typing import Awaitable, Callable, Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.prompt_templates.detect_appointment_action import detect_appointment_action_prompt
+from app.services.intent_classifier import intent_classifier
+from app.utils.debounce import DebouncedRunner
+from app.utils.function_call import afunction_call
+from app.utils.transcript_context import TranscriptContext
+
+async def detect_conversation_action(
+    conversation_history: ChatMessageHistory,
+    context: Optional[TranscriptContext] = None,
+) -> dict:
+    """Detect whether the conversation requires new appointment, rescheduling, or human handoff."""
+    context = context or TranscriptContext(conversation_history)
+    try:
+        if settings.INTENT_CLASSIFIER_TIERED:
+            result = await intent_classifier.classify(conversation_history, context)
+        else:
+            prompt = detect_appointment_action_prompt.format(conversation_history=context.format())
+            result = await afunction_call(prompt, "detect_appointment_action")
+        logger.info(f"Conversation action detected: {result['action_type']} (tier: {result.get('tier', 'llm')})")
+        return result
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Error in conversation action detection: {str(e)}")
+        traceback.print_exc()
+        return {"action_type": "new_appointment", "reason": "Error in detection", "existing_appointment_mentioned": False}
+
+class IntentDetectionWorker:
+    """Per-call background worker that keeps the latest conversation action up to date.
+
+    Transcripts arriving in a burst are coalesced: every notification restarts a short
+    debounce timer and cancels any detection that is still running for an older transcript.
+    """
+
+    def __init__(
+        self,
+        conversation_history: ChatMessageHistory,
+        on_action: Callable[[dict], Optional[Awaitable[None]]],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        debounce_seconds: Optional[float] = None,
+        context: Optional[TranscriptContext] = None,
+    ):
+        self.conversation_history = conversation_history
+        # Kept for the whole call so each detection only formats the turns added since the last one
+        self.context = context or TranscriptContext(conversation_history)
+        self.on_action = on_action
+        self.latest_action: Optional[dict] = None
+        # Number of messages the latest published action was detected from
+        self.detected_through = 0
+        self.runner = DebouncedRunner(
+            self._detect,
+            settings.INTENT_DETECTION_DEBOUNCE_SECONDS if debounce_seconds is None else debounce_seconds,
+            loop=loop,
+        )
+
+    def notify(self):
+        """Signal that a new user transcript was added. Safe to call from any thread."""
+        self.runner.trigger()
+
+    async def _detect(self):
+        message_count = len(self.conversation_history.messages)
+        action = await detect_conversation_action(self.conversation_history, self.context)
+        self.latest_action = action
+        self.detected_through = message_count
+        result = self.on_action(action)
+        if inspect.isawaitable(result):
+            await result
+
+    async def flush(self) -> Optional[dict]:
+        """Wait until the detection for the latest transcript has been published."""
+        await self.runner.flush()
+        return self.latest_action
+
+    def close(self):
+        """Cancel any pending detection. Further notifications are ignored."""
+        self.runner.close()
+        logger.info(
+            f"Intent detection stats: started={self.runner.runs_started}, cancelled={self.runner.runs_cancelled}"
+        )
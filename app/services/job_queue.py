@@ -0,0 +1,227 @@
+import asyncio
+import json
+import random
+import sqlite3
+import time
+from typing import Awaitable, Callable, Optional
+
+from app.core.logger import logger
+
+JobHandler = Callable[[str, dict], Awaitable[bool]]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    idempotency_key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    locked_until REAL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_next_run_at ON jobs (status, next_run_at);
+"""
+
+class JobStatus:
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    DEAD = "dead"
+
+class PermanentJobError(Exception):
+    """Raised by a job handler for failures a retry cannot fix; the job is dead-lettered right away."""
+
+class PostCallJobQueue:
+    """Durable SQLite-backed queue for work that runs after a call ends.
+
+    Jobs are keyed by an idempotency key (the CallSid), so enqueueing the same call twice
+    is a no-op. A pool of workers claims jobs with a lease: a job whose worker died is picked
+    up again once its lease expires. Failed jobs are retried with backoff and moved to the
+    dead-letter list after `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        handler: JobHandler,
+        workers: int = 4,
+        max_attempts: int = 3,
+        retry_backoff: float = 5.0,
+        lease_seconds: float = 300.0,
+        poll_interval: float = 1.0,
+        name: str = "post-call",
+    ):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.name = name
+        self._tasks: list[asyncio.Task] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self._initialized = True
+        return connection
+
+    def _execute(self, fn: Callable[[sqlite3.Connection], object]):
+        connection = self._connect()
+        try:
+            return fn(connection)
+        finally:
+            connection.close()
+
+    async def enqueue(self, kind: str, idempotency_key: str, payload: dict) -> bool:
+        """Persist a job. Returns False if a job with the same idempotency key already exists."""
+        def insert(connection: sqlite3.Connection) -> bool:
+            now = time.time()
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO jobs (idempotency_key, kind, payload, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (idempotency_key, kind, json.dumps(payload), now, now, now)
+            )
+            return cursor.rowcount == 1
+
+        created = await asyncio.to_thread(self._execute, insert)
+        if created:
+            logger.info(f"Queued {kind} job for {idempotency_key}")
+            if self._wakeup is not None:
+                self._wakeup.set()
+        else:
+            logger.info(f"Skipping duplicate {kind} job for {idempotency_key}")
+        return created
+
+    def _claim(self, connection: sqlite3.Connection) -> Optional[sqlite3.Row]:
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT * FROM jobs WHERE (status = ? AND next_run_at <= ?) OR (status = ? AND locked_until < ?) "
+                "ORDER BY next_run_at LIMIT 1",
+                (JobStatus.PENDING, now, JobStatus.RUNNING, now)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, locked_until = ?, updated_at = ? WHERE id = ?",
+                    (JobStatus.RUNNING, now + self.lease_seconds, now, row["id"])
+                )
+            connection.execute("COMMIT")
+            return row
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _finish(self, job_id: int, attempts: int, error: Optional[str]):
+        def update(connection: sqlite3.Connection):
+            now = time.time()
+            if error is None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = NULL, updated_at = ? WHERE id = ?",
+                    (JobStatus.DONE, now, job_id)
+                )
+            elif attempts >= self.max_attempts:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                    (JobStatus.DEAD, error, now, job_id)
+                )
+            else:
+                delay = self.retry_backoff * (2 ** (attempts - 1))
+                delay += random.uniform(0, delay / 2)
+                connection.execute(
+                    "UPDATE jobs SET status = ?, locked_until = NULL, last_error = ?, next_run_at = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (JobStatus.PENDING, error, now + delay, now, job_id)
+                )
+
+        self._execute(update)
+
+    async def _run_job(self, row: sqlite3.Row):
+        attempts = row["attempts"] + 1
+        error = None
+        try:
+            if not await self.handler(row["kind"], json.loads(row["payload"])):
+                error = "Job handler reported failure"
+        except PermanentJobError as e:
+            error = f"{type(e).__name__}: {e}"
+            attempts = max(attempts, self.max_attempts)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        await asyncio.to_thread(self._finish, row["id"], attempts, error)
+        if error is None:
+            logger.info(f"Job {row['kind']} for {row['idempotency_key']} completed")
+        elif attempts >= self.max_attempts:
+            logger.error(f"Job {row['kind']} for {row['idempotency_key']} moved to dead-letter list: {error}")
+        else:
+            logger.warning(f"Job {row['kind']} for {row['idempotency_key']} failed (attempt {attempts}): {error}")
+
+    async def _worker(self):
+        while True:
+            try:
+                row = await asyncio.to_thread(self._execute, self._claim)
+            except Exception as e:
+                logger.error(f"Error claiming {self.name} job: {e}")
+                row = None
+
+            if row is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run_job(row)
+
+    def start(self):
+        """Start the worker pool on the running event loop."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Started {self.name} job queue with {self.workers} workers ({self.path})")
+
+    async def stop(self):
+        """Stop the workers. Jobs that were running are picked up again when their lease expires."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def dead_letters(self) -> list[dict]:
+        def select(connection: sqlite3.Connection) -> list[dict]:
+            rows = connection.execute(
+                "SELECT id, idempotency_key, kind, attempts, last_error, created_at, updated_at FROM jobs "
+                "WHERE status = ? ORDER BY updated_at",
+                (JobStatus.DEAD,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+
+        return await asyncio.to_thread(self._execute, select)
+
+    async def requeue(self, job_id: int) -> bool:
+        """Move a dead-lettered job back to the queue with a fresh attempt budget."""
+        def update(connection: sqlite3.Connection) -> bool:
+            now = time.time()
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, attempts = 0, next_run_at = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (JobStatus.PENDING, now, now, job_id, JobStatus.DEAD)
+            )
+            return cursor.rowcount == 1
+
+        requeued = await asyncio.to_thread(self._execute, update)
+        if requeued and self._wakeup is not None:
+            self._wakeup.set()
+        return requeued
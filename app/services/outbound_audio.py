@@ -0,0 +1,143 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+class OutboundAudioMetrics:
+    """Queue depth and send lag for one call's outbound audio."""
+
+    def __init__(self):
+        self.chunks_enqueued = 0
+        self.chunks_sent = 0
+        self.chunks_dropped_overflow = 0
+        self.chunks_dropped_interrupt = 0
+        self.max_depth_bytes = 0
+        self.producer_blocked_seconds = 0.0
+        self.send_lag_total = 0.0
+        self.send_lag_max = 0.0
+        self.first_output_at: Optional[float] = None
+        self.first_sent_at: Optional[float] = None
+
+    def record_send(self, enqueued_at: float, sent_at: float):
+        if self.first_sent_at is None:
+            self.first_sent_at = sent_at
+        lag = sent_at - enqueued_at
+        self.chunks_sent += 1
+        self.send_lag_total += lag
+        self.send_lag_max = max(self.send_lag_max, lag)
+
+    def summary(self) -> dict:
+        return {
+            "chunks_enqueued": self.chunks_enqueued,
+            "chunks_sent": self.chunks_sent,
+            "chunks_dropped_overflow": self.chunks_dropped_overflow,
+            "chunks_dropped_interrupt": self.chunks_dropped_interrupt,
+            "max_depth_bytes": self.max_depth_bytes,
+            "producer_blocked_ms": round(self.producer_blocked_seconds * 1000, 1),
+            "send_lag_avg_ms": round(self.send_lag_total / self.chunks_sent * 1000, 1) if self.chunks_sent else 0.0,
+            "send_lag_max_ms": round(self.send_lag_max * 1000, 1),
+        }
+
+class OutboundAudioBuffer:
+    """Bounded buffer between the ElevenLabs thread and the single task that sends audio to Twilio.
+
+    `put` blocks the producer while the buffer is full, up to `put_timeout`, after which the
+    oldest audio is dropped to make room. `clear` drops everything queued for a barge-in and
+    asks the sender to tell Twilio to clear its own playback buffer.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_bytes: int, put_timeout: float):
+        self.loop = loop
+        self.max_bytes = max_bytes
+        self.put_timeout = put_timeout
+        self.metrics = OutboundAudioMetrics()
+        self.generation = 0
+        self._chunks: deque[tuple[float, bytes]] = deque()
+        self._size = 0
+        self._clear_requested = False
+        self._closed = False
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._ready = asyncio.Event()
+
+    @property
+    def depth_bytes(self) -> int:
+        return self._size
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def _wake_sender(self):
+        try:
+            self.loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            # The event loop is already closed, there is no sender left to wake
+            pass
+
+    def put(self, audio: bytes):
+        """Queue audio for sending. Called from the producer thread."""
+        with self._not_full:
+            if self._closed:
+                return
+            if self.metrics.first_output_at is None:
+                self.metrics.first_output_at = time.monotonic()
+            if self._size + len(audio) > self.max_bytes:
+                blocked_at = time.monotonic()
+                self._not_full.wait_for(
+                    lambda: self._closed or self._size + len(audio) <= self.max_bytes,
+                    timeout=self.put_timeout
+                )
+                self.metrics.producer_blocked_seconds += time.monotonic() - blocked_at
+                if self._closed:
+                    return
+                # Still full: the sender is stuck, so behave as a ring buffer and drop the oldest audio
+                while self._chunks and self._size + len(audio) > self.max_bytes:
+                    _, dropped = self._chunks.popleft()
+                    self._size -= len(dropped)
+                    self.metrics.chunks_dropped_overflow += 1
+
+            was_empty = not self._chunks
+            self._chunks.append((time.monotonic(), audio))
+            self._size += len(audio)
+            self.metrics.chunks_enqueued += 1
+            self.metrics.max_depth_bytes = max(self.metrics.max_depth_bytes, self._size)
+        if was_empty:
+            self._wake_sender()
+
+    def clear(self):
+        """Drop all queued audio and request a Twilio clear message. Safe to call from any thread."""
+        with self._not_full:
+            self.metrics.chunks_dropped_interrupt += len(self._chunks)
+            self._chunks.clear()
+            self._size = 0
+            self.generation += 1
+            self._clear_requested = True
+            self._not_full.notify_all()
+        self._wake_sender()
+
+    async def get_batch(self) -> tuple[bool, list[tuple[float, bytes]], int]:
+        """Wait for work and take everything queued: (clear requested, chunks, generation)."""
+        while True:
+            with self._not_full:
+                if self._clear_requested or self._chunks or self._closed:
+                    clear_requested = self._clear_requested
+                    chunks = list(self._chunks)
+                    self._chunks.clear()
+                    self._size = 0
+                    self._clear_requested = False
+                    self._not_full.notify_all()
+                    return clear_requested, chunks, self.generation
+                # Cleared under the lock, so a producer's wake-up can't be lost
+                self._ready.clear()
+            await self._ready.wait()
+
+    def close(self):
+        """Release any blocked producer. Queued audio is discarded."""
+        with self._not_full:
+            self._closed = True
+            self._chunks.clear()
+            self._size = 0
+            self._not_full.notify_all()
+        self._wake_sender()
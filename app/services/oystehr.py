@@ -1,84 +1,302 @@
-from datetime import timedelta
-import requests
+import copy
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
 
 from app.core.config import settings
 from app.core.logger import logger
 from app.schemas.appointment import Appointment
+from app.services.availability import DEFAULT_PROVIDER, AvailabilityIndex, availability_index, schedule_interval
+from app.services.call_state import CallStateStore, slot_holds
+from app.services.fhir_client import get_fhir_client
+from app.services.patient_cache import PatientCache, normalize_name, normalize_phone, patient_cache
+from app.utils.normalization import now_in_practice, practice_timezone, to_fhir_datetime
+
+class SlotUnavailableError(Exception):
+    """The requested appointment time is already booked."""
 
 class OystehrService:
-    def __init__(self):
-        self.base_url = settings.OYSTEHR_API_URL
-        self.headers = {
-            "accept": "application/json",
-            "Content-Type": "application/json",
-            "authorization": f"Bearer {settings.OYSTEHR_AUTH_TOKEN}",
-            "x-zapehr-project-id": settings.OYSTEHR_PROJECT_ID
+    def __init__(self, cache: PatientCache = patient_cache, availability: AvailabilityIndex = availability_index):
+        self.client = get_fhir_client()
+        self.cache = cache
+        self.availability = availability
+        # Several workers may book (the memory store means one): each has its own availability index
+        self.shared_state: Optional[CallStateStore] = slot_holds if settings.CALL_STATE_BACKEND != "memory" else None
+        self.slot = timedelta(minutes=settings.APPOINTMENT_SLOT_MINUTES)
+        self._slot_claims: dict[str, list[str]] = {}
+
+    @staticmethod
+    def patient_has_name(patient: dict, name: str) -> bool:
+        return any(normalize_name(n.get("text", "")) == normalize_name(name) for n in patient.get("name", []))
+
+    def _patient_payload(self, appointment: Appointment) -> dict:
+        return {
+            "resourceType": "Patient",
+            "active": True,
+            "name": [
+                {
+                    "text": appointment.patient_name
+                }
+            ],
+            "telecom": [
+                {
+                    "system": "phone",
+                    "value": appointment.phone_number
+                }
+            ]
+        }
+
+    def _schedule_payload(self, patient_reference: str, appointment: Appointment) -> dict:
+        return {
+            "resourceType": "Schedule",
+            "active": True,
+            "actor": [
+                {
+                    "reference": patient_reference,
+                    "display": appointment.patient_name
+                }
+            ],
+            "planningHorizon": {
+                "start": to_fhir_datetime(appointment.datetime),
+                "end": to_fhir_datetime(appointment.datetime + self.slot)
+            },
+            "comment": appointment.notes
         }
 
+    def _slot_keys(self, start: datetime, end: datetime) -> list[str]:
+        """Shared-store keys of the slot-grid cells an interval touches, so overlapping bookings share one."""
+        slot_seconds = self.slot.total_seconds()
+        cell = int(start.timestamp() // slot_seconds)
+        keys = []
+        while cell * slot_seconds < end.timestamp():
+            keys.append(f"slot:{DEFAULT_PROVIDER}:{datetime.fromtimestamp(cell * slot_seconds, practice_timezone()).isoformat()}")
+            cell += 1
+        return keys
+
+    async def _is_booked_in_oystehr(self, start: datetime, end: datetime, ignore: Optional[str]) -> bool:
+        day = start.astimezone(practice_timezone()).replace(hour=0, minute=0, second=0, microsecond=0)
+        schedules = await self.search_schedules(day, day + timedelta(days=1))
+        if schedules is None:
+            # Can't tell, so don't risk a double booking
+            raise RuntimeError(f"Could not check Oystehr for bookings at {start}")
+        for schedule in schedules:
+            interval = schedule_interval(schedule)
+            if schedule["id"] != ignore and schedule.get("active") is not False and interval and interval[0] < end and interval[1] > start:
+                return True
+        return False
+
+    async def _reserve(self, start: datetime, end: datetime, ignore: Optional[str] = None) -> Optional[str]:
+        """Hold an interval until the booking is confirmed or `_release`d. Returns None if it is taken.
+
+        The hold is taken in this worker's availability index. With several workers it is also
+        claimed in the shared store for as long as the booking is in flight, and checked
+        against Oystehr's own Schedules, which may hold another worker's booking that this
+        worker's index has not picked up yet. Raises if either check fails, so the caller can retry.
+        """
+        hold = self.availability.reserve(start, end, ignore=ignore)
+        if hold is None or self.shared_state is None:
+            return hold
+        claimed = self._slot_claims[hold] = []
+        try:
+            for key in self._slot_keys(start, end):
+                if not await self.shared_state.claim(key, "hold", hold):
+                    logger.info(f"Slot {key} is being booked by another worker")
+                    break
+                claimed.append(key)
+            else:
+                if not await self._is_booked_in_oystehr(start, end, ignore):
+                    return hold
+        except Exception:
+            await self._release(hold)
+            raise
+        await self._release(hold)
+        return None
+
+    async def _release(self, hold: str):
+        """Release a hold; only the shared claims once the hold was confirmed."""
+        self.availability.release(hold)
+        for key in self._slot_claims.pop(hold, []):
+            await self.shared_state.delete(key)
+
+    def _known_patient(self, appointment: Appointment) -> Optional[dict]:
+        patient = self.cache.get_patient_by_phone(appointment.phone_number)
+        return patient if patient and self.patient_has_name(patient, appointment.patient_name) else None
+
+    async def find_patient(self, appointment: Appointment) -> Optional[dict]:
+        """The patient with the appointment's phone number and exactly its name, if there is one.
+
+        A family often shares a phone number, and FHIR name search matches on any name part
+        ("Maria" finds Maria Lopez), so the name is compared here rather than by the server.
+        Raises if the search fails, so a booking never creates a duplicate on a lookup error.
+        """
+        known_patient = self._known_patient(appointment)
+        if known_patient:
+            return known_patient
+        response = await self.client.get("/Patient", params={"phone": appointment.phone_number})
+        data = response.json()
+        if response.status_code != 200:
+            raise RuntimeError(f"Error searching for patient by phone in Oystehr: {data}")
+        for entry in data.get("entry", []):
+            if self.patient_has_name(entry["resource"], appointment.patient_name):
+                self.cache.put_patient(entry["resource"])
+                return entry["resource"]
+        return None
+
     async def create_appointment(self, appointment: Appointment) -> bool:
-        """Create an appointment in Oystehr."""
+        """Create an appointment in Oystehr. Raises SlotUnavailableError if the time is already booked."""
+        # Claimed up front so two calls booking the same time can't both succeed
+        hold = await self._reserve(appointment.datetime, appointment.datetime + self.slot)
+        if hold is None:
+            raise SlotUnavailableError(f"Requested time {appointment.datetime} is already booked")
         try:
+            if settings.OYSTEHR_BATCHED_REQUESTS:
+                results = [False]
+                await self._book([appointment], {0: hold}, results)
+                return results[0]
+            return await self._create_appointment_sequentially(appointment, hold)
+        except Exception as e:
+            logger.error(f"Error creating appointment in Oystehr: {e}")
+            return False
+        finally:
+            # Only the shared claims once the hold was confirmed
+            await self._release(hold)
+
+    async def _create_appointment_sequentially(self, appointment: Appointment, hold: str) -> bool:
+        """Find or create the patient, then create the Schedule, one request at a time."""
+        # Reuse the record of a returning patient instead of creating a duplicate
+        existing_patient = await self.find_patient(appointment)
+        if existing_patient:
+            patient_id = existing_patient["id"]
+            logger.info(f"Reusing existing Oystehr patient {patient_id}")
+        else:
             patient_id = await self.create_patient(appointment)
-            if not patient_id:
-                logger.error("Failed to create patient in Oystehr")
-                return False
+        if not patient_id:
+            logger.error("Failed to create patient in Oystehr")
+            return False
 
-            payload = {
-                "resourceType": "Schedule",
-                "active": True,
-                "actor": [
-                    {
-                        "reference": f"Patient/{patient_id}",
-                        "display": appointment.patient_name
-                    }
-                ],
-                "planningHorizon": {
-                    "start": appointment.datetime.strftime("%Y-%m-%dT%H:%M:%S%zZ"),
-                    "end": (appointment.datetime + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%S%zZ")
-                },
-                "comment": appointment.notes
-            }
-            response = requests.post(
-                f"{self.base_url}/Schedule",
-                headers=self.headers,
-                json=payload
+        payload = self._schedule_payload(f"Patient/{patient_id}", appointment)
+        response = await self.client.post("/Schedule", json=payload)
+
+        data = response.json()
+        if response.status_code != 201:
+            logger.error(f"Error creating an appointment in Oystehr: {data}")
+            return False
+
+        logger.info(f"Oystehr appointment created: {data}")
+        self.cache.put_schedule(patient_id, data)
+        self.availability.confirm(hold, data)
+        return True
+
+    async def create_appointments(self, appointments: list[Appointment]) -> list[bool]:
+        """Book many appointments in one FHIR transaction, returning whether each was booked.
+
+        Returning patients are looked up by phone number and exact name first; every new patient
+        is created in the same transaction and referenced by its Schedule through a `urn:uuid`,
+        so a patient is never left without its appointment. The transaction is all or nothing: if the server rejects it,
+        each booking is retried in a transaction of its own so one bad booking can't sink the rest.
+        """
+        results = [False] * len(appointments)
+        holds = {}
+        try:
+            for i, appointment in enumerate(appointments):
+                hold = await self._reserve(appointment.datetime, appointment.datetime + self.slot)
+                if hold is None:
+                    logger.error(f"Requested time {appointment.datetime} is already booked")
+                else:
+                    holds[i] = hold
+            await self._book(appointments, holds, results)
+            return results
+        finally:
+            for hold in holds.values():
+                await self._release(hold)
+
+    async def _book(self, appointments: list[Appointment], holds: dict, results: list[bool]):
+        pending = list(holds)
+        if pending and not await self._book_in_transaction(appointments, pending, holds, results) and len(pending) > 1:
+            logger.warning(f"Oystehr rejected a transaction of {len(pending)} bookings, booking them one by one")
+            # One after another, so bookings for the same new patient don't race to create it
+            for i in pending:
+                await self._book_in_transaction(appointments, [i], holds, results)
+
+    async def _book_in_transaction(self, appointments: list[Appointment], indices: list[int], holds: dict, results: list[bool]) -> bool:
+        entries = []
+        schedule_positions = []
+        patient_references = {}
+        try:
+            for i in indices:
+                appointment = appointments[i]
+                key = (normalize_phone(appointment.phone_number), normalize_name(appointment.patient_name))
+                if key not in patient_references:
+                    # Not an ifNoneExist conditional create: its name match is by any name part
+                    existing_patient = await self.find_patient(appointment)
+                    if existing_patient:
+                        patient_references[key] = f"Patient/{existing_patient['id']}"
+                    else:
+                        patient_references[key] = f"urn:uuid:{uuid.uuid4()}"
+                        entries.append({
+                            "fullUrl": patient_references[key],
+                            "resource": self._patient_payload(appointment),
+                            "request": {"method": "POST", "url": "Patient"}
+                        })
+                schedule_positions.append((i, len(entries)))
+                entries.append({
+                    "fullUrl": f"urn:uuid:{uuid.uuid4()}",
+                    "resource": self._schedule_payload(patient_references[key], appointment),
+                    "request": {"method": "POST", "url": "Schedule"}
+                })
+
+            response = await self.client.post(
+                "/",
+                json={"resourceType": "Bundle", "type": "transaction", "entry": entries},
+                headers={"Prefer": "return=representation"}
             )
-            
             data = response.json()
-            if response.status_code != 201:
-                logger.error(f"Error creating an appointment in Oystehr: {data}")
+            if response.status_code != 200:
+                logger.error(f"Error in Oystehr booking transaction: {data}")
                 return False
 
-            logger.info(f"Oystehr appointment created: {data}")
-
+            resources = self._transaction_resources(entries, data.get("entry", []))
+            for resource in resources:
+                if resource["resourceType"] == "Patient":
+                    self.cache.put_patient(resource)
+            for i, position in schedule_positions:
+                schedule = resources[position]
+                self.cache.put_schedule(schedule["actor"][0]["reference"].split("/")[-1], schedule)
+                self.availability.confirm(holds[i], schedule)
+                results[i] = True
+            logger.info(f"Oystehr transaction booked {len(schedule_positions)} appointments")
             return True
         except Exception as e:
-            logger.error(f"Error creating appointment in Oystehr: {e}")
+            logger.error(f"Error in Oystehr booking transaction: {e}")
             return False
-    
+
+    @staticmethod
+    def _transaction_resources(entries: list[dict], response_entries: list[dict]) -> list[dict]:
+        """The resources a transaction created or matched, in request order.
+
+        Servers return them only when asked with `Prefer: return=representation`; otherwise the
+        submitted resource is used, with its ID from the Location header and `urn:uuid`
+        references resolved.
+        """
+        references = {}
+        resources = []
+        for entry, response_entry in zip(entries, response_entries):
+            resource = response_entry.get("resource")
+            if resource is None:
+                resource = copy.deepcopy(entry["resource"])
+                # e.g. "Patient/123/_history/1", possibly absolute
+                location = response_entry["response"]["location"].split("/_history")[0]
+                resource["id"] = location.rstrip("/").split("/")[-1]
+                for actor in resource.get("actor", []):
+                    actor["reference"] = references.get(actor["reference"], actor["reference"])
+            references[entry["fullUrl"]] = f"{resource['resourceType']}/{resource['id']}"
+            resources.append(resource)
+        return resources
+
     async def create_patient(self, appointment: Appointment):
         """Create a patient in Oystehr."""
         try:
-            payload = {
-                "resourceType": "Patient",
-                "active": True,
-                "name": [
-                    {
-                        "text": appointment.patient_name
-                    }
-                ],
-                "telecom": [
-                    {
-                        "system": "phone",
-                        "value": appointment.phone_number
-                    }
-                ]
-            }
-            response = requests.post(
-                f"{self.base_url}/Patient",
-                headers=self.headers,
-                json=payload
-            )
+            response = await self.client.post("/Patient", json=self._patient_payload(appointment))
             data = response.json()
 
             if response.status_code != 201:
@@ -86,6 +304,7 @@ class OystehrService:
                 return None
 
             logger.info(f"Oystehr patient created: {data}")
+            self.cache.put_patient(data)
 
             return data["id"]
         except Exception as e:
@@ -94,11 +313,11 @@ class OystehrService:
     
     async def search_patient(self, name: str):
         """Search for a patient in Oystehr by name."""
+        cached = self.cache.get_patient_by_name(name)
+        if cached:
+            return cached
         try:
-            response = requests.get(
-                f"{self.base_url}/Patient?name={name}",
-                headers=self.headers
-            )
+            response = await self.client.get("/Patient", params={"name": name})
             data = response.json()
             if response.status_code != 200:
                 logger.error(f"Error searching for patient in Oystehr: {data}")
@@ -106,18 +325,44 @@ class OystehrService:
             
             logger.info(f"Oystehr patient search results: {data}")
 
-            return data['entry'][0]['resource'] if data['total'] > 0 else None
+            # Name search matches any part of a name, so "Maria" would also find Maria Lopez
+            patient = next((e["resource"] for e in data.get("entry", []) if self.patient_has_name(e["resource"], name)), None)
+            if patient:
+                self.cache.put_patient(patient)
+            return patient
         except Exception as e:
             logger.error(f"Error searching for patient in Oystehr: {e}")
             return None
     
+    async def search_patient_by_phone(self, phone_number: str):
+        """Search for a patient in Oystehr by phone number."""
+        cached = self.cache.get_patient_by_phone(phone_number)
+        if cached:
+            return cached
+        try:
+            response = await self.client.get("/Patient", params={"phone": phone_number})
+            data = response.json()
+            if response.status_code != 200:
+                logger.error(f"Error searching for patient by phone in Oystehr: {data}")
+                return None
+
+            logger.info(f"Oystehr patient search results: {data}")
+
+            patient = data['entry'][0]['resource'] if data['total'] > 0 else None
+            if patient:
+                self.cache.put_patient(patient)
+            return patient
+        except Exception as e:
+            logger.error(f"Error searching for patient by phone in Oystehr: {e}")
+            return None
+    
     async def search_appointment(self, patient_id: str):
         """Search for an appointment in Oystehr by patient ID."""
+        cached = self.cache.get_schedule(patient_id)
+        if cached:
+            return cached
         try:
-            response = requests.get(
-                f"{self.base_url}/Schedule?actor={patient_id}",
-                headers=self.headers
-            )
+            response = await self.client.get("/Schedule", params={"actor": patient_id})
             data = response.json()
             if response.status_code != 200:
                 logger.error(f"Error searching for appointment in Oystehr: {data}")
@@ -125,43 +370,119 @@ class OystehrService:
             
             logger.info(f"Oystehr appointment search results: {data}")
 
-            return data['entry'][0]['resource'] if data['total'] > 0 else None
+            schedule = data['entry'][0]['resource'] if data['total'] > 0 else None
+            if schedule:
+                self.cache.put_schedule(patient_id, schedule)
+            return schedule
         except Exception as e:
             logger.error(f"Error searching for appointment in Oystehr: {e}")
             return None
     
-    async def update_appointment(self, appointment_id: str, patient_id: str, appointment: Appointment):
-        """Update an appointment in Oystehr."""
+    async def search_patient_appointment(self, name: str) -> tuple[Optional[dict], Optional[dict]]:
+        """Find a patient by name together with their appointment.
+
+        Uses the cache when it can, otherwise one chained Schedule search that includes the
+        matching Patient instead of a Patient search followed by a Schedule search. Only a
+        patient with exactly this name counts as a match.
+        """
+        patient = self.cache.get_patient_by_name(name)
+        if patient or not settings.OYSTEHR_BATCHED_REQUESTS:
+            patient = patient or await self.search_patient(name)
+            return patient, await self.search_appointment(patient["id"]) if patient else None
         try:
-            payload = {
-                "resourceType": "Schedule",
-                "id": appointment_id,
-                "active": True,
-                "actor": [
-                    {
-                        "reference": f"Patient/{patient_id}",
-                        "display": appointment.patient_name
-                    }
-                ],
-                "planningHorizon": {
-                    "start": appointment.datetime.strftime("%Y-%m-%dT%H:%M:%S%zZ"),
-                    "end": (appointment.datetime + timedelta(minutes=30)).strftime("%Y-%m-%dT%H:%M:%S%zZ")
-                },
-                "comment": appointment.notes
+            response = await self.client.get(
+                "/Schedule",
+                params={"actor:Patient.name": name, "_include": "Schedule:actor"}
+            )
+            data = response.json()
+            if response.status_code != 200:
+                logger.error(f"Error searching for patient appointment in Oystehr: {data}")
+                return None, None
+
+            logger.info(f"Oystehr patient appointment search results: {data}")
+
+            resources = [entry["resource"] for entry in data.get("entry", [])]
+            # The chained search matches any part of a name, like the Patient search does
+            patients = {
+                f"Patient/{r['id']}": r for r in resources
+                if r["resourceType"] == "Patient" and self.patient_has_name(r, name)
             }
-            response = requests.put(
-                f"{self.base_url}/Schedule/{appointment_id}",
-                headers=self.headers,
-                json=payload
+            for schedule in (r for r in resources if r["resourceType"] == "Schedule"):
+                for actor in schedule.get("actor", []):
+                    patient = patients.get(actor.get("reference"))
+                    if patient:
+                        self.cache.put_patient(patient)
+                        self.cache.put_schedule(patient["id"], schedule)
+                        return patient, schedule
+            return None, None
+        except Exception as e:
+            logger.error(f"Error searching for patient appointment in Oystehr: {e}")
+            return None, None
+    
+    async def search_upcoming_appointments(self, patient_id: str) -> list[dict]:
+        """Search for a patient's upcoming appointments in Oystehr, soonest first."""
+        try:
+            response = await self.client.get(
+                "/Schedule",
+                params={"actor": patient_id, "date": f"ge{to_fhir_datetime(now_in_practice())}"}
             )
             data = response.json()
+            if response.status_code != 200:
+                logger.error(f"Error searching for upcoming appointments in Oystehr: {data}")
+                return []
+
+            schedules = [entry["resource"] for entry in data.get("entry", [])]
+            schedules.sort(key=lambda schedule: schedule.get("planningHorizon", {}).get("start", ""))
+            if schedules:
+                self.cache.put_schedule(patient_id, schedules[0])
+            return schedules
+        except Exception as e:
+            logger.error(f"Error searching for upcoming appointments in Oystehr: {e}")
+            return []
+    
+    async def update_appointment(self, appointment_id: str, patient_id: str, appointment: Appointment):
+        """Update an appointment in Oystehr. Raises SlotUnavailableError if the new time is already booked."""
+        hold = await self._reserve(appointment.datetime, appointment.datetime + self.slot, ignore=appointment_id)
+        if hold is None:
+            raise SlotUnavailableError(f"Requested time {appointment.datetime} is already booked")
+        try:
+            payload = {"id": appointment_id, **self._schedule_payload(f"Patient/{patient_id}", appointment)}
+            response = await self.client.put(f"/Schedule/{appointment_id}", json=payload)
+            data = response.json()
             if response.status_code != 200:
                 logger.error(f"Error updating appointment in Oystehr: {data}")
+                # Our copy may be out of date now, fetch it again next time
+                self.cache.invalidate_schedule(patient_id)
                 return False
 
             logger.info(f"Oystehr appointment updated: {data}")
+            self.cache.put_schedule(patient_id, data)
+            self.availability.confirm(hold, data)
 
             return True
         except Exception as e:
             logger.error(f"Error updating appointment in Oystehr: {e}")
-            return False
\ No newline at end of file
+            return False
+        finally:
+            await self._release(hold)
+
+    async def search_schedules(self, start: datetime, end: datetime) -> Optional[list[dict]]:
+        """All Schedules whose planning horizon falls in [start, end), following search pages."""
+        try:
+            schedules = []
+            path = "/Schedule"
+            params = [("date", f"ge{to_fhir_datetime(start)}"), ("date", f"lt{to_fhir_datetime(end)}"), ("_count", "500")]
+            while path:
+                response = await self.client.get(path, params=params)
+                data = response.json()
+                if response.status_code != 200:
+                    logger.error(f"Error searching for schedules in Oystehr: {data}")
+                    return None
+                schedules.extend(entry["resource"] for entry in data.get("entry", []))
+                # The next link carries the search parameters itself
+                path = next((link["url"] for link in data.get("link", []) if link.get("relation") == "next"), None)
+                params = None
+            return schedules
+        except Exception as e:
+            logger.error(f"Error searching for schedules in Oystehr: {e}")
+            return None
\ No newline at end of file
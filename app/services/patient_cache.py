@@ -0,0 +1,53 @@
+import re
+from typing import Optional
+
+from app.core.config import settings
+from app.utils.cache import TTLCache
+
+def normalize_name(name: str) -> str:
+    return " ".join(name.lower().split())
+
+def normalize_phone(phone: str) -> str:
+    """Compare phone numbers by their last ten digits so formatting and country code don't matter."""
+    return re.sub(r"\D", "", phone)[-10:]
+
+class PatientCache:
+    """Patient and schedule lookups keyed by normalized name, phone number and patient ID.
+
+    OystehrService writes through to this cache whenever it creates or updates a resource,
+    so entries never lag behind our own writes.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 900.0):
+        self.patients_by_name = TTLCache(max_entries, ttl_seconds)
+        self.patients_by_phone = TTLCache(max_entries, ttl_seconds)
+        self.schedules_by_patient = TTLCache(max_entries, ttl_seconds)
+
+    def get_patient_by_name(self, name: str) -> Optional[dict]:
+        return self.patients_by_name.get(normalize_name(name))
+
+    def get_patient_by_phone(self, phone: str) -> Optional[dict]:
+        key = normalize_phone(phone)
+        return self.patients_by_phone.get(key) if key else None
+
+    def put_patient(self, patient: dict):
+        for name in patient.get("name", []):
+            if name.get("text"):
+                self.patients_by_name.set(normalize_name(name["text"]), patient)
+        for telecom in patient.get("telecom", []):
+            if telecom.get("system") == "phone" and normalize_phone(telecom.get("value", "")):
+                self.patients_by_phone.set(normalize_phone(telecom["value"]), patient)
+
+    def get_schedule(self, patient_id: str) -> Optional[dict]:
+        return self.schedules_by_patient.get(patient_id)
+
+    def put_schedule(self, patient_id: str, schedule: dict):
+        self.schedules_by_patient.set(patient_id, schedule)
+
+    def invalidate_schedule(self, patient_id: str):
+        self.schedules_by_patient.pop(patient_id)
+
+patient_cache = PatientCache(
+    max_entries=settings.PATIENT_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.PATIENT_CACHE_TTL_SECONDS,
+)
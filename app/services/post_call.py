@@ -0,0 +1,126 @@
+import uuid
+from datetime import datetime
+from typing import Optional
+from langchain_core.messages import messages_from_dict, messages_to_dict
+from langchain_community.chat_message_histories import ChatMessageHistory
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import tracer
+from app.services.appointment import AppointmentService
+from app.services.call_capture import resume_capture
+from app.services.call_context import call_contexts
+from app.services.intent_detection import IntentDetectionWorker, detect_conversation_action
+from app.services.job_queue import PostCallJobQueue
+from app.services.slot_extraction import SLOT_NAMES, IncrementalSlotExtractor
+from app.utils.transcript_context import TranscriptContext
+
+POST_CALL_JOB = "post_call_booking"
+
+appointment_service = AppointmentService()
+
+def merge_call_outcome(outcome: dict, action: dict, slots: dict) -> dict:
+    """Combine the hang-up extraction with what the call already established.
+
+    A handoff or reschedule detected during the call stands, as in the per-function path, and
+    slots confirmed during the call fill any details the extraction left out.
+    """
+    merged = dict(outcome)
+    if action["human_handoff"]:
+        merged["action_type"] = "human_handoff"
+    elif action["reschedule_requested"] and merged["action_type"] == "new_appointment":
+        merged["action_type"] = "reschedule"
+    for name in SLOT_NAMES:
+        if not merged.get(name) and slots.get(name):
+            merged[name] = slots[name]
+    if all(merged.get(name) for name in ("patient_name", "phone_number", "appointment_date", "appointment_time")):
+        merged["has_appointment_info"] = True
+    return merged
+
+async def process_post_call_job(kind: str, payload: dict) -> bool:
+    """Finish whatever the call left pending and run the booking or rescheduling workflow."""
+    tracer.bind_call(payload["call_sid"])
+    with resume_capture(payload["call_sid"]), tracer.span("post_call.job", kind=kind) as span:
+        result = await _run_post_call_workflow(payload)
+        span.set_attribute("result", bool(result))
+        return result
+
+async def _run_post_call_workflow(payload: dict) -> bool:
+    conversation_history = ChatMessageHistory(messages=messages_from_dict(payload["messages"]))
+    # Relative dates ("tomorrow") mean what they meant during the call, not when the job runs
+    now = datetime.fromisoformat(payload["call_started_at"]) if payload.get("call_started_at") else None
+    if not conversation_history.messages:
+        logger.info(f"Call {payload['call_sid']} has no transcript, nothing to book")
+        return True
+    action = payload["action"]
+    if action["human_handoff"]:
+        logger.info(f"Call {payload['call_sid']} was handed off to staff, skipping booking")
+        return True
+
+    slot_extractor = IncrementalSlotExtractor(conversation_history, now=now, **payload["slots"])
+    # The call may have ended while detection was still running on the last user turns
+    pending = conversation_history.messages[action["detected_through"]:]
+    needs_detection = any(message.type == "human" for message in pending)
+
+    # Detection and extraction are both still needed: do them in one pass over the transcript
+    if settings.COMBINED_POST_CALL_EXTRACTION and (needs_detection or not slot_extractor.is_complete()):
+        outcome = await appointment_service.extract_call_outcome(conversation_history, now)
+        if outcome:
+            slot_extractor.close()
+            return await appointment_service.handle_call_outcome(
+                conversation_history,
+                merge_call_outcome(outcome, action, slot_extractor.slots),
+                payload.get("patient_context"),
+                now
+            )
+        logger.warning(f"Combined extraction failed for call {payload['call_sid']}, falling back to per-function calls")
+
+    if needs_detection:
+        context = TranscriptContext(conversation_history, summary=lambda: payload["slots"]["slots"])
+        latest = await detect_conversation_action(conversation_history, context)
+        action["human_handoff"] = action["human_handoff"] or latest["action_type"] == "human_handoff"
+        action["reschedule_requested"] = action["reschedule_requested"] or latest["action_type"] == "reschedule"
+
+    if action["human_handoff"]:
+        logger.info(f"Call {payload['call_sid']} needs staff follow-up, skipping booking")
+        return True
+
+    # Only the turns the call did not get to are sent to the LLM
+    slots = await slot_extractor.flush()
+    slot_extractor.close()
+
+    if action["reschedule_requested"]:
+        return await appointment_service.reschedule_appointment(conversation_history, slots, payload.get("patient_context"), now)
+    return await appointment_service.schedule_appointment(conversation_history, slot_extractor.to_appointment(), now)
+
+post_call_queue = PostCallJobQueue(
+    path=settings.POST_CALL_QUEUE_PATH,
+    handler=process_post_call_job,
+    workers=settings.POST_CALL_QUEUE_WORKERS,
+    max_attempts=settings.POST_CALL_QUEUE_MAX_ATTEMPTS,
+    retry_backoff=settings.POST_CALL_QUEUE_RETRY_BACKOFF_SECONDS,
+)
+
+async def enqueue_post_call_job(
+    call_sid: Optional[str],
+    conversation_history: ChatMessageHistory,
+    action_needed: dict,
+    intent_worker: IntentDetectionWorker,
+    slot_extractor: IncrementalSlotExtractor,
+    call_started_at: datetime,
+) -> bool:
+    """Persist everything the booking needs so the media-stream handler can return right away."""
+    payload = {
+        "call_sid": call_sid,
+        "call_started_at": call_started_at.isoformat(),
+        "messages": messages_to_dict(conversation_history.messages),
+        "action": {
+            "human_handoff": action_needed["human_handoff"],
+            "reschedule_requested": action_needed["reschedule_requested"],
+            "detected_through": intent_worker.detected_through,
+        },
+        "slots": slot_extractor.snapshot(),
+        # Caller-ID lookup from the inbound webhook, if it has finished
+        "patient_context": await call_contexts.get(call_sid),
+    }
+    return await post_call_queue.enqueue(POST_CALL_JOB, call_sid or f"no-call-sid-{uuid.uuid4()}", payload)
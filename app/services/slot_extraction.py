@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.prompt_templates.update_appointment_slots import update_appointment_slots_prompt
+from app.schemas.appointment import Appointment
+from app.services.appointment import AppointmentService
+from app.utils.debounce import DebouncedRunner
+from app.utils.function_call import afunction_call
+from app.utils.normalization import normalize_appointment_fields
+from app.utils.utils import format_messages, get_current_datetime
+
+SLOT_NAMES = ("patient_name", "phone_number", "appointment_date", "appointment_time", "notes")
+
+class IncrementalSlotExtractor:
+    """Per-call appointment slot state, updated from only the turns added since the last update.
+
+    Updates run in the background as transcripts arrive, so by the time the caller hangs up
+    the appointment is already assembled and only needs validating.
+    """
+
+    def __init__(
+        self,
+        conversation_history: ChatMessageHistory,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        debounce_seconds: Optional[float] = None,
+        slots: Optional[dict] = None,
+        processed: int = 0,
+        now: Optional[datetime] = None,
+    ):
+        self.conversation_history = conversation_history
+        # Relative dates are resolved against this, or the current time while the call is live
+        self.now = now
+        self.slots: dict[str, str] = dict(slots or {})
+        self._processed = processed
+        self.runner = DebouncedRunner(
+            self._update,
+            settings.SLOT_EXTRACTION_DEBOUNCE_SECONDS if debounce_seconds is None else debounce_seconds,
+            loop=loop,
+        )
+
+    def notify(self):
+        """Signal that new turns were added. Safe to call from any thread."""
+        self.runner.trigger()
+
+    def format_slots(self) -> str:
+        if not self.slots:
+            return "None yet"
+        return "\n    ".join(f"{name}: {value}" for name, value in self.slots.items())
+
+    async def _update(self):
+        messages = self.conversation_history.messages
+        end = len(messages)
+        if end <= self._processed:
+            return
+
+        prompt = update_appointment_slots_prompt.format(
+            current_datetime=get_current_datetime(self.now),
+            current_slots=self.format_slots(),
+            new_turns=format_messages(messages[self._processed:end])
+        )
+        # Relative dates ("tomorrow") are resolved now, while they still mean what the caller meant
+        updates = normalize_appointment_fields(await afunction_call(prompt, "update_appointment_slots"), self.now)
+
+        # Only advance once the update is applied; a cancelled run leaves its turns for the next one
+        for name in SLOT_NAMES:
+            value = updates.get(name)
+            if value:
+                self.slots[name] = value
+        self._processed = end
+        logger.info(f"Appointment slots updated: {self.slots}")
+
+    async def flush(self) -> dict:
+        """Apply any turns that have not been processed yet and return the slot state."""
+        await self.runner.flush()
+        if self._processed < len(self.conversation_history.messages):
+            try:
+                await self._update()
+            except Exception as e:
+                logger.error(f"Error updating appointment slots: {e}")
+        return self.slots
+
+    def snapshot(self) -> dict:
+        """Serializable slot state, restorable with `IncrementalSlotExtractor(history, **snapshot)`."""
+        return {"slots": dict(self.slots), "processed": self._processed}
+
+    def is_complete(self) -> bool:
+        return all(self.slots.get(name) for name in ("patient_name", "phone_number", "appointment_date", "appointment_time"))
+
+    def to_appointment(self) -> Optional[Appointment]:
+        """Validate the collected slots and build the appointment, or return None if incomplete."""
+        if not self.is_complete():
+            return None
+        try:
+            return AppointmentService.build_appointment(self.slots, self.now)
+        except Exception as e:
+            logger.error(f"Collected appointment slots are invalid: {e}")
+            return None
+
+    def close(self):
+        self.runner.close()
@@ -1,17 +1,44 @@
 import asyncio
 import base64
-import json
+import time
 from fastapi import WebSocket
 from elevenlabs.conversational_ai.conversation import AudioInterface
 from starlette.websockets import WebSocketDisconnect, WebSocketState
 
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import tracer
+from app.services.audio_codec import AgentAudioCodec
+from app.services.call_capture import RecordKind, current_capture
+from app.services.outbound_audio import OutboundAudioBuffer
+from app.services.twilio_media_codec import MediaFrameEncoder
+from app.services.voice_activity import VoiceActivityDetector
+
 
 class TwilioAudioInterface(AudioInterface):
     def __init__(self, websocket: WebSocket):
         self.websocket = websocket
         self.input_callback = None
         self.stream_sid = None
+        self.encoder = None
+        # Between Twilio's 8 kHz mu-law and the agent's formats, a no-op for ulaw_8000
+        self.codec = AgentAudioCodec(settings.ELEVENLABS_INPUT_AUDIO_FORMAT, settings.ELEVENLABS_OUTPUT_AUDIO_FORMAT)
+        self.vad = VoiceActivityDetector(
+            hangover_frames=settings.VAD_HANGOVER_MS // 20,
+            comfort_interval=settings.VAD_COMFORT_INTERVAL_FRAMES
+        ) if settings.VAD_ENABLED else None
+        # Created inside the media-stream handler, which starts the call's capture first
+        self.capture = current_capture()
         self.loop = asyncio.get_event_loop()
+        self.started_at = time.monotonic()
+        self.span = tracer.start_span("audio.outbound_queue")
+        # Audio from the ElevenLabs thread is queued here and sent by a single task
+        self.outbound = OutboundAudioBuffer(
+            self.loop,
+            max_bytes=settings.TWILIO_OUTBOUND_QUEUE_MAX_BYTES,
+            put_timeout=settings.TWILIO_OUTBOUND_QUEUE_PUT_TIMEOUT_SECONDS
+        )
+        self._sender_task = self.loop.create_task(self._send_outbound_audio())
 
     def start(self, input_callback):
         self.input_callback = input_callback
@@ -19,43 +46,88 @@ class TwilioAudioInterface(AudioInterface):
     def stop(self):
         self.input_callback = None
         self.stream_sid = None
+        self.encoder = None
 
     def output(self, audio: bytes):
         """
         This method should return quickly and not block the calling thread.
+        Blocks briefly only when the outbound queue is full, as backpressure.
         """
-        asyncio.run_coroutine_threadsafe(self.send_audio_to_twilio(audio), self.loop)
+        self.outbound.put(self.codec.from_agent(audio))
 
     def interrupt(self):
-        asyncio.run_coroutine_threadsafe(self.send_clear_message_to_twilio(), self.loop)
-
-    async def send_audio_to_twilio(self, audio: bytes):
-        if self.stream_sid:
-            audio_payload = base64.b64encode(audio).decode("utf-8")
-            audio_delta = {
-                "event": "media",
-                "streamSid": self.stream_sid,
-                "media": {"payload": audio_payload},
-            }
-            try:
-                if self.websocket.application_state == WebSocketState.CONNECTED:
-                    await self.websocket.send_text(json.dumps(audio_delta))
-            except (WebSocketDisconnect, RuntimeError):
-                pass
-
-    async def send_clear_message_to_twilio(self):
-        if self.stream_sid:
-            clear_message = {"event": "clear", "streamSid": self.stream_sid}
-            try:
-                if self.websocket.application_state == WebSocketState.CONNECTED:
-                    await self.websocket.send_text(json.dumps(clear_message))
-            except (WebSocketDisconnect, RuntimeError):
-                pass
+        self.outbound.clear()
+
+    def set_stream_sid(self, stream_sid: str):
+        self.stream_sid = stream_sid
+        self.encoder = MediaFrameEncoder(stream_sid, settings.TWILIO_OUTBOUND_MAX_FRAME_BYTES)
+
+    async def _send_text(self, text: str):
+        try:
+            if self.websocket.application_state == WebSocketState.CONNECTED:
+                await self.websocket.send_text(text)
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+
+    async def _send_outbound_audio(self):
+        while not self.outbound.closed:
+            clear_requested, chunks, generation = await self.outbound.get_batch()
+            encoder = self.encoder
+            if not encoder:
+                continue
+            if clear_requested:
+                await self._send_text(encoder.clear_message)
+            if not chunks:
+                continue
+
+            if settings.TWILIO_OUTBOUND_BATCHING:
+                frames = encoder.encode_batch([audio for _, audio in chunks])
+            else:
+                frames = [encoder.encode(audio) for _, audio in chunks]
+            for frame in frames:
+                # A barge-in while this batch was being sent makes the rest of it stale
+                if self.outbound.generation != generation:
+                    break
+                await self._send_text(frame)
+            else:
+                sent_at = time.monotonic()
+                for enqueued_at, audio in chunks:
+                    self.outbound.metrics.record_send(enqueued_at, sent_at)
+                    if self.capture:
+                        self.capture.record(RecordKind.OUTBOUND_AUDIO, audio)
+
+    async def close(self):
+        """Stop the sender task and release the ElevenLabs thread if it is waiting on a full queue."""
+        self.outbound.close()
+        self._sender_task.cancel()
+        await asyncio.gather(self._sender_task, return_exceptions=True)
+        summary = self.outbound.metrics.summary()
+        logger.info(f"Outbound audio stats: {summary}")
+        self.span.set_attributes(summary)
+        if self.vad:
+            vad_summary = self.vad.summary()
+            logger.info(f"Inbound voice activity stats: {vad_summary}")
+            self.span.set_attributes({f"vad_{key}": value for key, value in vad_summary.items()})
+        self.span.end()
+
+    def time_to_first_audio(self) -> float | None:
+        """Seconds from the media stream opening until the first agent audio was sent to Twilio."""
+        first_sent_at = self.outbound.metrics.first_sent_at
+        return first_sent_at - self.started_at if first_sent_at is not None else None
+
+    def handle_media(self, audio: bytes):
+        """Forward decoded inbound audio, see `twilio_media_codec.extract_media_payload`."""
+        if not self.input_callback:
+            return
+        if self.vad is None:
+            self.input_callback(self.codec.to_agent(audio))
+            return
+        for frame in self.vad.filter(audio):
+            self.input_callback(self.codec.to_agent(frame))
 
     async def handle_twilio_message(self, data):
         event_type = data.get("event")
         if event_type == "start":
-            self.stream_sid = data["start"]["streamSid"]
+            self.set_stream_sid(data["start"]["streamSid"])
         elif event_type == "media" and self.input_callback:
-            audio_data = base64.b64decode(data["media"]["payload"])
-            self.input_callback(audio_data)
+            self.handle_media(base64.b64decode(data["media"]["payload"]))
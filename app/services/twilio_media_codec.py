@@ -0,0 +1,70 @@
+import binascii
+import json
+from typing import Optional, Sequence
+
+# Twilio always serializes "event" first, so media frames can be recognized by prefix
+_MEDIA_PREFIX = '{"event":"media"'
+_PAYLOAD_KEY = '"payload":"'
+
+def extract_media_payload(message: str) -> Optional[bytes]:
+    """Decode the audio of a Twilio media frame without parsing the JSON.
+
+    Returns None for any other event, which should go through `json.loads` as usual.
+    """
+    if not message.startswith(_MEDIA_PREFIX):
+        return None
+    start = message.find(_PAYLOAD_KEY)
+    if start < 0:
+        return None
+    start += len(_PAYLOAD_KEY)
+    end = message.find('"', start)
+    if end < 0:
+        return None
+    return binascii.a2b_base64(message[start:end])
+
+class MediaFrameEncoder:
+    """Build outbound Twilio frames from templates precomputed around the streamSid."""
+
+    def __init__(self, stream_sid: str, max_frame_bytes: int = 8000):
+        self.stream_sid = stream_sid
+        self.max_frame_bytes = max_frame_bytes
+        self._prefix = '{"event":"media","streamSid":' + json.dumps(stream_sid) + ',"media":{"payload":"'
+        self._suffix = '"}}'
+        self.clear_message = json.dumps({"event": "clear", "streamSid": stream_sid}, separators=(",", ":"))
+        # Reused across batches so coalescing small chunks doesn't allocate per frame
+        self._buffer = bytearray(max_frame_bytes)
+
+    def encode(self, audio: bytes) -> str:
+        return self._prefix + binascii.b2a_base64(audio, newline=False).decode("ascii") + self._suffix
+
+    def encode_batch(self, chunks: Sequence[bytes]) -> list[str]:
+        """Coalesce audio chunks into as few frames as possible, each at most `max_frame_bytes`."""
+        if len(chunks) == 1 and len(chunks[0]) <= self.max_frame_bytes:
+            return [self.encode(chunks[0])]
+        if sum(map(len, chunks)) <= self.max_frame_bytes:
+            # Common case, everything fits in one frame: copy straight into the reused buffer
+            size = 0
+            for chunk in chunks:
+                self._buffer[size:size + len(chunk)] = chunk
+                size += len(chunk)
+            return [self._encode_view(memoryview(self._buffer)[:size])]
+        frames = []
+        view = memoryview(self._buffer)
+        size = 0
+        for chunk in chunks:
+            source = memoryview(chunk)
+            offset = 0
+            while offset < len(source):
+                if size == self.max_frame_bytes:
+                    frames.append(self._encode_view(view[:size]))
+                    size = 0
+                n = min(len(source) - offset, self.max_frame_bytes - size)
+                view[size:size + n] = source[offset:offset + n]
+                size += n
+                offset += n
+        if size:
+            frames.append(self._encode_view(view[:size]))
+        return frames
+
+    def _encode_view(self, view: memoryview) -> str:
+        return self._prefix + binascii.b2a_base64(view, newline=False).decode("ascii") + self._suffix
@@ -1,27 +1,234 @@
-from twilio.rest import Client
+import asyncio
+import random
+import time
+import uuid
+from collections import Counter
+from typing import Optional
+import httpx
+
 from app.core.config import settings
 from app.core.logger import logger
+from app.core.tracing import tracer
+from app.services.job_queue import PermanentJobError, PostCallJobQueue
+from app.utils.cache import TTLCache
+from app.utils.normalization import normalize_phone_number
+
+SMS_JOB = "sms"
+# Sending is not idempotent: only retry failures where Twilio cannot have accepted the message
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRY_STATUS_CODES = {429}
+FINAL_STATUSES = {"delivered", "undelivered", "failed"}
+
+class TokenBucket:
+    """Paces acquisitions to `rate` per second on average, allowing bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        # Waiters queue on the lock, so they are served in arrival order
+        async with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.tokens = 1.0
+                self.updated_at = time.monotonic()
+            self.tokens -= 1
+
+    def throttle(self, seconds: float):
+        """Hold off all acquisitions for `seconds`, e.g. after a 429."""
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+
+class SMSDispatcher:
+    """Sends SMS through the Twilio REST API on a pooled async HTTP client.
+
+    Each sender number has its own token bucket matching its throughput, so bursts queue up
+    locally instead of running into 429s, and a 429 pauses that sender for its Retry-After.
+    Connection failures are retried with jittered backoff; a read timeout or 5xx may mean the
+    message was sent anyway, so those are not retried, to avoid texting the patient twice. Delivery status is reported back
+    through the status callback and kept per message SID.
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        base_url: str,
+        rate_per_second: float = 1.0,
+        burst: int = 1,
+        max_retries: int = 3,
+        retry_backoff: float = 1.0,
+        timeout: float = 10.0,
+        status_callback_url: str = "",
+    ):
+        self.account_sid = account_sid
+        self.auth = (account_sid, auth_token)
+        self.messages_url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        self.rate_per_second = rate_per_second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.timeout = httpx.Timeout(timeout)
+        self.status_callback_url = status_callback_url
+        self.statuses = TTLCache(max_entries=10000, ttl_seconds=86400.0)
+        self.stats = Counter()
+        self._buckets: dict[str, TokenBucket] = {}
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self.open()
+
+    def open(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def _bucket(self, sender: str) -> TokenBucket:
+        if sender not in self._buckets:
+            self._buckets[sender] = TokenBucket(self.rate_per_second, self.burst)
+        return self._buckets[sender]
+
+    def _retry_delay(self, attempt: int, response: Optional[httpx.Response] = None) -> float:
+        if response is not None:
+            retry_after = response.headers.get("retry-after")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+        delay = self.retry_backoff * (2 ** attempt)
+        return delay + random.uniform(0, delay / 2)
+
+    async def send(self, to_number: str, body: str, from_number: str) -> str:
+        """Send one message and return its SID, retrying 429s and failures to connect.
+
+        Raises PermanentJobError if Twilio rejects the message itself (e.g. an invalid number), or
+        if it may have been sent despite the error.
+        """
+        data = {"To": to_number, "From": from_number, "Body": body}
+        if self.status_callback_url:
+            data["StatusCallback"] = self.status_callback_url
+        bucket = self._bucket(from_number)
+
+        with tracer.span("twilio.sms") as span:
+            for attempt in range(self.max_retries + 1):
+                span.set_attribute("attempts", attempt + 1)
+                await bucket.acquire()
+                try:
+                    response = await self.client.post(self.messages_url, data=data)
+                except RETRY_ERRORS as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    delay = self._retry_delay(attempt)
+                    logger.warning(f"Sending SMS failed ({e!r}), retrying in {delay:.2f}s")
+                    self.stats["retried"] += 1
+                    await asyncio.sleep(delay)
+                    continue
+                except httpx.TransportError as e:
+                    self.stats["failed"] += 1
+                    raise PermanentJobError(f"Sending SMS to {to_number} failed after the request was sent, not retrying: {e!r}") from e
+
+                if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                    delay = self._retry_delay(attempt, response)
+                    logger.warning(f"Twilio returned {response.status_code} for SMS, retrying in {delay:.2f}s")
+                    self.stats["retried"] += 1
+                    # Slow down every message from this sender, not just this one
+                    bucket.throttle(delay)
+                    continue
+                break
+
+            span.set_attribute("status_code", response.status_code)
+            try:
+                message = response.json()
+            except ValueError:
+                # e.g. an HTML error page from a proxy in front of Twilio
+                message = {}
+            if response.status_code == 201:
+                self.statuses.set(message["sid"], message.get("status", "queued"))
+                self.stats["sent"] += 1
+                logger.info(f"SMS sent successfully: {message['sid']}")
+                return message["sid"]
+
+            self.stats["failed"] += 1
+            error = f"Twilio returned {response.status_code} ({message.get('code')}): {message.get('message')}"
+            if response.status_code in RETRY_STATUS_CODES:
+                raise RuntimeError(error)
+            raise PermanentJobError(error)
+
+    async def handle_job(self, kind: str, payload: dict) -> bool:
+        await self.send(payload["to"], payload["body"], payload["from"])
+        return True
+
+    def record_status(self, message_sid: str, status: str, error_code: Optional[str] = None):
+        """Record a delivery status reported by Twilio's status callback."""
+        self.statuses.set(message_sid, status)
+        if status in FINAL_STATUSES:
+            self.stats[status] += 1
+        if status in ("undelivered", "failed"):
+            logger.warning(f"SMS {message_sid} was not delivered: {status} (error {error_code})")
+        else:
+            logger.info(f"SMS {message_sid} status: {status}")
+
+    def status(self, message_sid: str) -> Optional[str]:
+        return self.statuses.get(message_sid)
+
+sms_dispatcher = SMSDispatcher(
+    account_sid=settings.TWILIO_ACCOUNT_SID,
+    auth_token=settings.TWILIO_AUTH_TOKEN,
+    base_url=settings.TWILIO_API_BASE_URL,
+    rate_per_second=settings.SMS_RATE_PER_SECOND,
+    burst=settings.SMS_BURST,
+    max_retries=settings.SMS_MAX_RETRIES,
+    retry_backoff=settings.SMS_RETRY_BACKOFF_SECONDS,
+    timeout=settings.SMS_TIMEOUT_SECONDS,
+    status_callback_url=settings.SMS_STATUS_CALLBACK_URL,
+)
+
+sms_queue = PostCallJobQueue(
+    path=settings.SMS_QUEUE_PATH,
+    handler=sms_dispatcher.handle_job,
+    workers=settings.SMS_QUEUE_WORKERS,
+    max_attempts=settings.SMS_QUEUE_MAX_ATTEMPTS,
+    retry_backoff=settings.SMS_QUEUE_RETRY_BACKOFF_SECONDS,
+    name="SMS",
+)
 
 class SMSService:
-    def __init__(self):
-        self.client = Client(
-            settings.TWILIO_ACCOUNT_SID,
-            settings.TWILIO_AUTH_TOKEN
-        )
+    def __init__(self, queue: PostCallJobQueue = sms_queue):
+        self.queue = queue
 
     async def send_confirmation(
         self,
         to_number: str,
-        appointment_details: str
-    ) -> None:
-        """Send appointment confirmation via SMS."""
+        appointment_details: str,
+        dedupe_key: Optional[str] = None
+    ) -> bool:
+        """Queue an appointment confirmation SMS.
+
+        Messages with the same `dedupe_key` (one per appointment) are sent only once. Never
+        raises: a failed confirmation must not fail a booking that already reached the EHR.
+        Returns whether a message was queued.
+        """
+        phone_number = normalize_phone_number(to_number)
+        if phone_number is None:
+            logger.warning(f"Not sending SMS to unparsable number {to_number!r}")
+            return False
+        payload = {
+            "to": phone_number,
+            "from": settings.TWILIO_PHONE_NUMBER,
+            "body": f"Your appointment has been confirmed:\n{appointment_details}"
+        }
         try:
-            message = self.client.messages.create(
-                body=f"Your appointment has been confirmed:\n{appointment_details}",
-                from_=settings.TWILIO_PHONE_NUMBER,
-                to=to_number
-            )
-            logger.info(f"SMS sent successfully: {message.sid}")
+            return await self.queue.enqueue(SMS_JOB, dedupe_key or f"sms-{uuid.uuid4()}", payload)
         except Exception as e:
-            logger.error(f"Error sending SMS: {e}")
-            raise
+            logger.error(f"Error queueing SMS: {e}")
+            return False
@@ -0,0 +1,105 @@
+import math
+from collections import Counter, deque
+import numpy as np
+
+from app.services.audio_codec import ULAW_DECODE
+
+ULAW_SILENCE = 0xFF
+FULL_SCALE_ENERGY = 32768.0 ** 2
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing VAD for one call's inbound mu-law frames.
+
+    A frame is speech when its energy is `margin_db` above the noise floor (and above
+    `min_energy_db`), or half that with a high zero-crossing rate, which catches quiet
+    fricatives. The noise floor is the lowest frame energy of the last `noise_window_frames`:
+    speech keeps dipping between syllables, while steady background noise and hold music
+    become the floor within that window.
+
+    `filter` returns the frames to send upstream. Speech and the `hangover_frames` after it go
+    through unchanged, so the remote end-of-turn detection still hears the pause. Longer
+    silence is thinned to one comfort frame of digital silence every `comfort_interval`
+    frames, and the last `preroll_frames` before speech are replayed so word onsets survive.
+    """
+
+    def __init__(
+        self,
+        hangover_frames: int = 50,
+        comfort_interval: int = 5,
+        preroll_frames: int = 2,
+        margin_db: float = 9.0,
+        min_energy_db: float = -50.0,
+        zero_crossing_rate: float = 0.25,
+        noise_window_frames: int = 250,
+    ):
+        self.hangover_frames = hangover_frames
+        self.comfort_interval = comfort_interval
+        self.margin_db = margin_db
+        self.min_energy_db = min_energy_db
+        self.zero_crossing_rate = zero_crossing_rate
+        self.noise_floor_db = min_energy_db
+        self.stats = Counter()
+        # Minimum statistics over blocks, so the window slides without rescanning every frame
+        self._block_frames = max(noise_window_frames // 5, 1)
+        # Until a full window has been seen, assume the line starts out quiet
+        self._block_minima = deque([min_energy_db], maxlen=5)
+        self._block_min = float("inf")
+        self._block_count = 0
+        self._hangover = 0
+        self._since_comfort = 0
+        self._preroll = deque(maxlen=preroll_frames)
+
+    def features(self, frame: bytes) -> tuple[float, float]:
+        """Energy in dBFS and zero-crossing rate of a mu-law frame."""
+        samples = ULAW_DECODE[np.frombuffer(frame, dtype=np.uint8)].astype(np.float32)
+        energy = float(np.dot(samples, samples)) / len(samples) / FULL_SCALE_ENERGY
+        crossings = np.count_nonzero(np.signbit(samples[1:]) != np.signbit(samples[:-1]))
+        return 10 * math.log10(energy + 1e-12), crossings / max(len(samples) - 1, 1)
+
+    def _track_noise_floor(self, energy_db: float):
+        self._block_min = min(self._block_min, energy_db)
+        self._block_count += 1
+        if self._block_count == self._block_frames:
+            self._block_minima.append(self._block_min)
+            self._block_min, self._block_count = float("inf"), 0
+        self.noise_floor_db = min(self._block_min, min(self._block_minima, default=self._block_min))
+
+    def is_speech(self, frame: bytes) -> bool:
+        energy_db, zero_crossing_rate = self.features(frame)
+        self._track_noise_floor(energy_db)
+        threshold = max(self.min_energy_db, self.noise_floor_db + self.margin_db)
+        return energy_db > threshold or (
+            zero_crossing_rate > self.zero_crossing_rate and energy_db > threshold - self.margin_db / 2
+        )
+
+    def filter(self, frame: bytes) -> list[bytes]:
+        if not frame:
+            return []
+        self.stats["frames"] += 1
+        if self.is_speech(frame):
+            self.stats["speech"] += 1
+            self._hangover = self.hangover_frames
+            frames = [*self._preroll, frame]
+            self._preroll.clear()
+        elif self._hangover > 0:
+            self._hangover -= 1
+            frames = [frame]
+        else:
+            self._since_comfort += 1
+            if self._since_comfort < self.comfort_interval:
+                self._preroll.append(frame)
+                return []
+            self._since_comfort = 0
+            self._preroll.clear()
+            frames = [bytes([ULAW_SILENCE]) * len(frame)]
+        self.stats["forwarded"] += len(frames)
+        return frames
+
+    def summary(self) -> dict:
+        frames = self.stats["frames"]
+        return {
+            "frames": frames,
+            "speech_frames": self.stats["speech"],
+            "forwarded_frames": self.stats["forwarded"],
+            "suppression_ratio": round(1 - self.stats["forwarded"] / frames, 3) if frames else 0.0,
+        }
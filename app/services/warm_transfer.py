@@ -0,0 +1,232 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Optional
+import httpx
+from twilio.twiml.voice_response import Dial, VoiceResponse
+
+from app.core.config import settings
+from app.core.logger import logger
+from app.core.tracing import tracer
+from app.services.call_state import CallStateStore, call_state
+
+ANSWERED_STATUS = "in-progress"
+UNANSWERED_STATUSES = {"busy", "no-answer", "failed", "canceled"}
+TRANSFER_MESSAGE = "Transferring you to a member of our staff. Please stay on the line."
+TRANSFER_FAILED_MESSAGE = (
+    "I'm sorry, I could not reach our staff. If this is an emergency, please hang up and dial 9 1 1."
+)
+
+def handoff_key(call_sid: str) -> str:
+    # Kept apart from the call's own state, which is dropped when the media stream closes
+    return f"{call_sid}:handoff"
+
+class WarmTransferService:
+    """Warm transfer of a call to a ring group of staff numbers.
+
+    The caller is moved into a conference while every number in the group is dialed, all at
+    once on a pooled async client. The first staff member to answer gets the call and the
+    other legs are cancelled. Answer and join times are measured from the moment the handoff
+    was detected. Transfer state lives in the call state store, so the status callbacks can
+    land on any worker.
+    """
+
+    def __init__(
+        self,
+        account_sid: str,
+        auth_token: str,
+        base_url: str,
+        from_number: str,
+        numbers: list[str],
+        ring_seconds: int = 20,
+        timeout: float = 5.0,
+        store: CallStateStore = call_state,
+    ):
+        self.auth = (account_sid, auth_token)
+        self.calls_url = f"{base_url.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Calls"
+        self.from_number = from_number
+        self.numbers = numbers
+        self.ring_seconds = ring_seconds
+        self.timeout = httpx.Timeout(timeout)
+        self.store = store
+        self.stats = Counter()
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        return self.open()
+
+    def open(self) -> httpx.AsyncClient:
+        # Opened at startup so a transfer does not wait for a TLS handshake
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(auth=self.auth, timeout=self.timeout)
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def _post(self, path: str, data: dict) -> Optional[dict]:
+        try:
+            response = await self.client.post(f"{self.calls_url}{path}", data=data)
+        except httpx.HTTPError as e:
+            logger.error(f"Twilio call request {path} failed: {e!r}")
+            return None
+        if response.status_code >= 400:
+            logger.error(f"Twilio returned {response.status_code} for {path}: {response.text}")
+            return None
+        return response.json()
+
+    @staticmethod
+    def _caller_twiml(conference: str) -> str:
+        response = VoiceResponse()
+        response.say(TRANSFER_MESSAGE)
+        dial = Dial()
+        # The caller hears hold music until a staff member joins
+        dial.conference(conference, start_conference_on_enter=False, end_conference_on_exit=True)
+        response.append(dial)
+        return str(response)
+
+    @staticmethod
+    def _staff_twiml(conference: str, reason: str, status_callback_url: str) -> str:
+        response = VoiceResponse()
+        response.say("This is an automated transfer from an AI assistant that has detected a potential human service.")
+        response.pause(length=1)
+        response.say(f"The caller reported: {reason}")
+        response.pause(length=1)
+        response.say("You will now be connected to the caller. Please provide assistance.")
+        dial = Dial()
+        dial.conference(
+            conference,
+            start_conference_on_enter=True,
+            end_conference_on_exit=True,
+            status_callback=status_callback_url,
+            status_callback_event="join",
+        )
+        response.append(dial)
+        return str(response)
+
+    @staticmethod
+    def _transfer_failed_twiml() -> str:
+        response = VoiceResponse()
+        response.say(TRANSFER_FAILED_MESSAGE)
+        return str(response)
+
+    @staticmethod
+    def _answered_elsewhere_twiml() -> str:
+        response = VoiceResponse()
+        response.say("This call was already answered by a colleague. Thank you.")
+        response.hangup()
+        return str(response)
+
+    async def transfer(self, call_sid: str, reason: str, detected_at: float, status_callback_url: str) -> bool:
+        """Move the caller into a conference and ring the whole group. Returns whether the caller
+        was moved and at least one staff number is ringing.
+
+        If the caller was moved but no staff number could be dialed, they are told to hang up
+        and dial emergency services; if they could not be moved, their media stream is still up
+        and telling them is up to the caller of this method.
+        """
+        if not self.numbers:
+            logger.error("Cannot transfer: HUMAN_HANDOFF_NUMBERS is not configured")
+            return False
+        key = handoff_key(call_sid)
+        conference = f"human_handoff_{call_sid}"
+        status_callback_url = f"{status_callback_url}?call_sid={call_sid}"
+        await self.store.update(key, {"detected_at": detected_at, "legs": []})
+
+        with tracer.span("handoff.transfer", ring_group=len(self.numbers)) as span:
+            staff_twiml = self._staff_twiml(conference, reason, status_callback_url)
+            # Staff phones take seconds to ring: dial them while the caller is moved, not after
+            moved, *legs = await asyncio.gather(
+                self._post(f"/{call_sid}.json", {"Twiml": self._caller_twiml(conference)}),
+                *(
+                    self._post(".json", {
+                        "To": number,
+                        "From": self.from_number,
+                        "Twiml": staff_twiml,
+                        "Timeout": self.ring_seconds,
+                        "StatusCallback": status_callback_url,
+                        "StatusCallbackEvent": ["answered", "completed"],
+                    })
+                    for number in self.numbers
+                )
+            )
+            leg_sids = [leg["sid"] for leg in legs if leg]
+            span.set_attributes({"caller_moved": moved is not None, "legs": len(leg_sids)})
+
+        await self.store.update(key, {"legs": leg_sids})
+        # A leg may have been answered before its siblings were recorded
+        answered_by = (await self.store.get(key)).get("answered_by")
+        if answered_by:
+            await self._cancel_legs(leg_sids, answered_by)
+
+        self.stats["transfers"] += 1
+        if moved is None:
+            logger.error(f"Could not move call {call_sid} into conference {conference}")
+        elif not leg_sids:
+            logger.error(f"Could not dial any staff number for call {call_sid}")
+            await self._post(f"/{call_sid}.json", {"Twiml": self._transfer_failed_twiml()})
+        logger.info(
+            f"Call {call_sid} transferred to conference {conference}, ringing {len(leg_sids)} of {len(self.numbers)} "
+            f"staff numbers {(time.time() - detected_at) * 1000:.0f}ms after the handoff was detected"
+        )
+        return moved is not None and bool(leg_sids)
+
+    async def _cancel_legs(self, leg_sids: list[str], answered_by: str):
+        # Only ringing legs can be cancelled; a leg answered at the same time hangs itself up
+        await asyncio.gather(*(
+            self._post(f"/{leg_sid}.json", {"Status": "canceled"})
+            for leg_sid in leg_sids if leg_sid != answered_by
+        ))
+
+    async def handle_status(self, call_sid: Optional[str], form: dict):
+        """Status callback of a staff leg or of its conference participant."""
+        if not call_sid:
+            return
+        tracer.bind_call(call_sid)
+        key = handoff_key(call_sid)
+        state = await self.store.get(key)
+        if not state:
+            logger.warning(f"Status callback for unknown transfer of call {call_sid}")
+            return
+        leg_sid = form.get("CallSid")
+        latency_ms = round((time.time() - state["detected_at"]) * 1000, 1)
+
+        if form.get("StatusCallbackEvent") == "participant-join":
+            if await self.store.claim(key, "joined_by", leg_sid):
+                self.stats["joined"] += 1
+                with tracer.span("handoff.agent_joined", latency_ms=latency_ms):
+                    logger.info(f"Staff joined call {call_sid} {latency_ms:.0f}ms after the handoff was detected")
+            return
+
+        status = form.get("CallStatus")
+        if status == ANSWERED_STATUS:
+            if await self.store.claim(key, "answered_by", leg_sid):
+                self.stats["answered"] += 1
+                with tracer.span("handoff.answered", latency_ms=latency_ms):
+                    logger.info(f"{form.get('To')} answered the transfer of call {call_sid} after {latency_ms:.0f}ms")
+                await self._cancel_legs(state.get("legs", []), leg_sid)
+            else:
+                await self._post(f"/{leg_sid}.json", {"Twiml": self._answered_elsewhere_twiml()})
+        elif status in UNANSWERED_STATUSES:
+            await self.store.claim(key, f"unanswered:{leg_sid}")
+            state = await self.store.get(key)
+            legs = state.get("legs", [])
+            if "answered_by" not in state and legs and all(f"unanswered:{leg}" in state for leg in legs):
+                if await self.store.claim(key, "unanswered_reported"):
+                    self.stats["unanswered"] += 1
+                    logger.error(f"Nobody in the ring group answered the transfer of call {call_sid}")
+                    # Otherwise the caller is left on hold music in an empty conference
+                    await self._post(f"/{call_sid}.json", {"Twiml": self._transfer_failed_twiml()})
+
+warm_transfer_service = WarmTransferService(
+    account_sid=settings.TWILIO_ACCOUNT_SID,
+    auth_token=settings.TWILIO_AUTH_TOKEN,
+    base_url=settings.TWILIO_API_BASE_URL,
+    from_number=settings.TWILIO_PHONE_NUMBER,
+    numbers=settings.HUMAN_HANDOFF_NUMBERS,
+    ring_seconds=settings.HUMAN_HANDOFF_RING_SECONDS,
+    timeout=settings.HUMAN_HANDOFF_TIMEOUT_SECONDS,
+)
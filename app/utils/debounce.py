@@ -0,0 +1,61 @@
+import asyncio
+import contextvars
+from typing import Awaitable, Callable, Optional
+
+from app.core.logger import logger
+
+class DebouncedRunner:
+    """Run a coroutine on the event loop after a quiet period, restarting it on every trigger.
+
+    A trigger that arrives while the coroutine is still running cancels it, so only work
+    for the most recent input ever completes. `trigger` is safe to call from any thread.
+    """
+
+    def __init__(
+        self,
+        coro_factory: Callable[[], Awaitable[None]],
+        debounce_seconds: float,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ):
+        self.coro_factory = coro_factory
+        self.debounce_seconds = debounce_seconds
+        self.loop = loop or asyncio.get_event_loop()
+        self.runs_started = 0
+        self.runs_cancelled = 0
+        self._task: Optional[asyncio.Task] = None
+        self._closed = False
+        # Triggers arrive from other threads, so runs use the creator's context (e.g. the call trace)
+        self._context = contextvars.copy_context()
+
+    def trigger(self):
+        if self._closed:
+            return
+        self.loop.call_soon_threadsafe(self._restart)
+
+    def _restart(self):
+        if self._closed:
+            return
+        if self._task and not self._task.done():
+            self._task.cancel()
+            self.runs_cancelled += 1
+        self._task = self.loop.create_task(self._run(), context=self._context.copy())
+
+    async def _run(self):
+        await asyncio.sleep(self.debounce_seconds)
+        self.runs_started += 1
+        try:
+            await self.coro_factory()
+        except Exception as e:
+            logger.error(f"Error in debounced task: {e}")
+
+    async def flush(self):
+        """Wait until the run for the latest trigger has finished."""
+        while self._task and not self._task.done():
+            # asyncio.wait does not propagate the task's own cancellation to us
+            await asyncio.wait({self._task})
+
+    def close(self):
+        """Cancel any pending run. Further triggers are ignored."""
+        self._closed = True
+        if self._task and not self._task.done():
+            self._task.cancel()
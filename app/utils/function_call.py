@@ -1,18 +1,158 @@
-from langchain_core.messages import SystemMessage
+import asyncio
+import copy
+import hashlib
+from typing import Optional
+from langchain_core.messages import BaseMessage, SystemMessage
 from langchain_openai import ChatOpenAI
 
 from app.core.config import settings, ModelType
 from app.core.function_templates.functions import functions
+from app.core.logger import logger
+from app.core.prompts import Prompt
+from app.core.tracing import tracer
+from app.services.call_capture import RecordKind, current_capture
+from app.utils.cache import TTLCache
 
 model = ChatOpenAI(
     model=ModelType.GPT4O,
-    openai_api_key=settings.OPENAI_API_KEY
+    openai_api_key=settings.OPENAI_API_KEY,
+    base_url=settings.OPENAI_BASE_URL or None
 )
 
-def function_call(prompt, function_name):
-    model_ = model.bind_tools(functions, tool_choice=function_name)
-    messages = [SystemMessage(prompt)]
-    function_call = model_.invoke(messages).tool_calls
-    result = function_call[0]['args']
+class _InFlight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
 
-    return result
+class FunctionCallGateway:
+    """Async entry point for OpenAI function calls.
+
+    Every tool in `functions.py` is bound once per model instead of on every call. In-flight
+    requests are capped per process, identical requests (same model, function and prompt)
+    share one round trip, and successful results are cached with TTL/LRU eviction so
+    re-running detection over an unchanged transcript is free. Prompts from the registry are
+    sent as their fixed instructions followed by the request's context, see `PromptTemplate`.
+    """
+
+    def __init__(self, default_model: ChatOpenAI, max_concurrency: int, cache: TTLCache):
+        self.default_model_type = ModelType(default_model.model_name)
+        self.max_concurrency = max_concurrency
+        self.cache = cache
+        self._models = {self.default_model_type: default_model}
+        self._bound = {self.default_model_type: self._bind_tools(default_model)}
+        self._inflight: dict[str, _InFlight] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._semaphore_loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @staticmethod
+    def _bind_tools(chat_model: ChatOpenAI) -> dict:
+        return {
+            function["function"]["name"]: chat_model.bind_tools([function], tool_choice=function["function"]["name"])
+            for function in functions
+        }
+
+    def bound_tool(self, function_name: str, model_type: Optional[ModelType] = None):
+        """Return the model with `function_name` bound as its only, forced tool."""
+        model_type = ModelType(model_type or self.default_model_type)
+        if model_type not in self._bound:
+            self._models[model_type] = ChatOpenAI(model=model_type, openai_api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL or None)
+            self._bound[model_type] = self._bind_tools(self._models[model_type])
+        return self._bound[model_type][function_name]
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # A semaphore belongs to one event loop; recreate it if the gateway is used from a new one
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    @staticmethod
+    def cache_key(prompt: str | Prompt, function_name: str, model_type: ModelType) -> str:
+        # A template's instructions never change, its name stands in for them
+        text = f"{prompt.template.name}\0{prompt.context}" if isinstance(prompt, Prompt) else prompt
+        return hashlib.sha256(f"{model_type.value}\0{function_name}\0{text}".encode()).hexdigest()
+
+    @staticmethod
+    def _messages(prompt: str | Prompt) -> list[BaseMessage]:
+        return prompt.messages() if isinstance(prompt, Prompt) else [SystemMessage(prompt)]
+
+    @staticmethod
+    def _capture(function_name: str, model_type: ModelType, result: dict):
+        capture = current_capture()
+        if capture:
+            capture.record_json(RecordKind.FUNCTION_CALL, {"function": function_name, "model": model_type.value, "result": result})
+
+    @staticmethod
+    def _record_usage(span, response):
+        usage = response.usage_metadata or {}
+        input_tokens = usage.get("input_tokens")
+        # Input tokens served from the provider's prompt prefix cache
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+        span.set_attributes({
+            "input_tokens": input_tokens,
+            "cached_input_tokens": cached_tokens,
+            "uncached_input_tokens": input_tokens - cached_tokens if input_tokens is not None else None,
+            "output_tokens": usage.get("output_tokens"),
+        })
+
+    async def _invoke(self, key: str, prompt: str | Prompt, function_name: str, model_type: ModelType) -> dict:
+        bound = self.bound_tool(function_name, model_type)
+        async with self._get_semaphore():
+            with tracer.span("llm.function_call", function_name=function_name, model=model_type.value) as span:
+                response = await bound.ainvoke(self._messages(prompt))
+                self._record_usage(span, response)
+        result = response.tool_calls[0]['args']
+        self._capture(function_name, model_type, result)
+        self.cache.set(key, result)
+        return result
+
+    async def call(self, prompt: str | Prompt, function_name: str, model_type: Optional[ModelType] = None) -> dict:
+        model_type = ModelType(model_type or self.default_model_type)
+        key = self.cache_key(prompt, function_name, model_type)
+        result = self.cache.get(key)
+        if result is not None:
+            logger.debug(f"Function call cache hit: {function_name}")
+            return copy.deepcopy(result)
+
+        inflight = self._inflight.get(key)
+        if inflight is None:
+            inflight = _InFlight(asyncio.ensure_future(self._invoke(key, prompt, function_name, model_type)))
+            self._inflight[key] = inflight
+            inflight.task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        inflight.waiters += 1
+        try:
+            # Shielded so one cancelled caller does not fail the others sharing this request
+            return copy.deepcopy(await asyncio.shield(inflight.task))
+        finally:
+            inflight.waiters -= 1
+            # Nobody is waiting any more (e.g. a debounced run was superseded): stop paying for it
+            if inflight.waiters == 0 and not inflight.task.done():
+                inflight.task.cancel()
+
+    def call_sync(self, prompt: str | Prompt, function_name: str, model_type: Optional[ModelType] = None) -> dict:
+        model_type = ModelType(model_type or self.default_model_type)
+        key = self.cache_key(prompt, function_name, model_type)
+        result = self.cache.get(key)
+        if result is None:
+            with tracer.span("llm.function_call", function_name=function_name, model=model_type.value) as span:
+                response = self.bound_tool(function_name, model_type).invoke(self._messages(prompt))
+                self._record_usage(span, response)
+            result = response.tool_calls[0]['args']
+            self._capture(function_name, model_type, result)
+            self.cache.set(key, result)
+        return copy.deepcopy(result)
+
+gateway = FunctionCallGateway(
+    model,
+    max_concurrency=settings.OPENAI_MAX_CONCURRENCY,
+    cache=TTLCache(settings.FUNCTION_CALL_CACHE_MAX_ENTRIES, settings.FUNCTION_CALL_CACHE_TTL_SECONDS),
+)
+
+async def afunction_call(prompt, function_name, model_type=None):
+    return await gateway.call(prompt, function_name, model_type)
+
+def function_call(prompt, function_name, model_type=None):
+    """Blocking variant for scripts and threads; async code should await `afunction_call`."""
+    return gateway.call_sync(prompt, function_name, model_type)
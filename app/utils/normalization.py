@@ -0,0 +1,283 @@
+import re
+from datetime import date, datetime, time, timedelta, tzinfo
+from functools import lru_cache
+from typing import Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from app.core.config import settings
+from app.core.logger import logger
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0, "tuesday": 1, "tue": 1, "tues": 1, "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3, "friday": 4, "fri": 4,
+    "saturday": 5, "sat": 5, "sunday": 6, "sun": 6,
+}
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4,
+    "may": 5, "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8,
+    "september": 9, "sep": 9, "sept": 9, "october": 10, "oct": 10, "november": 11, "nov": 11,
+    "december": 12, "dec": 12,
+}
+NUMBER_WORDS = {
+    "zero": 0, "oh": 0, "one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "six": 6, "seven": 7,
+    "eight": 8, "nine": 9, "ten": 10, "eleven": 11, "twelve": 12, "a": 1, "an": 1,
+}
+SPOKEN_DIGITS = {word: str(number) for word, number in NUMBER_WORDS.items() if number < 10 and word not in ("a", "an")}
+# Minutes as spoken after the hour ("three thirty", "ten oh five", "four forty-five")
+MINUTE_WORDS = {
+    "ten": 10, "eleven": 11, "twelve": 12, "thirteen": 13, "fourteen": 14, "fifteen": 15, "sixteen": 16,
+    "seventeen": 17, "eighteen": 18, "nineteen": 19, "twenty": 20, "thirty": 30, "forty": 40, "fifty": 50,
+}
+# Times of day a caller may give instead of a clock time
+DAY_PERIODS = {"morning": time(9), "afternoon": time(14), "evening": time(17), "noon": time(12), "midday": time(12), "midnight": time(0)}
+# Words that may surround a date or time without changing it
+FILLER_WORDS = {"at", "on", "the", "for", "in", "of", "around", "about", "approximately", "roughly", "by", "please", "say", "um", "uh", "ish"}
+
+_WEEKDAY = "|".join(WEEKDAYS)
+_MONTH = "|".join(sorted(MONTHS, key=len, reverse=True))
+_NUMBER = r"\d{1,2}|" + "|".join(NUMBER_WORDS)
+_HOUR = r"\d{1,2}|" + "|".join(word for word, number in NUMBER_WORDS.items() if number >= 1 and word not in ("a", "an"))
+_DIGIT_WORD = "|".join(word for word, number in NUMBER_WORDS.items() if 1 <= number <= 9 and word not in ("a", "an"))
+_MINUTES = rf"oh[\s-]+(?:{_DIGIT_WORD})|(?:twenty|thirty|forty|fifty)(?:[\s-]+(?:{_DIGIT_WORD}))?|{'|'.join(MINUTE_WORDS)}"
+
+_ISO_DATE = re.compile(r"\b(\d{4})-(\d{1,2})-(\d{1,2})\b")
+_NUMERIC_DATE = re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2}|\d{4}))?\b")
+_MONTH_DAY = re.compile(rf"\b({_MONTH})\.?\s+(\d{{1,2}})(?:,?\s+(\d{{4}}))?\b")
+_DAY_MONTH = re.compile(rf"\b(\d{{1,2}})\s+(?:of\s+)?({_MONTH})\b(?:,?\s+(\d{{4}}))?")
+_RELATIVE_DAYS = re.compile(rf"\bin\s+({_NUMBER})\s+(day|week)s?\b")
+_FROM_DAY = re.compile(rf"\b({_NUMBER})\s+(day|week)s?\s+from\s+(today|tomorrow|(?:(?:this|next|coming)\s+)?(?:{_WEEKDAY}))\b")
+_WEEKDAY_NAME = re.compile(rf"\b(?:(this|next|coming)\s+)?({_WEEKDAY})\b(\s+next\s+week)?")
+_RELATIVE_WORDS = re.compile(r"\b(day after tomorrow|tomorrow|today|tonight|this (morning|afternoon|evening))\b")
+_CLOCK_12H = re.compile(r"\b(\d{1,2})(?::([0-5]\d))?\s*(am|pm)\b")
+_CLOCK = re.compile(r"\b([01]?\d|2[0-3]):([0-5]\d)\b")
+_SPOKEN_CLOCK = re.compile(rf"\b({_HOUR})\s+({_MINUTES})\b(?:\s*(am|pm)\b)?")
+_PAST_HOUR = re.compile(rf"\b(half|quarter|{_MINUTES}|\d{{1,2}})\s+(?:minutes?\s+)?(past|after|to|till|before)\s+({_HOUR})\b(?:\s*(am|pm)\b)?")
+_AT_HOUR = re.compile(rf"\b(?:at\s+({_NUMBER})|({_NUMBER})\s+o'?clock)\b")
+_DAY_OF_MONTH = re.compile(r"\bthe\s+(\d{1,2})\b")
+_BARE_HOUR = re.compile(r"^\s*(\d{1,2})\s*$")
+_ORDINAL = re.compile(r"\b(\d{1,2})(st|nd|rd|th)\b")
+_PERIOD_WORDS = re.compile(rf"\b(in the|this)?\s*({'|'.join(DAY_PERIODS)}|tonight)\b")
+_FILLER = re.compile(rf"\b({'|'.join(FILLER_WORDS)})\b")
+# Everything a date or time span may be made of, longest forms first
+_RECOGNISED = (
+    _ISO_DATE, _NUMERIC_DATE, _MONTH_DAY, _DAY_MONTH, _FROM_DAY, _RELATIVE_DAYS, _RELATIVE_WORDS, _WEEKDAY_NAME,
+    _CLOCK_12H, _CLOCK, _PAST_HOUR, _SPOKEN_CLOCK, _AT_HOUR, _DAY_OF_MONTH, _BARE_HOUR, _PERIOD_WORDS, _FILLER,
+)
+
+@lru_cache()
+def practice_timezone() -> tzinfo:
+    """The practice's timezone (PRACTICE_TIMEZONE), or the server's local one if unset."""
+    if settings.PRACTICE_TIMEZONE:
+        try:
+            return ZoneInfo(settings.PRACTICE_TIMEZONE)
+        except ZoneInfoNotFoundError:
+            logger.error(f"Unknown PRACTICE_TIMEZONE {settings.PRACTICE_TIMEZONE!r}, using the server timezone")
+    return datetime.now().astimezone().tzinfo
+
+def now_in_practice() -> datetime:
+    return datetime.now(practice_timezone())
+
+def _number(text: str) -> int:
+    return int(text) if text.isdigit() else NUMBER_WORDS[text]
+
+def _minutes(text: str) -> int:
+    words = re.split(r"[\s-]+", text)
+    if words[0] == "oh":
+        return NUMBER_WORDS[words[1]]
+    return MINUTE_WORDS[words[0]] + (NUMBER_WORDS[words[1]] if len(words) > 1 else 0)
+
+def _clean(text: str) -> str:
+    text = text.lower().replace("a.m.", "am").replace("p.m.", "pm")
+    return _ORDINAL.sub(r"\1", text)
+
+def _fully_recognised(text: str) -> bool:
+    """Whether every word of the span is part of a date or time expression (or filler), so that
+    a partly understood span ("a week from Monday" read as "Monday") is rejected, not guessed."""
+    for pattern in _RECOGNISED:
+        text = pattern.sub(" ", text)
+    return not re.search(r"[a-z0-9]", text)
+
+def _date_or_none(year: int, month: int, day: int) -> Optional[date]:
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def _upcoming(today: date, month: int, day: int, year: Optional[str]) -> Optional[date]:
+    """A month and day without a year means the next time that date comes around."""
+    if year:
+        return _date_or_none(int(year) + (2000 if len(year) == 2 else 0), month, day)
+    candidate = _date_or_none(today.year, month, day)
+    if candidate and candidate < today:
+        candidate = _date_or_none(today.year + 1, month, day)
+    return candidate
+
+def _next_weekday(today: date, match: re.Match) -> date:
+    # The nearest upcoming one; a weekday named on that same day means a week out
+    days_ahead = (WEEKDAYS[match[2]] - today.weekday()) % 7 or 7
+    if match[3]:
+        # "Tuesday next week": the Tuesday of the following calendar week
+        days_ahead = WEEKDAYS[match[2]] - today.weekday() + 7
+    return today + timedelta(days=days_ahead)
+
+def _resolve_date(text: str, today: date) -> Optional[date]:
+    if match := _ISO_DATE.search(text):
+        return _date_or_none(int(match[1]), int(match[2]), int(match[3]))
+    if match := _NUMERIC_DATE.search(text):
+        return _upcoming(today, int(match[1]), int(match[2]), match[3])
+    if match := _MONTH_DAY.search(text):
+        return _upcoming(today, MONTHS[match[1]], int(match[2]), match[3])
+    if match := _DAY_MONTH.search(text):
+        return _upcoming(today, MONTHS[match[2]], int(match[1]), match[3])
+    if match := _FROM_DAY.search(text):
+        # "A week from Monday": counted from that day, not from today
+        start = match[3]
+        if start == "today":
+            base = today
+        elif start == "tomorrow":
+            base = today + timedelta(days=1)
+        else:
+            base = _next_weekday(today, _WEEKDAY_NAME.search(start))
+        return base + timedelta(days=_number(match[1]) * (7 if match[2] == "week" else 1))
+    if "day after tomorrow" in text:
+        return today + timedelta(days=2)
+    if "tomorrow" in text:
+        return today + timedelta(days=1)
+    if re.search(r"\b(today|tonight|this (morning|afternoon|evening))\b", text):
+        return today
+    if match := _RELATIVE_DAYS.search(text):
+        days = _number(match[1]) * (7 if match[2] == "week" else 1)
+        return today + timedelta(days=days)
+    if match := _DAY_OF_MONTH.search(text):
+        # "The 5th": this month's if it hasn't passed, else next month's; with a weekday
+        # ("Friday the 13th") whichever of the two falls on it
+        next_month = date(today.year + today.month // 12, today.month % 12 + 1, 1)
+        candidates = [
+            candidate for candidate in (
+                _date_or_none(today.year, today.month, int(match[1])),
+                _date_or_none(next_month.year, next_month.month, int(match[1])),
+            )
+            if candidate and candidate >= today
+        ]
+        if weekday := _WEEKDAY_NAME.search(text):
+            candidates = [candidate for candidate in candidates if candidate.weekday() == WEEKDAYS[weekday[2]]]
+        return candidates[0] if candidates else None
+    if match := _WEEKDAY_NAME.search(text):
+        return _next_weekday(today, match)
+    return None
+
+def parse_date(text: str, today: Optional[date] = None) -> Optional[date]:
+    """Resolve a spoken or written date ("2025-03-14", "3/14", "March 14th", "tomorrow",
+    "next Tuesday", "in two weeks", "a week from Monday") against today's date in the practice
+    timezone. Returns None if any part of the span is not understood, or if a weekday it names
+    does not match the date."""
+    if not text:
+        return None
+    today = today or now_in_practice().date()
+    text = _clean(text)
+    if not _fully_recognised(text):
+        return None
+
+    resolved = _resolve_date(text, today)
+    weekday = _WEEKDAY_NAME.search(text)
+    if resolved and weekday and resolved.weekday() != WEEKDAYS[weekday[2]]:
+        return None
+    return resolved
+
+def _clinic_hour(hour: int, period: Optional[str]) -> int:
+    """Turn a bare hour into 24h, using the day period if given, else office hours (7-11 AM, 12-6 PM)."""
+    if period == "am":
+        return 0 if hour == 12 else hour
+    if period == "pm":
+        return hour if hour == 12 else hour + 12
+    return hour + 12 if 1 <= hour <= 6 else hour
+
+def parse_time(text: str) -> Optional[time]:
+    """Resolve a spoken or written time ("3:30 PM", "15:30", "at three", "three thirty",
+    "quarter to four", "noon", "morning"). Returns None if any part of the span is not understood."""
+    if not text:
+        return None
+    text = _clean(text)
+    if not _fully_recognised(text):
+        return None
+    period = "am" if "morning" in text else "pm" if re.search(r"\b(afternoon|evening|tonight)\b", text) else None
+
+    if match := _CLOCK_12H.search(text):
+        hour, minute = int(match[1]), int(match[2] or 0)
+        if 1 <= hour <= 12:
+            return time(_clinic_hour(hour, match[3]), minute)
+        return None
+    if match := _CLOCK.search(text):
+        hour, minute = int(match[1]), int(match[2])
+        return time(hour if hour == 0 or hour > 12 else _clinic_hour(hour, period), minute)
+    if match := _PAST_HOUR.search(text):
+        hour = _number(match[3])
+        minute = {"half": 30, "quarter": 15}.get(match[1]) or (int(match[1]) if match[1].isdigit() else _minutes(match[1]))
+        if not 1 <= hour <= 12 or not 0 < minute < 60:
+            return None
+        if match[2] in ("to", "till", "before"):
+            hour, minute = hour - 1 or 12, 60 - minute
+        return time(_clinic_hour(hour, match[4] or period), minute)
+    if match := _SPOKEN_CLOCK.search(text):
+        hour, minute = _number(match[1]), _minutes(match[2])
+        if 1 <= hour <= 12 and minute < 60:
+            return time(_clinic_hour(hour, match[3] or period), minute)
+        return None
+    if match := _AT_HOUR.search(text) or _BARE_HOUR.match(text):
+        hour = _number(next(group for group in match.groups() if group))
+        if 1 <= hour <= 12:
+            return time(_clinic_hour(hour, period))
+        return None
+    for word, default in DAY_PERIODS.items():
+        if re.search(rf"\b{word}\b", text):
+            return default
+    return None
+
+def parse_datetime(date_text: str, time_text: Optional[str] = None, now: Optional[datetime] = None) -> Optional[datetime]:
+    """Combine a date and time expression into an aware datetime in the practice timezone.
+
+    Either part may hold both ("next Tuesday at 3"); returns None if either cannot be resolved.
+    """
+    now = now or now_in_practice()
+    appointment_date = parse_date(date_text, now.date()) or parse_date(time_text or "", now.date())
+    appointment_time = parse_time(time_text) if time_text else parse_time(date_text)
+    if appointment_date is None or appointment_time is None:
+        return None
+    return datetime.combine(appointment_date, appointment_time, tzinfo=now.tzinfo)
+
+def normalize_phone_number(text: str) -> Optional[str]:
+    """Parse a written or spoken phone number to E.164. Numbers without a country code are
+    taken as North American (+1). Returns None if it isn't a plausible number."""
+    if not text:
+        return None
+    text = "".join(SPOKEN_DIGITS.get(word, word) for word in re.findall(r"[a-z]+|[^a-z]+", text.lower()))
+    digits = re.sub(r"\D", "", text)
+
+    if text.strip().startswith("+"):
+        return f"+{digits}" if 8 <= len(digits) <= 15 else None
+    if digits.startswith("011") and 11 <= len(digits) <= 18:
+        return f"+{digits[3:]}"
+    if len(digits) == 11 and digits.startswith("1"):
+        digits = digits[1:]
+    if len(digits) == 10 and digits[0] in "23456789":
+        return f"+1{digits}"
+    return None
+
+def normalize_appointment_fields(fields: dict, now: Optional[datetime] = None) -> dict:
+    """Resolve whatever date, time and phone spans can be resolved into canonical form
+    (YYYY-MM-DD, HH:MM AM/PM, E.164), leaving the rest as the caller said them."""
+    now = now or now_in_practice()
+    normalized = dict(fields)
+    if appointment_date := parse_date(fields.get("appointment_date") or "", now.date()):
+        normalized["appointment_date"] = appointment_date.isoformat()
+    if appointment_time := parse_time(fields.get("appointment_time") or ""):
+        normalized["appointment_time"] = appointment_time.strftime("%I:%M %p")
+    if phone_number := normalize_phone_number(fields.get("phone_number") or ""):
+        normalized["phone_number"] = phone_number
+    return normalized
+
+def to_fhir_datetime(value: datetime) -> str:
+    """FHIR dateTime with an explicit offset; naive values are taken as practice local time."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=practice_timezone())
+    return value.isoformat(timespec="seconds")
@@ -0,0 +1,97 @@
+import threading
+from bisect import bisect_left
+from typing import Callable, Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+
+from app.core.config import settings
+from app.core.logger import logger
+
+class TokenCounter:
+    """Count prompt tokens with tiktoken when it is available, else estimate ~4 characters per token.
+
+    tiktoken downloads its encoding on first use, so `load` should be called once at startup
+    rather than on the first caller turn.
+    """
+
+    def __init__(self, encoding_name: str = "o200k_base"):
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self._loaded:
+                return
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                logger.warning(f"tiktoken unavailable ({type(e).__name__}), estimating prompt tokens from length")
+            self._loaded = True
+
+    def count(self, text: str) -> int:
+        if not self._loaded:
+            self.load()
+        if self._encoding is not None:
+            return len(self._encoding.encode(text))
+        return len(text) // 4 + 1
+
+token_counter = TokenCounter()
+
+class TranscriptContext:
+    """Token-budgeted view of a call transcript for LLM prompts.
+
+    Formatted lines are appended incrementally as the history grows instead of re-joining the
+    whole conversation on every call. A prompt keeps the most recent turns that fit the budget;
+    older turns are replaced by one summary line built from `summary` (e.g. the slots already
+    confirmed), so prompt size stays flat however long the call runs.
+    """
+
+    def __init__(
+        self,
+        conversation_history: ChatMessageHistory,
+        max_tokens: Optional[int] = None,
+        summary: Optional[Callable[[], dict]] = None,
+        counter: TokenCounter = token_counter,
+    ):
+        self.conversation_history = conversation_history
+        self.max_tokens = settings.TRANSCRIPT_MAX_PROMPT_TOKENS if max_tokens is None else max_tokens
+        self.summary = summary
+        self.counter = counter
+        self._lines: list[str] = []
+        # _offsets[i] is the token count of lines[:i], so any window's size is one subtraction
+        self._offsets = [0]
+
+    def _sync(self):
+        messages = self.conversation_history.messages
+        for message in messages[len(self._lines):]:
+            line = f"{message.type}: {message.content}"
+            self._lines.append(line)
+            self._offsets.append(self._offsets[-1] + self.counter.count(line) + 1)
+
+    @property
+    def total_tokens(self) -> int:
+        self._sync()
+        return self._offsets[-1]
+
+    def _summary_line(self, omitted: int) -> str:
+        facts = {name: value for name, value in (self.summary() if self.summary else {}).items() if value}
+        confirmed = "; ".join(f"{name}: {value}" for name, value in facts.items()) or "nothing confirmed yet"
+        return f"summary: {omitted} earlier messages omitted. Confirmed so far: {confirmed}"
+
+    def format(self, max_tokens: Optional[int] = None) -> str:
+        """Return the transcript, or its most recent turns plus a summary if it exceeds the budget."""
+        self._sync()
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        end = len(self._lines)
+        if self._offsets[end] <= budget:
+            return "\n".join(self._lines)
+
+        summary = self._summary_line(0)
+        budget -= self.counter.count(summary) + 1
+        # First line such that everything from it to the end fits the remaining budget
+        start = bisect_left(self._offsets, self._offsets[end] - budget, hi=end)
+        # Always keep the latest turn, even if it alone exceeds the budget
+        start = min(start, end - 1)
+        return "\n".join([self._summary_line(start), *self._lines[start:end]])
@@ -1,9 +1,16 @@
-from langchain_community.chat_message_histories import ChatMessageHistory
 from datetime import datetime
+from typing import Optional
+from langchain_community.chat_message_histories import ChatMessageHistory
+from langchain_core.messages import BaseMessage
+
+from app.utils.normalization import now_in_practice
+
+def format_messages(messages: list[BaseMessage]) -> str:
+    return "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
 
 def format_conversation_history(messages: ChatMessageHistory) -> str:
-    return "\n".join([f"{msg.type}: {msg.content}" for msg in messages.messages])
+    return format_messages(messages.messages)
 
-def get_current_datetime():
-    now = datetime.now()
-    return f"date: {now.strftime('%Y-%m-%d')}, time: {now.strftime('%I:%M %p')}"
+def get_current_datetime(now: Optional[datetime] = None):
+    now = now or now_in_practice()
+    return f"date: {now.strftime('%Y-%m-%d')} ({now.strftime('%A')}), time: {now.strftime('%I:%M %p %Z')}"
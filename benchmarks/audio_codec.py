@@ -0,0 +1,113 @@
+"""CPU per call for converting between Twilio mu-law and the agent's PCM formats.
+
+Compares per-sample Python loops in the style of `audioop` (ulaw2lin/lin2ulaw plus a
+ratecv-like linear interpolator), `audioop` itself where it is still available, and the
+NumPy codec in `app.services.audio_codec`:
+
+    python -m benchmarks.audio_codec --seconds 60 --format pcm_16000
+"""
+import argparse
+import os
+import time
+import warnings
+
+from app.services.audio_codec import AgentAudioCodec, parse_audio_format
+
+FRAME_SECONDS = 0.02  # Twilio sends 20 ms frames
+AGENT_CHUNK_SECONDS = 0.1
+
+def ulaw_decode_sample(code: int) -> int:
+    code = ~code & 0xFF
+    magnitude = ((((code & 0x0F) << 3) + 0x84) << ((code >> 4) & 0x07)) - 0x84
+    return -magnitude if code & 0x80 else magnitude
+
+def ulaw_encode_sample(sample: int) -> int:
+    sample >>= 2
+    mask = 0x7F if sample < 0 else 0xFF
+    magnitude = min(abs(sample), 8159) + 33
+    segment = magnitude.bit_length() - 6
+    if segment > 7:
+        return 0x7F ^ mask
+    return ((segment << 4) | ((magnitude >> (segment + 1)) & 0x0F)) ^ mask
+
+class LoopCodec:
+    """Per-sample loops, converting the way audioop.ulaw2lin/lin2ulaw/ratecv do."""
+
+    def __init__(self, agent_rate: int):
+        self.agent_rate = agent_rate
+        self._inbound = [0.0, 0]  # position, previous sample
+        self._outbound = [0.0, 0]
+
+    @staticmethod
+    def _ratecv(samples: list[int], from_rate: int, to_rate: int, state: list) -> list[int]:
+        position, previous = state
+        step = from_rate / to_rate
+        output = []
+        for i, sample in enumerate(samples):
+            while position <= i:
+                fraction = position - (i - 1)
+                output.append(int(previous + (sample - previous) * fraction))
+                position += step
+            previous = sample
+        state[0], state[1] = position - len(samples), previous
+        return output
+
+    def to_agent(self, ulaw: bytes) -> bytes:
+        samples = self._ratecv([ulaw_decode_sample(b) for b in ulaw], 8000, self.agent_rate, self._inbound)
+        return b"".join(s.to_bytes(2, "little", signed=True) for s in samples)
+
+    def from_agent(self, pcm: bytes) -> bytes:
+        samples = [int.from_bytes(pcm[i:i + 2], "little", signed=True) for i in range(0, len(pcm), 2)]
+        return bytes(ulaw_encode_sample(s) for s in self._ratecv(samples, self.agent_rate, 8000, self._outbound))
+
+class AudioopCodec:
+    def __init__(self, audioop, agent_rate: int):
+        self.audioop = audioop
+        self.agent_rate = agent_rate
+        self._inbound = None
+        self._outbound = None
+
+    def to_agent(self, ulaw: bytes) -> bytes:
+        pcm, self._inbound = self.audioop.ratecv(self.audioop.ulaw2lin(ulaw, 2), 2, 1, 8000, self.agent_rate, self._inbound)
+        return pcm
+
+    def from_agent(self, pcm: bytes) -> bytes:
+        pcm, self._outbound = self.audioop.ratecv(pcm, 2, 1, self.agent_rate, 8000, self._outbound)
+        return self.audioop.lin2ulaw(pcm, 2)
+
+def measure(label: str, codec, inbound: list[bytes], outbound: list[bytes], seconds: float):
+    started = time.process_time()
+    for frame in inbound:
+        codec.to_agent(frame)
+    for chunk in outbound:
+        codec.from_agent(chunk)
+    elapsed = time.process_time() - started
+    # Both directions for the whole call, as a share of one core
+    print(
+        f"{label:<24} {elapsed * 1e6 / len(inbound):>9.1f} us per 20 ms frame  "
+        f"{elapsed / seconds * 100:>7.3f}% of a core per call  ({seconds / elapsed:,.0f} calls/core)"
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=60.0, help="seconds of call audio in each direction")
+    parser.add_argument("--format", default="pcm_16000", help="agent input and output format")
+    args = parser.parse_args()
+
+    _, agent_rate = parse_audio_format(args.format)
+    inbound = [os.urandom(int(8000 * FRAME_SECONDS)) for _ in range(round(args.seconds / FRAME_SECONDS))]
+    chunk_bytes = int(agent_rate * AGENT_CHUNK_SECONDS) * 2
+    outbound = [os.urandom(chunk_bytes) for _ in range(round(args.seconds / AGENT_CHUNK_SECONDS))]
+
+    measure("per-sample loops", LoopCodec(agent_rate), inbound, outbound, args.seconds)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", DeprecationWarning)
+            import audioop
+        measure("audioop", AudioopCodec(audioop, agent_rate), inbound, outbound, args.seconds)
+    except ImportError:
+        print("audioop                  not available (removed in Python 3.13)")
+    measure("numpy polyphase", AgentAudioCodec(args.format, args.format), inbound, outbound, args.seconds)
+
+if __name__ == "__main__":
+    main()
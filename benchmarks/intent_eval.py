@@ -0,0 +1,109 @@
+"""Evaluate the tiered intent classifier over recorded transcripts.
+
+Reports accuracy, escalation rate and mean latency per tier, against GPT-4o on every turn:
+
+    python -m benchmarks.intent_eval
+    python -m benchmarks.intent_eval --live  # real OpenAI calls, needs OPENAI_API_KEY
+
+Transcripts are JSON lines: {"id": ..., "expected": "new_appointment" | "reschedule" |
+"human_handoff", "messages": [{"type": "human" | "ai", "content": ...}]}. Without --live the
+model tiers are answered by a stub that returns the expected label after a fixed latency, so
+only the local tier's accuracy and the escalation rate are real measurements.
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from benchmarks.stubs import configure_environment
+
+DEFAULT_TRANSCRIPTS = Path(__file__).parent / "data" / "intent_transcripts.jsonl"
+
+def load_transcripts(path: Path) -> list[dict]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+class OracleModel:
+    """Stands in for OpenAI offline: answers with the expected label after the tier's latency."""
+
+    def __init__(self, latencies: dict):
+        self.latencies = latencies
+        self.expected = None
+
+    async def __call__(self, prompt: str, function_name: str, model_type=None) -> dict:
+        await asyncio.sleep(self.latencies[model_type])
+        return {"action_type": self.expected, "reason": "oracle", "existing_appointment_mentioned": False}
+
+async def evaluate(transcripts: list[dict], live: bool, small_latency: float, large_latency: float):
+    from langchain_community.chat_message_histories import ChatMessageHistory
+    from langchain_core.messages import messages_from_dict
+    from app.core.config import ModelType
+    from app.services.intent_classifier import TieredIntentClassifier
+    from app.utils.function_call import afunction_call, gateway
+
+    async def live_model(prompt: str, function_name: str, model_type=None) -> dict:
+        # Every tier and the baseline see the same prompt, don't let them share cached answers
+        gateway.cache.clear()
+        return await afunction_call(prompt, function_name, model_type)
+
+    oracle = OracleModel({ModelType.GPT4O_MINI: small_latency, ModelType.GPT4O: large_latency})
+    model = live_model if live else oracle
+    classifier = TieredIntentClassifier(function_caller=model)
+
+    decided_by = defaultdict(lambda: [0, 0])
+    correct = baseline_correct = 0
+    baseline_seconds = 0.0
+    for transcript in transcripts:
+        history = ChatMessageHistory(messages=messages_from_dict(
+            [{"type": message["type"], "data": {"content": message["content"]}} for message in transcript["messages"]]
+        ))
+        oracle.expected = transcript["expected"]
+
+        result = await classifier.classify(history)
+        hit = result["action_type"] == transcript["expected"]
+        correct += hit
+        decided_by[result["tier"]][0] += 1
+        decided_by[result["tier"]][1] += hit
+        if not hit:
+            print(f"  miss {transcript['id']}: expected {transcript['expected']}, {result['tier']} said {result['action_type']}")
+
+        # Previous behaviour: GPT-4o on the whole conversation every time
+        started = time.perf_counter()
+        result = await model(_detect_prompt(history), "detect_appointment_action", ModelType.GPT4O)
+        baseline_seconds += time.perf_counter() - started
+        baseline_correct += result["action_type"] == transcript["expected"]
+
+    total = len(transcripts)
+    summary = classifier.summary()
+    print(f"\n{total} transcripts ({'live OpenAI' if live else 'offline, oracle model tiers'})")
+    print(f"accuracy            tiered {correct / total:.1%}   gpt-4o only {baseline_correct / total:.1%}")
+    print(f"escalation rate     to small {summary['escalation_rate_small']:.1%}   to large {summary['escalation_rate_large']:.1%}")
+    for tier in ("local", "small", "large"):
+        decided, hits = decided_by.get(tier, (0, 0))
+        accuracy = f"{hits / decided:.1%}" if decided else "-"
+        print(f"tier {tier:<6} calls {summary[tier]['calls']:>4}  decided {decided:>4}  accuracy {accuracy:>6}  "
+              f"mean latency {summary[tier]['mean_latency_ms']:>9.3f}ms")
+    tiered_ms = sum(summary[tier]["mean_latency_ms"] * summary[tier]["calls"] for tier in ("local", "small", "large")) / total
+    print(f"mean latency/turn   tiered {tiered_ms:.1f}ms   gpt-4o only {baseline_seconds / total * 1000:.1f}ms")
+
+def _detect_prompt(history) -> str:
+    from app.core.prompt_templates.detect_appointment_action import detect_appointment_action_prompt
+    from app.utils.utils import format_conversation_history
+    return detect_appointment_action_prompt.format(conversation_history=format_conversation_history(history))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--transcripts", type=Path, default=DEFAULT_TRANSCRIPTS)
+    parser.add_argument("--live", action="store_true", help="call OpenAI instead of the oracle stub")
+    parser.add_argument("--small-latency", type=float, default=0.6, help="offline latency of the small model tier")
+    parser.add_argument("--large-latency", type=float, default=1.5, help="offline latency of the large model tier")
+    args = parser.parse_args()
+
+    if not args.live:
+        configure_environment()
+    asyncio.run(evaluate(load_transcripts(args.transcripts), args.live, args.small_latency, args.large_latency))
+
+if __name__ == "__main__":
+    main()
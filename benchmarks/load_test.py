@@ -0,0 +1,485 @@
+"""Load test: concurrent synthetic Twilio calls against the whole app, with every vendor stubbed.
+
+Each call posts the inbound webhook, opens /media-stream and streams 20 ms mu-law frames in
+real time while a scripted ElevenLabs conversation books an appointment. For each level of
+concurrency it reports the jitter of the agent audio the caller hears, event-loop lag and CPU
+in the server, and the time from hang-up until the booking reaches the EHR:
+
+    python -m benchmarks.load_test --levels 1,10,100,500 --duration 20
+
+This is the regression gate for changes to `handle_media_stream` and `TwilioAudioInterface`:
+it exits non-zero if a call fails or is not booked, or a `--max-*` threshold is exceeded.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import math
+import multiprocessing
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import httpx
+
+from benchmarks.stubs import (
+    StubElevenLabsServer,
+    StubFHIRServer,
+    StubOpenAIServer,
+    StubTwilioServer,
+    configure_environment,
+    mulaw_tone,
+)
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+FRAME_SECONDS = 0.02
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+# Every inbound frame starts with the call's index, so the ElevenLabs stub can tell which
+# caller it is talking to from whichever frame reaches it first
+MARKER = b"LOADTEST"
+SLOTS_PER_DAY = 16
+# A gap this much longer than the audio received so far starts a new talk spurt
+SPURT_GAP_SECONDS = 0.5
+
+def booking_day(start: date, business_days: int) -> date:
+    day = start
+    while business_days:
+        day += timedelta(days=1)
+        if day.weekday() < 5:
+            business_days -= 1
+    return day
+
+def caller(index: int, today: date) -> dict:
+    """Name, phone number and a slot no other caller asks for."""
+    minutes = 9 * 60 + (index % SLOTS_PER_DAY) * 30
+    return {
+        "name": f"Loadtest Caller{index:05d}",
+        "phone": f"+1555{index:07d}",
+        "date": booking_day(today, 1 + index // SLOTS_PER_DAY).isoformat(),
+        "time": datetime(2000, 1, 1, minutes // 60, minutes % 60).strftime("%I:%M %p"),
+    }
+
+class ConversationScript:
+    """The ElevenLabs side of a call: the caller books an appointment in four turns."""
+
+    def __init__(self, today: date, turn_seconds: float, response_latency: float):
+        self.today = today
+        self.turn_seconds = turn_seconds
+        self.response_latency = response_latency
+
+    def __call__(self, first_chunk: bytes) -> list[tuple[float, str, str]]:
+        index = int(first_chunk[len(MARKER):len(MARKER) + 8]) if first_chunk.startswith(MARKER) else 0
+        details = caller(index, self.today)
+        exchanges = [
+            ("Hi, I'd like to book a new appointment.", "Sure. May I have your full name?"),
+            (f"My name is {details['name']}.", "Thanks. What's the best number to reach you?"),
+            (f"It's {details['phone']}.", "When would you like to come in?"),
+            (f"On {details['date']} at {details['time']}.", "You're all set, we'll text you a confirmation. Goodbye!"),
+        ]
+        turns = [(0.5, "agent", "Thank you for calling. How can I help you today?")]
+        for i, (user, agent) in enumerate(exchanges, start=1):
+            at = 0.5 + i * self.turn_seconds
+            turns += [(at, "user", user), (at + self.response_latency, "agent", agent)]
+        return turns
+
+def extract_details(prompt: str) -> dict:
+    """What the OpenAI stub 'understands' from a prompt: the details the script's caller gave."""
+    name = re.search(r"[Mm]y name is ([A-Za-z0-9 ]+?)[.,]", prompt)
+    phone = re.search(r"\+1\d{10}", prompt)
+    slot = re.search(r"On (\d{4}-\d{2}-\d{2}) at (\d{1,2}:\d{2} [AP]M)", prompt)
+    values = {
+        "patient_name": name.group(1) if name else None,
+        "phone_number": phone.group(0) if phone else None,
+        "appointment_date": slot.group(1) if slot else None,
+        "appointment_time": slot.group(2) if slot else None,
+    }
+    return values
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+# -- Stub process ------------------------------------------------------------------------
+
+def run_stubs(connection, args, today: date):
+    """Run every vendor stub in one process, send their URLs back and serve until killed."""
+    fhir = StubFHIRServer(latency=args.fhir_latency).start()
+    openai = StubOpenAIServer(extract_details, latency=args.openai_latency).start()
+    twilio = StubTwilioServer(latency=args.twilio_latency).start()
+    script = ConversationScript(today, args.turn_seconds, args.elevenlabs_latency)
+    elevenlabs = StubElevenLabsServer(script, latency=args.elevenlabs_latency).start()
+    connection.send({
+        "OYSTEHR_API_URL": fhir.url,
+        "OPENAI_BASE_URL": openai.base_url,
+        "TWILIO_API_BASE_URL": twilio.url,
+        "ELEVENLABS_API_BASE_URL": elevenlabs.url,
+    })
+    while True:
+        time.sleep(3600)
+
+# -- Server process ----------------------------------------------------------------------
+
+class LoopLagMonitor:
+    """Measures how late a 10 ms timer fires on the server's event loop."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.task = None
+        self.reset()
+
+    def reset(self):
+        self.lags = []
+        self.cpu_started = time.process_time()
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    def stats(self) -> dict:
+        return {
+            "loop_lag_p50_ms": percentile(self.lags, 0.5) * 1000,
+            "loop_lag_p99_ms": percentile(self.lags, 0.99) * 1000,
+            "loop_lag_max_ms": max(self.lags, default=0.0) * 1000,
+            "cpu_seconds": time.process_time() - self.cpu_started,
+        }
+
+def serve(port: int):
+    """Run the app with the loop-lag monitor and its stats routes (`--serve`)."""
+    configure_environment()
+    import uvicorn
+    from manage import app
+
+    monitor = LoopLagMonitor()
+    app_lifespan = app.router.lifespan_context
+
+    @asynccontextmanager
+    async def lifespan(app):
+        async with app_lifespan(app) as state:
+            monitor.start()
+            yield state
+            monitor.stop()
+
+    app.router.lifespan_context = lifespan
+    app.add_api_route("/__load_test/stats", monitor.stats, methods=["GET"])
+    app.add_api_route("/__load_test/reset", monitor.reset, methods=["POST"])
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_server(stub_urls: dict, workdir: str, log_path: str) -> tuple[subprocess.Popen, str]:
+    port = free_port()
+    env = {
+        **os.environ,
+        **stub_urls,
+        "PYTHONPATH": str(REPO_ROOT),
+        "PRACTICE_TIMEZONE": "UTC",
+        # Confirmations are not what is being measured, don't let pacing hold up the queue
+        "SMS_RATE_PER_SECOND": "1000",
+        "SMS_BURST": "1000",
+    }
+    log = open(log_path, "ab")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.load_test", "--serve", "--port", str(port)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup, see {log_path}")
+        try:
+            httpx.get(f"{url}/", timeout=1).raise_for_status()
+            return process, url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Server did not start within 60s, see {log_path}")
+
+# -- Synthetic Twilio --------------------------------------------------------------------
+
+def media_message(index: int, stream_sid: str) -> str:
+    audio = MARKER + f"{index:08d}".encode() + mulaw_tone(FRAME_SECONDS)[len(MARKER) + 8:]
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": "0",
+        "media": {"track": "inbound", "chunk": "0", "timestamp": "0", "payload": base64.b64encode(audio).decode()},
+        "streamSid": stream_sid,
+    }, separators=(",", ":"))
+
+class ReceivedAudio:
+    """Arrival statistics of the agent audio: RFC 3550 interarrival jitter and the spread of
+    transit times within each talk spurt, against the audio's own 8 kHz timeline."""
+
+    def __init__(self, opened_at: float):
+        self.opened_at = opened_at
+        self.first_audio_at = None
+        self.frames = 0
+        self.jitter = 0.0
+        self.max_jitter = 0.0
+        self.max_delay_variation = 0.0
+        self._spurt_started = None
+        self._spurt_audio = 0.0
+        self._transit = None
+        self._transit_range = None
+
+    def add(self, arrived_at: float, seconds: float):
+        self.frames += 1
+        if self.first_audio_at is None:
+            self.first_audio_at = arrived_at
+        if self._spurt_started is None or arrived_at > self._spurt_started + self._spurt_audio + SPURT_GAP_SECONDS:
+            self._spurt_started, self._spurt_audio = arrived_at, 0.0
+            self._transit, self._transit_range = None, None
+        transit = arrived_at - (self._spurt_started + self._spurt_audio)
+        if self._transit is not None:
+            self.jitter += (abs(transit - self._transit) - self.jitter) / 16
+            self.max_jitter = max(self.max_jitter, self.jitter)
+        self._transit = transit
+        low, high = self._transit_range or (transit, transit)
+        self._transit_range = (min(low, transit), max(high, transit))
+        self.max_delay_variation = max(self.max_delay_variation, self._transit_range[1] - self._transit_range[0])
+        self._spurt_audio += seconds
+
+async def receive_audio(websocket, received: ReceivedAudio):
+    async for message in websocket:
+        arrived_at = time.perf_counter()
+        data = json.loads(message)
+        if data.get("event") == "media":
+            received.add(arrived_at, len(base64.b64decode(data["media"]["payload"])) / 8000)
+
+async def run_call(index: int, args, server_url: str, start_at: float) -> dict:
+    import websockets
+
+    await asyncio.sleep(max(0.0, start_at - time.time()))
+    call_sid = f"CA{index:032d}"
+    stream_sid = f"MZ{index:032d}"
+    result = {"index": index, "ok": False}
+    try:
+        async with httpx.AsyncClient(timeout=30) as client:
+            started = time.perf_counter()
+            response = await client.post(
+                f"{server_url}/twilio/inbound_call",
+                data={"CallSid": call_sid, "From": caller(index, args.today)["phone"]}
+            )
+            response.raise_for_status()
+            result["webhook_ms"] = (time.perf_counter() - started) * 1000
+
+        ws_url = server_url.replace("http://", "ws://") + "/media-stream"
+        async with websockets.connect(ws_url, max_size=None, open_timeout=30) as websocket:
+            received = ReceivedAudio(time.perf_counter())
+            receiver = asyncio.create_task(receive_audio(websocket, received))
+            await websocket.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+            await websocket.send(json.dumps({
+                "event": "start",
+                "sequenceNumber": "1",
+                "start": {
+                    "streamSid": stream_sid,
+                    "callSid": call_sid,
+                    "tracks": ["inbound"],
+                    "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1},
+                },
+                "streamSid": stream_sid,
+            }))
+
+            # Frames go out on an absolute 20 ms schedule, like a phone network would send them
+            frame = media_message(index, stream_sid)
+            send_lags = []
+            started = time.perf_counter()
+            for i in range(round(args.duration / FRAME_SECONDS)):
+                delay = started + i * FRAME_SECONDS - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                else:
+                    send_lags.append(-delay)
+                await websocket.send(frame)
+
+            await websocket.send(json.dumps({"event": "stop", "sequenceNumber": "2", "stop": {"callSid": call_sid}, "streamSid": stream_sid}))
+            result["hung_up_at"] = time.time()
+            receiver.cancel()
+
+        result.update({
+            "ok": True,
+            "first_audio_ms": (received.first_audio_at - received.opened_at) * 1000 if received.first_audio_at else None,
+            "frames_received": received.frames,
+            "jitter_ms": received.max_jitter * 1000,
+            "delay_variation_ms": received.max_delay_variation * 1000,
+            "send_lag_p99_ms": percentile(send_lags, 0.99) * 1000,
+        })
+    except Exception as e:
+        result["error"] = repr(e)
+    return result
+
+def run_client(indices: list[int], args, server_url: str, start_at: float) -> list[dict]:
+    """One client process: its share of the calls, each starting at its offset in the ramp."""
+    async def run() -> list[dict]:
+        ramp = args.ramp / max(1, args.calls)
+        return await asyncio.gather(*(run_call(i, args, server_url, start_at + i * ramp) for i in indices))
+
+    return asyncio.run(run())
+
+# -- Bookings ----------------------------------------------------------------------------
+
+def collect_bookings(fhir_url: str, calls: list[dict], today: date, timeout: float) -> dict[int, float]:
+    """Wait for the post-call jobs to book, return each call's seconds from hang-up to booking."""
+    hung_up_at = {caller(call["index"], today)["phone"]: call for call in calls if call["ok"]}
+    deadline = time.monotonic() + timeout
+    bookings = {}
+    with httpx.Client(timeout=30) as client:
+        while True:
+            patients = {
+                entry["resource"]["id"]: entry["resource"]
+                for entry in client.get(f"{fhir_url}/Patient").json().get("entry", [])
+            }
+            for entry in client.get(f"{fhir_url}/Schedule").json().get("entry", []):
+                schedule = entry["resource"]
+                patient = patients.get(schedule["actor"][0]["reference"].split("/")[-1], {})
+                phones = [telecom.get("value") for telecom in patient.get("telecom", [])]
+                call = next((hung_up_at[phone] for phone in phones if phone in hung_up_at), None)
+                if call is not None:
+                    booked_at = datetime.fromisoformat(schedule["meta"]["lastUpdated"]).timestamp()
+                    bookings[call["index"]] = booked_at - call["hung_up_at"]
+            if len(bookings) >= len(hung_up_at) or time.monotonic() > deadline:
+                return bookings
+            time.sleep(0.5)
+
+# -- Driver ------------------------------------------------------------------------------
+
+def run_level(calls: int, args, workdir: str) -> dict:
+    args.calls = calls
+    parent, child = multiprocessing.Pipe()
+    stubs = multiprocessing.Process(target=run_stubs, args=(child, args, args.today), daemon=True)
+    stubs.start()
+    server = None
+    try:
+        stub_urls = parent.recv()
+        level_dir = tempfile.mkdtemp(prefix=f"calls-{calls}-", dir=workdir)
+        server, server_url = start_server(stub_urls, level_dir, os.path.join(level_dir, "server.log"))
+        httpx.post(f"{server_url}/__load_test/reset").raise_for_status()
+
+        processes = max(1, math.ceil(calls / args.calls_per_client_process))
+        shards = [list(range(calls))[i::processes] for i in range(processes)]
+        start_at = time.time() + 1.0
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(run_client, shard, args, server_url, start_at) for shard in shards]
+            results = [result for future in futures for result in future.result()]
+
+        server_stats = httpx.get(f"{server_url}/__load_test/stats").json()
+        bookings = collect_bookings(stub_urls["OYSTEHR_API_URL"], results, args.today, args.booking_timeout)
+        sms = httpx.get(f"{stub_urls['TWILIO_API_BASE_URL']}/stats").json()["messages"]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        stubs.kill()
+
+    ok = [r for r in results if r["ok"]]
+    errors = sorted({r["error"] for r in results if not r["ok"]})
+    summary = {
+        "calls": calls,
+        "ok": len(ok),
+        "booked": len(bookings),
+        "sms": sms,
+        "errors": errors[:5],
+        **server_stats,
+        "cpu_ms_per_call": server_stats["cpu_seconds"] * 1000 / calls,
+    }
+    for name in ("webhook_ms", "first_audio_ms", "jitter_ms", "delay_variation_ms", "send_lag_p99_ms"):
+        values = [r[name] for r in ok if r.get(name) is not None]
+        summary[f"{name.removesuffix('_ms')}_p50_ms"] = percentile(values, 0.5)
+        summary[f"{name.removesuffix('_ms')}_p99_ms"] = percentile(values, 0.99)
+    summary["booking_p50_s"] = percentile(list(bookings.values()), 0.5)
+    summary["booking_p99_s"] = percentile(list(bookings.values()), 0.99)
+    return summary
+
+def report(summary: dict):
+    print(
+        f"calls={summary['calls']:<4} ok={summary['ok']:<4} booked={summary['booked']:<4} sms={summary['sms']:<4} "
+        f"jitter p50/p99={summary['jitter_p50_ms']:.1f}/{summary['jitter_p99_ms']:.1f}ms "
+        f"delay_var p99={summary['delay_variation_p99_ms']:.1f}ms "
+        f"first_audio p50/p99={summary['first_audio_p50_ms']:.0f}/{summary['first_audio_p99_ms']:.0f}ms "
+        f"loop_lag p99/max={summary['loop_lag_p99_ms']:.1f}/{summary['loop_lag_max_ms']:.1f}ms "
+        f"cpu/call={summary['cpu_ms_per_call']:.0f}ms "
+        f"booking p50/p99={summary['booking_p50_s']:.2f}/{summary['booking_p99_s']:.2f}s"
+    )
+    if summary["send_lag_p99_p99_ms"] > 5:
+        print(f"  warning: the client itself fell behind by {summary['send_lag_p99_p99_ms']:.1f}ms, use more client processes")
+    for error in summary["errors"]:
+        print(f"  error: {error}")
+
+def failures(summary: dict, args) -> list[str]:
+    problems = []
+    if summary["ok"] < summary["calls"]:
+        problems.append(f"{summary['calls'] - summary['ok']} calls failed")
+    if summary["booked"] < summary["ok"]:
+        problems.append(f"{summary['ok'] - summary['booked']} calls were not booked")
+    if args.max_jitter_ms is not None and summary["jitter_p99_ms"] > args.max_jitter_ms:
+        problems.append(f"p99 jitter {summary['jitter_p99_ms']:.1f}ms > {args.max_jitter_ms}ms")
+    if args.max_loop_lag_ms is not None and summary["loop_lag_p99_ms"] > args.max_loop_lag_ms:
+        problems.append(f"p99 loop lag {summary['loop_lag_p99_ms']:.1f}ms > {args.max_loop_lag_ms}ms")
+    if args.max_booking_seconds is not None and summary["booking_p99_s"] > args.max_booking_seconds:
+        problems.append(f"p99 time to booking {summary['booking_p99_s']:.2f}s > {args.max_booking_seconds}s")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--levels", default="1,10,100,500", help="comma-separated numbers of concurrent calls")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds each call lasts")
+    parser.add_argument("--turn-seconds", type=float, default=3.5, help="seconds between the caller's turns")
+    parser.add_argument("--ramp", type=float, default=2.0, help="seconds over which the calls of a level start")
+    parser.add_argument("--fhir-latency", type=float, default=0.05)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--twilio-latency", type=float, default=0.05)
+    parser.add_argument("--elevenlabs-latency", type=float, default=0.3, help="signed URL and agent response latency")
+    parser.add_argument("--calls-per-client-process", type=int, default=100)
+    parser.add_argument("--booking-timeout", type=float, default=120.0, help="seconds to wait for bookings after the last hang-up")
+    parser.add_argument("--max-jitter-ms", type=float)
+    parser.add_argument("--max-loop-lag-ms", type=float)
+    parser.add_argument("--max-booking-seconds", type=float)
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args.port)
+    if args.duration < 0.5 + 5 * args.turn_seconds:
+        parser.error("--duration is too short for the conversation, lower --turn-seconds or raise --duration")
+
+    args.today = date.today()
+    summaries, problems = [], []
+    with tempfile.TemporaryDirectory(prefix="load-test-") as workdir:
+        for calls in (int(level) for level in args.levels.split(",")):
+            summary = run_level(calls, args, workdir)
+            report(summary)
+            summaries.append(summary)
+            problems += [f"calls={calls}: {problem}" for problem in failures(summary, args)]
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(summaries, indent=2))
+    for problem in problems:
+        print(f"FAIL {problem}")
+    sys.exit(1 if problems else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Measure event-loop stall caused by Oystehr calls against a local stub FHIR server.
+
+Compares the previous blocking `requests` implementation with the pooled async client:
+
+    python -m benchmarks.oystehr_event_loop_stall --bookings 50 --latency 0.05
+"""
+import argparse
+import asyncio
+import time
+from datetime import datetime, timedelta
+
+from benchmarks.stubs import StubFHIRServer, configure_environment
+
+class BlockingOystehrService:
+    """The previous implementation: async methods issuing blocking requests without a session."""
+
+    def __init__(self, base_url: str):
+        import requests
+        self.requests = requests
+        self.base_url = base_url
+        self.headers = {"accept": "application/json", "Content-Type": "application/json"}
+
+    async def create_appointment(self, appointment) -> bool:
+        patient = self.requests.post(
+            f"{self.base_url}/Patient",
+            headers=self.headers,
+            json={"resourceType": "Patient", "name": [{"text": appointment.patient_name}]}
+        ).json()
+        response = self.requests.post(
+            f"{self.base_url}/Schedule",
+            headers=self.headers,
+            json={
+                "resourceType": "Schedule",
+                "actor": [{"reference": f"Patient/{patient['id']}"}],
+                "planningHorizon": {"start": appointment.datetime.isoformat()}
+            }
+        )
+        return response.status_code == 201
+
+async def measure_stall(service, appointments, tick: float = 0.005) -> dict:
+    """Book all appointments concurrently while a heartbeat task records how late it wakes up."""
+    stalls = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            start = time.perf_counter()
+            await asyncio.sleep(tick)
+            stalls.append(max(0.0, time.perf_counter() - start - tick))
+
+    monitor = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    results = await asyncio.gather(*(service.create_appointment(a) for a in appointments))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await monitor
+
+    stalls.sort()
+    return {
+        "booked": sum(1 for r in results if r),
+        "wall_s": elapsed,
+        "max_stall_ms": stalls[-1] * 1000 if stalls else 0.0,
+        "p99_stall_ms": stalls[int(len(stalls) * 0.99) - 1] * 1000 if stalls else 0.0,
+        "total_stall_ms": sum(stalls) * 1000,
+    }
+
+def report(label: str, result: dict):
+    print(
+        f"{label:<10} booked={result['booked']:<4} requests={result['requests']:<5} wall={result['wall_s']:.2f}s "
+        f"max_stall={result['max_stall_ms']:.1f}ms p99_stall={result['p99_stall_ms']:.1f}ms "
+        f"total_stall={result['total_stall_ms']:.1f}ms"
+    )
+
+async def run(args):
+    from app.schemas.appointment import Appointment
+    from app.services.fhir_client import get_fhir_client
+    from app.services.oystehr import OystehrService
+
+    start = datetime.now() + timedelta(days=1)
+    appointments = [
+        Appointment(patient_name=f"Patient {i}", phone_number=f"+1555000{i:04d}", datetime=start + timedelta(minutes=30 * i))
+        for i in range(args.bookings)
+    ]
+
+    async def measure(service) -> dict:
+        requests_before = args.server.requests
+        result = await measure_stall(service, appointments)
+        result["requests"] = args.server.requests - requests_before
+        return result
+
+    report("before", await measure(BlockingOystehrService(args.server.url)))
+    # The application opens the pool at startup, so exclude that one-off cost here too
+    get_fhir_client().open()
+    report("after", await measure(OystehrService()))
+    await get_fhir_client().aclose()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub server latency per request (seconds)")
+    args = parser.parse_args()
+
+    server = StubFHIRServer(latency=args.latency).start()
+    args.server = server
+    configure_environment(OYSTEHR_API_URL=server.url)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.stop()
+
+if __name__ == "__main__":
+    main()
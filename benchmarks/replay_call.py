@@ -0,0 +1,237 @@
+"""Replay a captured call against the app, with every vendor stubbed.
+
+Takes a capture written with CALL_CAPTURE_ENABLED and re-drives `handle_media_stream` with
+it: the caller's frames are sent at their recorded times, the ElevenLabs stub says the
+recorded transcripts and agent responses at theirs, the OpenAI stub returns the recorded
+tool results and the FHIR stub holds the patients and schedules the call looked up. Times
+are divided by `--speed`:
+
+    python -m benchmarks.replay_call call_captures/CA0123.vcap --speed 4
+
+Reports the same jitter, event-loop lag and time to booking as the load test, and how many
+detection and extraction calls the replay made compared with the recorded call.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import sys
+import tempfile
+import time
+import uuid
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from benchmarks.load_test import ReceivedAudio, extract_details, percentile, receive_audio, start_server
+from benchmarks.stubs import StubElevenLabsServer, StubFHIRServer, StubOpenAIServer, StubTwilioServer, configure_environment
+
+def _resources(body: dict) -> list[dict]:
+    if body.get("resourceType") == "Bundle":
+        return [entry["resource"] for entry in body.get("entry", []) if "resource" in entry]
+    return [body] if body.get("id") else []
+
+def load_capture(path: str) -> dict:
+    """Everything a replay needs from a capture, with times relative to the first inbound frame."""
+    from app.services.call_capture import RecordKind, read_capture
+
+    messages, turns, function_calls, seed = [], [], {}, {}
+    outbound_bytes = 0
+    recorded_bookings = 0
+    for record in read_capture(path):
+        if record.kind == RecordKind.INBOUND_AUDIO:
+            messages.append((record.timestamp, record.payload))
+        elif record.kind == RecordKind.TWILIO_EVENT:
+            messages.append((record.timestamp, record.json()))
+        elif record.kind == RecordKind.OUTBOUND_AUDIO:
+            outbound_bytes += len(record.payload)
+        elif record.kind in (RecordKind.USER_TRANSCRIPT, RecordKind.AGENT_RESPONSE):
+            role = "user" if record.kind == RecordKind.USER_TRANSCRIPT else "agent"
+            turns.append((record.timestamp, role, record.text()))
+        elif record.kind == RecordKind.FUNCTION_CALL:
+            call = record.json()
+            function_calls.setdefault(call["function"], []).append(call["result"])
+        elif record.kind == RecordKind.OYSTEHR_RESPONSE:
+            response = record.json()
+            if response["method"] == "GET" and response["status"] == 200:
+                for resource in _resources(json.loads(response["body"] or "{}")):
+                    seed[(resource["resourceType"], resource["id"])] = resource
+            elif response["method"] in ("POST", "PUT") and response["status"] < 300:
+                recorded_bookings += 1
+
+    audio_times = [at for at, message in messages if isinstance(message, bytes)]
+    if not audio_times:
+        raise ValueError(f"{path} has no inbound audio")
+    first_audio_at = audio_times[0]
+    messages.sort(key=lambda message: message[0])
+    return {
+        "messages": [(at - first_audio_at, message) for at, message in messages],
+        "turns": sorted((at - first_audio_at, role, text) for at, role, text in turns),
+        "function_calls": function_calls,
+        "seed": list(seed.values()),
+        "agent_audio_seconds": outbound_bytes / 8000 / max(1, sum(role == "agent" for _, role, _ in turns)),
+        "recorded_bookings": recorded_bookings,
+    }
+
+class ReplayScript:
+    """The ElevenLabs side of the recorded call, timed from the first caller audio it receives."""
+
+    def __init__(self, turns: list[tuple[float, str, str]], speed: float):
+        self.turns = [(max(0.0, at / speed), role, text) for at, role, text in turns]
+
+    def __call__(self, first_chunk: bytes) -> list[tuple[float, str, str]]:
+        return self.turns
+
+def run_stubs(connection, replay: dict, args):
+    """Run the vendor stubs loaded with the recorded call, send their URLs back and serve until killed."""
+    fhir = StubFHIRServer(latency=args.fhir_latency)
+    fhir.seed(replay["seed"])
+    fhir.start()
+    openai = StubOpenAIServer(extract_details, latency=args.openai_latency, recorded=replay["function_calls"]).start()
+    twilio = StubTwilioServer(latency=args.twilio_latency).start()
+    elevenlabs = StubElevenLabsServer(
+        ReplayScript(replay["turns"], args.speed),
+        latency=args.elevenlabs_latency,
+        agent_audio_seconds=min(replay["agent_audio_seconds"], 10.0) / args.speed,
+    ).start()
+    connection.send({
+        "OYSTEHR_API_URL": fhir.url,
+        "OPENAI_BASE_URL": openai.base_url,
+        "TWILIO_API_BASE_URL": twilio.url,
+        "ELEVENLABS_API_BASE_URL": elevenlabs.url,
+    })
+    while True:
+        time.sleep(3600)
+
+def _replayed(message: dict, call_sid: str, stream_sid: str) -> dict:
+    """A recorded Twilio event with this replay's CallSid and StreamSid."""
+    message = json.loads(json.dumps(message))
+    if "streamSid" in message:
+        message["streamSid"] = stream_sid
+    for event in ("start", "stop"):
+        if event in message:
+            message[event]["callSid"] = call_sid
+            if "streamSid" in message[event]:
+                message[event]["streamSid"] = stream_sid
+    return message
+
+async def replay_call(replay: dict, args, server_url: str) -> dict:
+    import websockets
+
+    call_sid = f"CA{uuid.uuid4().hex}"
+    stream_sid = f"MZ{uuid.uuid4().hex}"
+    async with httpx.AsyncClient(timeout=30) as client:
+        response = await client.post(f"{server_url}/twilio/inbound_call", data={"CallSid": call_sid, "From": args.from_number})
+        response.raise_for_status()
+
+    ws_url = server_url.replace("http://", "ws://") + "/media-stream"
+    async with websockets.connect(ws_url, max_size=None, open_timeout=30) as websocket:
+        received = ReceivedAudio(time.perf_counter())
+        receiver = asyncio.create_task(receive_audio(websocket, received))
+        # Events recorded before the first frame (connected, start) go out right away
+        send_lags = []
+        started = time.perf_counter()
+        for at, message in replay["messages"]:
+            delay = started + max(0.0, at) / args.speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            else:
+                send_lags.append(-delay)
+            if isinstance(message, bytes):
+                await websocket.send(json.dumps({
+                    "event": "media",
+                    "media": {"track": "inbound", "payload": base64.b64encode(message).decode()},
+                    "streamSid": stream_sid,
+                }, separators=(",", ":")))
+            else:
+                await websocket.send(json.dumps(_replayed(message, call_sid, stream_sid)))
+        hung_up_at = time.time()
+        receiver.cancel()
+
+    return {
+        "call_sid": call_sid,
+        "hung_up_at": hung_up_at,
+        "first_audio_ms": (received.first_audio_at - received.opened_at) * 1000 if received.first_audio_at else None,
+        "frames_received": received.frames,
+        "jitter_ms": received.max_jitter * 1000,
+        "delay_variation_ms": received.max_delay_variation * 1000,
+        "send_lag_p99_ms": percentile(send_lags, 0.99) * 1000,
+    }
+
+def wait_for_booking(fhir_url: str, seeded: set[str], hung_up_at: float, timeout: float) -> float | None:
+    """Seconds from hang-up until a schedule the recorded call did not already have appears."""
+    deadline = time.monotonic() + timeout
+    with httpx.Client(timeout=30) as client:
+        while time.monotonic() < deadline:
+            for entry in client.get(f"{fhir_url}/Schedule").json().get("entry", []):
+                schedule = entry["resource"]
+                if schedule["id"] not in seeded and "meta" in schedule:
+                    return datetime.fromisoformat(schedule["meta"]["lastUpdated"]).timestamp() - hung_up_at
+            time.sleep(0.5)
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("capture", help="a .vcap file written with CALL_CAPTURE_ENABLED")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay this many times faster than recorded")
+    parser.add_argument("--from-number", default="+15550000000", help="caller number for the inbound webhook")
+    parser.add_argument("--fhir-latency", type=float, default=0.05)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    parser.add_argument("--twilio-latency", type=float, default=0.05)
+    parser.add_argument("--elevenlabs-latency", type=float, default=0.3, help="signed URL latency")
+    parser.add_argument("--booking-timeout", type=float, default=60.0, help="seconds to wait for the booking after hang-up")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+
+    configure_environment()
+    replay = load_capture(args.capture)
+    parent, child = multiprocessing.Pipe()
+    stubs = multiprocessing.Process(target=run_stubs, args=(child, replay, args), daemon=True)
+    stubs.start()
+    server = None
+    try:
+        stub_urls = parent.recv()
+        with tempfile.TemporaryDirectory(prefix="replay-") as workdir:
+            server, server_url = start_server(stub_urls, workdir, str(Path(workdir) / "server.log"))
+            httpx.post(f"{server_url}/__load_test/reset").raise_for_status()
+            result = asyncio.run(replay_call(replay, args, server_url))
+            result.update(httpx.get(f"{server_url}/__load_test/stats").json())
+            seeded = {resource["id"] for resource in replay["seed"] if resource["resourceType"] == "Schedule"}
+            result["booking_s"] = (
+                wait_for_booking(stub_urls["OYSTEHR_API_URL"], seeded, result["hung_up_at"], args.booking_timeout)
+                if replay["recorded_bookings"] else None
+            )
+            result["function_calls"] = httpx.get(f"{stub_urls['OPENAI_BASE_URL']}/stats").json()
+            result["sms"] = httpx.get(f"{stub_urls['TWILIO_API_BASE_URL']}/stats").json()["messages"]
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        stubs.kill()
+
+    recorded_calls = Counter({name: len(results) for name, results in replay["function_calls"].items()})
+    booking = f"{result['booking_s']:.2f}s" if result["booking_s"] is not None else "none"
+    print(
+        f"speed={args.speed:g} frames_received={result['frames_received']} "
+        f"jitter={result['jitter_ms']:.1f}ms delay_var={result['delay_variation_ms']:.1f}ms "
+        f"first_audio={result['first_audio_ms'] or 0:.0f}ms "
+        f"loop_lag p99/max={result['loop_lag_p99_ms']:.1f}/{result['loop_lag_max_ms']:.1f}ms "
+        f"cpu={result['cpu_seconds'] * 1000:.0f}ms booking={booking} sms={result['sms']}"
+    )
+    for name in sorted(set(recorded_calls) | set(result["function_calls"])):
+        print(f"  {name}: {result['function_calls'].get(name, 0)} calls (recorded {recorded_calls[name]})")
+    if args.json:
+        Path(args.json).write_text(json.dumps(result, indent=2))
+
+    missing_booking = replay["recorded_bookings"] and result["booking_s"] is None
+    if missing_booking:
+        print("FAIL the recorded call booked, the replay did not")
+    sys.exit(1 if missing_booking else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+"""Local stand-ins for the external services the voice agent talks to.
+
+Used by the scripts in this directory so benchmarks never touch real vendor APIs.
+"""
+import asyncio
+import base64
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+REQUIRED_SETTINGS = (
+    "OPENAI_API_KEY", "TWILIO_ACCOUNT_SID", "TWILIO_AUTH_TOKEN", "TWILIO_PHONE_NUMBER",
+    "ELEVENLABS_API_KEY", "ELEVENLABS_AGENT_ID", "OYSTEHR_AUTH_TOKEN", "OYSTEHR_PROJECT_ID",
+)
+
+def configure_environment(**overrides: str):
+    """Point settings at the stubs. Must run before anything under `app` is imported."""
+    os.environ.update(overrides)
+    for name in REQUIRED_SETTINGS:
+        os.environ.setdefault(name, "benchmark")
+    # The app refuses to start without staff to hand emergencies off to
+    os.environ.setdefault("HUMAN_HANDOFF_NUMBERS", '["+15550100000"]')
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops SYNs under concurrent load and adds 1s retransmit stalls
+    request_queue_size = 1024
+
+def _matches(resource: dict, params: dict[str, list[str]]) -> bool:
+    """Loose FHIR search matching on the parameters OystehrService uses."""
+    for name, values in params.items():
+        value = values[0].lower()
+        if name == "name":
+            texts = [n.get("text", "").lower() for n in resource.get("name", [])]
+            if not any(value in text for text in texts):
+                return False
+        elif name in ("phone", "telecom"):
+            phones = [t.get("value", "").lower() for t in resource.get("telecom", [])]
+            if value.split("|")[-1] not in phones:
+                return False
+        elif name == "actor":
+            references = [a.get("reference", "").lower() for a in resource.get("actor", [])]
+            if not any(reference.endswith(value) for reference in references):
+                return False
+    return True
+
+class _StubServer:
+    """A threaded HTTP server answering with the handler class returned by `_handler`."""
+
+    def __init__(self, latency: float, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = _StubHTTPServer((host, port), self._handler())
+        self.server.stub = self
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        raise NotImplementedError
+
+class _JSONHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer writes so headers and body leave in one segment (avoids Nagle delays)
+    wbufsize = 1 << 16
+    content_type = "application/json"
+
+    @property
+    def stub(self) -> _StubServer:
+        return self.server.stub
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", self.content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _read_json(self) -> dict:
+        return json.loads(self._read_body() or b"{}")
+
+    def _count(self):
+        time.sleep(self.stub.latency)
+        with self.stub.lock:
+            self.stub.requests += 1
+
+def _last_updated() -> dict:
+    return {"lastUpdated": datetime.now(timezone.utc).isoformat()}
+
+class StubFHIRServer(_StubServer):
+    """Minimal in-memory FHIR server answering Patient and Schedule requests and transaction
+    Bundles after a fixed latency. Created resources carry `meta.lastUpdated`."""
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0):
+        self.resources: dict[str, dict[str, dict]] = {"Patient": {}, "Schedule": {}}
+        super().__init__(latency, host, port)
+
+    def seed(self, resources: list[dict]):
+        """Add existing resources, e.g. the patients and schedules a recorded call looked up."""
+        with self.lock:
+            for resource in resources:
+                self.resources.setdefault(resource["resourceType"], {})[resource["id"]] = resource
+
+    def _handler(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            content_type = "application/fhir+json"
+
+            def _resource_type(self) -> tuple[str, str | None]:
+                parts = [p for p in urlparse(self.path).path.split("/") if p]
+                resource_id = parts[-1] if len(parts) > 1 and parts[-2] in stub.resources else None
+                resource_type = parts[-2] if resource_id else parts[-1] if parts else ""
+                return resource_type, resource_id
+
+            def do_GET(self):
+                self._count()
+                resource_type, _ = self._resource_type()
+                params = parse_qs(urlparse(self.path).query)
+                # Chained search on the patient's name, as in `actor:Patient.name=...`
+                patient_name = params.pop("actor:Patient.name", None)
+                include = params.pop("_include", None)
+                with stub.lock:
+                    resources = [r for r in stub.resources.get(resource_type, {}).values() if _matches(r, params)]
+                    patients = stub.resources["Patient"]
+                    if patient_name:
+                        references = {f"Patient/{p['id']}" for p in patients.values() if _matches(p, {"name": patient_name})}
+                        resources = [r for r in resources if any(a.get("reference") in references for a in r.get("actor", []))]
+                    entries = [{"resource": r, "search": {"mode": "match"}} for r in resources]
+                    if include:
+                        included = {a["reference"].split("/")[-1] for r in resources for a in r.get("actor", [])}
+                        entries += [{"resource": patients[i], "search": {"mode": "include"}} for i in included if i in patients]
+                self._send(200, {"resourceType": "Bundle", "type": "searchset", "total": len(resources), "entry": entries})
+
+            def _transaction(self, bundle: dict):
+                """All-or-nothing processing of POST entries, with conditional create and urn:uuid references."""
+                with stub.lock:
+                    created: dict[str, dict[str, dict]] = {}
+                    references = {}
+                    response_entries = []
+                    for entry in bundle.get("entry", []):
+                        resource_type = entry["request"]["url"]
+                        resource = dict(entry["resource"])
+                        status = "201 Created"
+                        existing = []
+                        if entry["request"].get("ifNoneExist"):
+                            criteria = parse_qs(entry["request"]["ifNoneExist"])
+                            candidates = list(stub.resources[resource_type].values()) + list(created.get(resource_type, {}).values())
+                            existing = [r for r in candidates if _matches(r, criteria)]
+                        if len(existing) > 1:
+                            return self._send(412, {"resourceType": "OperationOutcome", "issue": [{"severity": "error", "code": "duplicate"}]})
+                        if existing:
+                            resource, status = existing[0], "200 OK"
+                        else:
+                            resource["id"] = str(uuid.uuid4())
+                            resource["meta"] = _last_updated()
+                            if "actor" in resource:
+                                resource["actor"] = [
+                                    {**actor, "reference": references.get(actor["reference"], actor["reference"])}
+                                    for actor in resource["actor"]
+                                ]
+                            created.setdefault(resource_type, {})[resource["id"]] = resource
+                        references[entry.get("fullUrl")] = f"{resource_type}/{resource['id']}"
+                        response_entries.append({
+                            "resource": resource,
+                            "response": {"status": status, "location": f"{resource_type}/{resource['id']}/_history/1"}
+                        })
+                    for resource_type, resources in created.items():
+                        stub.resources[resource_type].update(resources)
+                self._send(200, {"resourceType": "Bundle", "type": "transaction-response", "entry": response_entries})
+
+            def do_POST(self):
+                self._count()
+                resource_type, _ = self._resource_type()
+                resource = self._read_json()
+                if not resource_type and resource.get("resourceType") == "Bundle":
+                    return self._transaction(resource)
+                resource["id"] = str(uuid.uuid4())
+                resource["meta"] = _last_updated()
+                with stub.lock:
+                    stub.resources.setdefault(resource_type, {})[resource["id"]] = resource
+                self._send(201, resource)
+
+            def do_PUT(self):
+                self._count()
+                resource_type, resource_id = self._resource_type()
+                resource = self._read_json()
+                with stub.lock:
+                    stub.resources.setdefault(resource_type, {})[resource_id] = resource
+                self._send(200, resource)
+
+        return Handler
+
+def _fill_arguments(schema: dict, values: dict) -> dict:
+    """Tool-call arguments for a JSON schema: known `values` where the schema has the field,
+    the first enum value, `has_*` flags set when every value is known, placeholders for the
+    remaining required strings."""
+    arguments = {}
+    for name, field in schema.get("properties", {}).items():
+        if field.get("type") == "object":
+            arguments[name] = _fill_arguments(field, values)
+        elif "enum" in field:
+            arguments[name] = field["enum"][0]
+        elif field.get("type") == "boolean":
+            arguments[name] = name.startswith("has_") and all(values.values())
+        elif values.get(name):
+            arguments[name] = values[name]
+        elif name in schema.get("required", []):
+            arguments[name] = "benchmark"
+    return arguments
+
+class StubOpenAIServer(_StubServer):
+    """Chat Completions endpoint answering every request with a call to its forced tool.
+
+    `extract(prompt)` returns the argument values found in the prompt (e.g. the patient's
+    name), keyed by argument name. `recorded` maps tool names to the arguments of recorded
+    calls, returned in order (the last one repeats) instead of extracting. `GET /stats`
+    returns the number of calls per tool.
+    """
+
+    def __init__(
+        self,
+        extract,
+        latency: float = 0.3,
+        recorded: dict[str, list[dict]] | None = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.extract = extract
+        self.recorded = {name: list(results) for name, results in (recorded or {}).items()}
+        self.tool_calls: dict[str, int] = {}
+        super().__init__(latency, host, port)
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            def do_GET(self):
+                with stub.lock:
+                    self._send(200, stub.tool_calls)
+
+            def do_POST(self):
+                self._count()
+                request = self._read_json()
+                tool = request["tools"][0]["function"]
+                prompt = "\n".join(str(message.get("content") or "") for message in request["messages"])
+                with stub.lock:
+                    stub.tool_calls[tool["name"]] = stub.tool_calls.get(tool["name"], 0) + 1
+                    recorded = stub.recorded.get(tool["name"])
+                    arguments = (recorded.pop(0) if len(recorded) > 1 else recorded[0]) if recorded else None
+                if arguments is None:
+                    arguments = _fill_arguments(tool["parameters"], stub.extract(prompt))
+                self._send(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {
+                            "role": "assistant",
+                            "content": None,
+                            "tool_calls": [{
+                                "id": f"call_{uuid.uuid4().hex[:24]}",
+                                "type": "function",
+                                "function": {"name": tool["name"], "arguments": json.dumps(arguments)},
+                            }],
+                        },
+                        "finish_reason": "tool_calls",
+                    }],
+                    "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 20, "total_tokens": len(prompt) // 4 + 20},
+                })
+
+        return Handler
+
+class StubTwilioServer(_StubServer):
+    """Twilio REST API accepting Messages, new calls and call updates. `GET /stats` returns the counts."""
+
+    def __init__(self, latency: float = 0.05, host: str = "127.0.0.1", port: int = 0):
+        self.messages: list[dict] = []
+        self.calls_created = 0
+        self.call_updates = 0
+        super().__init__(latency, host, port)
+
+    def _handler(self):
+        stub = self
+
+        class Handler(_JSONHandler):
+            def do_GET(self):
+                with stub.lock:
+                    self._send(200, {"messages": len(stub.messages), "calls_created": stub.calls_created, "call_updates": stub.call_updates})
+
+            def do_POST(self):
+                self._count()
+                form = {name: values[0] for name, values in parse_qs(self._read_body().decode()).items()}
+                path = urlparse(self.path).path
+                with stub.lock:
+                    if path.endswith("/Messages.json"):
+                        message = {"sid": f"SM{uuid.uuid4().hex}", "status": "queued", "to": form.get("To"), "body": form.get("Body")}
+                        stub.messages.append(message)
+                        return self._send(201, message)
+                    if path.endswith("/Calls.json"):
+                        stub.calls_created += 1
+                        return self._send(201, {"sid": f"CA{uuid.uuid4().hex}", "status": "queued", "to": form.get("To")})
+                    stub.call_updates += 1
+                self._send(200, {"sid": path.rsplit("/", 1)[-1].removesuffix(".json"), "status": "in-progress"})
+
+        return Handler
+
+def _mulaw_byte(sample: int) -> int:
+    """G.711 mu-law encoding of a 16-bit PCM sample."""
+    sign = 0x80 if sample < 0 else 0
+    magnitude = min(abs(sample), 32635) + 0x84
+    exponent = max(magnitude.bit_length() - 8, 0)
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return ~(sign | (exponent << 4) | mantissa) & 0xFF
+
+def mulaw_tone(seconds: float, frequency: float = 440.0, amplitude: int = 8000, sample_rate: int = 8000) -> bytes:
+    """A sine tone as 8 kHz mu-law audio."""
+    return bytes(
+        _mulaw_byte(int(amplitude * math.sin(2 * math.pi * frequency * i / sample_rate)))
+        for i in range(int(seconds * sample_rate))
+    )
+
+class StubElevenLabsServer:
+    """ElevenLabs Conversational AI: the signed URL endpoint and the conversation websocket.
+
+    Each conversation follows a script, built by `script(first_audio_chunk)` from the first
+    user audio it receives, of `(seconds after that chunk, "user" | "agent", text)` turns.
+    User turns arrive as transcripts; agent turns as a response followed by
+    `agent_audio_seconds` of mu-law audio streamed in real time. Signed URLs are answered
+    after `latency`.
+    """
+
+    def __init__(
+        self,
+        script,
+        latency: float = 0.1,
+        agent_audio_seconds: float = 1.5,
+        chunk_seconds: float = 0.1,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.script = script
+        self.latency = latency
+        self.agent_audio_seconds = agent_audio_seconds
+        self.chunk_seconds = chunk_seconds
+        self.host = host
+        self.port = port
+        self.conversations = 0
+        self.audio_chunks = 0
+        self.loop = None
+        self.ready = threading.Event()
+        self.chunk = base64.b64encode(mulaw_tone(chunk_seconds, frequency=220.0)).decode()
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "StubElevenLabsServer":
+        threading.Thread(target=lambda: asyncio.run(self._serve()), daemon=True).start()
+        self.ready.wait()
+        return self
+
+    def stop(self):
+        if self.loop:
+            self.loop.call_soon_threadsafe(self._stopped.set)
+
+    async def _serve(self):
+        from websockets.asyncio.server import serve
+
+        self.loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        async with serve(self._converse, self.host, self.port, process_request=self._signed_url, max_size=None) as server:
+            self.port = server.sockets[0].getsockname()[1]
+            self.ready.set()
+            await self._stopped.wait()
+
+    async def _signed_url(self, connection, request):
+        if request.path.startswith("/v1/convai/conversation/get_signed_url"):
+            await asyncio.sleep(self.latency)
+            response = connection.respond(200, json.dumps({"signed_url": f"ws://{self.host}:{self.port}/v1/convai/conversation"}))
+            response.headers["Content-Type"] = "application/json"
+            return response
+        return None
+
+    async def _converse(self, websocket):
+        self.conversations += 1
+        await websocket.recv()  # conversation_initiation_client_data
+        await websocket.send(json.dumps({
+            "type": "conversation_initiation_metadata",
+            "conversation_initiation_metadata_event": {
+                "conversation_id": f"conv_{uuid.uuid4().hex}",
+                "agent_output_audio_format": "ulaw_8000",
+                "user_input_audio_format": "ulaw_8000",
+            },
+        }))
+        script = None
+        try:
+            async for message in websocket:
+                self.audio_chunks += 1
+                # Only the first chunk is decoded, the rest of the caller's audio is discarded
+                if script is None and message.startswith('{"user_audio_chunk"'):
+                    first_chunk = base64.b64decode(json.loads(message)["user_audio_chunk"])
+                    script = asyncio.create_task(self._play(websocket, self.script(first_chunk)))
+        finally:
+            if script is not None:
+                script.cancel()
+
+    async def _play(self, websocket, turns):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        event_id = 0
+        speaking = None
+        for at, role, text in turns:
+            await asyncio.sleep(max(0.0, started + at - loop.time()))
+            if role == "user":
+                await websocket.send(json.dumps({"type": "user_transcript", "user_transcription_event": {"user_transcript": text}}))
+                continue
+            await websocket.send(json.dumps({"type": "agent_response", "agent_response_event": {"agent_response": text}}))
+            if speaking is not None:
+                await speaking
+            event_id += 1
+            speaking = asyncio.create_task(self._speak(websocket, event_id))
+        if speaking is not None:
+            await speaking
+
+    async def _speak(self, websocket, event_id: int):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        message = json.dumps({"type": "audio", "audio_event": {"audio_base_64": self.chunk, "event_id": event_id}})
+        for i in range(round(self.agent_audio_seconds / self.chunk_seconds)):
+            await asyncio.sleep(max(0.0, started + i * self.chunk_seconds - loop.time()))
+            await websocket.send(message)
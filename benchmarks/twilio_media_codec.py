@@ -0,0 +1,66 @@
+"""Frames per second per core for the Twilio media frame path, previous vs optimized codec.
+
+    python -m benchmarks.twilio_media_codec --frames 200000
+"""
+import argparse
+import base64
+import json
+import os
+import time
+
+from app.services.twilio_media_codec import MediaFrameEncoder, extract_media_payload
+
+STREAM_SID = "MZ18ad3ab5a668481ce02b83e7395059f0"
+FRAME_BYTES = 160  # 20 ms of 8 kHz mu-law
+
+def inbound_message(audio: bytes, sequence: int) -> str:
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(sequence),
+        "media": {"track": "inbound", "chunk": str(sequence), "timestamp": str(sequence * 20), "payload": base64.b64encode(audio).decode()},
+        "streamSid": STREAM_SID,
+    }, separators=(",", ":"))
+
+def previous_inbound(message: str) -> bytes:
+    data = json.loads(message)
+    if data.get("event") == "media":
+        return base64.b64decode(data["media"]["payload"])
+
+def previous_outbound(audio: bytes) -> str:
+    return json.dumps({
+        "event": "media",
+        "streamSid": STREAM_SID,
+        "media": {"payload": base64.b64encode(audio).decode("utf-8")},
+    })
+
+def measure(label: str, fn, items, frames_per_item: int = 1):
+    started = time.process_time()
+    for item in items:
+        fn(item)
+    elapsed = time.process_time() - started
+    frames = len(items) * frames_per_item
+    print(f"{label:<32} {frames / elapsed:>12,.0f} frames/s/core  ({elapsed * 1e6 / frames:.2f} us/frame)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=200000)
+    parser.add_argument("--batch", type=int, default=5, help="outbound chunks coalesced per send")
+    args = parser.parse_args()
+
+    audio = [os.urandom(FRAME_BYTES) for _ in range(256)]
+    messages = [inbound_message(audio[i % 256], i) for i in range(args.frames)]
+    chunks = [audio[i % 256] for i in range(args.frames)]
+    batches = [chunks[i:i + args.batch] for i in range(0, len(chunks), args.batch)]
+    encoder = MediaFrameEncoder(STREAM_SID)
+
+    assert extract_media_payload(messages[0]) == previous_inbound(messages[0])
+    assert json.loads(encoder.encode(chunks[0])) == json.loads(previous_outbound(chunks[0]))
+
+    measure("inbound  json.loads + b64decode", previous_inbound, messages)
+    measure("inbound  extract_media_payload", extract_media_payload, messages)
+    measure("outbound dict + json.dumps", previous_outbound, chunks)
+    measure("outbound template encode", encoder.encode, chunks)
+    measure(f"outbound batched x{args.batch}", encoder.encode_batch, batches, args.batch)
+
+if __name__ == "__main__":
+    main()
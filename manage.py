@@ -1,16 +1,58 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.core.config import settings
 from app.core.logger import logger
+from app.routers.appointments import router as appointments_router
+from app.routers.availability import router as availability_router
 from app.routers.main import router as twilio_router
+from app.services.availability import availability_index
+from app.services.call_state import call_state, slot_holds
+from app.services.elevenlabs_sessions import signed_url_pool
+from app.services.fhir_client import get_fhir_client
+from app.services.oystehr import OystehrService
+from app.services.post_call import post_call_queue
+from app.services.twilio_sms import sms_dispatcher, sms_queue
+from app.services.warm_transfer import warm_transfer_service
+from app.utils.transcript_context import token_counter
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Emergencies are handed off to staff: without anyone to transfer to, don't take calls
+    if not settings.HUMAN_HANDOFF_NUMBERS:
+        raise RuntimeError("HUMAN_HANDOFF_NUMBERS is empty: set the staff numbers to transfer calls to")
+    get_fhir_client().open()
+    sms_dispatcher.open()
+    warm_transfer_service.open()
+    # tiktoken fetches its encoding on first use, do it before the first call
+    await asyncio.to_thread(token_counter.load)
+    post_call_queue.start()
+    sms_queue.start()
+    signed_url_pool.start()
+    availability_index.start(OystehrService().search_schedules)
+    yield
+    await availability_index.stop()
+    await signed_url_pool.stop()
+    await sms_queue.stop()
+    await post_call_queue.stop()
+    await sms_dispatcher.aclose()
+    await warm_transfer_service.aclose()
+    await call_state.close()
+    await slot_holds.close()
+    await get_fhir_client().aclose()
 
 app = FastAPI(
     title="Medical Voice Agent",
     description="AI-powered voice agent for medical practice",
-    version="0.1.0"
+    version="0.1.0",
+    lifespan=lifespan
 )
 
 app.include_router(twilio_router)
+app.include_router(availability_router)
+app.include_router(appointments_router)
 
 # Add CORS middleware
 app.add_middleware(
@@ -27,11 +69,32 @@ async def root():
     return {"message": "AI-powered voice agent for medical practice"}
 
 if __name__ == "__main__":
+    import argparse
+    import os
+    import sys
     import uvicorn
-    logger.info(f"Starting server on 5000 port")
-    uvicorn.run(
-        "manage:app",
-        host="0.0.0.0",
-        port=5000,
-        reload=True
-    )
+    parser = argparse.ArgumentParser(description="Run the voice agent server")
+    parser.add_argument("--production", action="store_true", help="several worker processes, no auto-reload")
+    parser.add_argument("--workers", type=int, default=settings.SERVER_WORKERS)
+    args = parser.parse_args()
+
+    if not args.production:
+        logger.info(f"Starting development server on {settings.SERVER_PORT} port")
+        uvicorn.run("manage:app", host=settings.SERVER_HOST, port=settings.SERVER_PORT, reload=True)
+    else:
+        # The webhook, media stream and transfer of one call may land on different workers
+        if args.workers > 1 and settings.CALL_STATE_BACKEND == "memory":
+            raise SystemExit("Running several workers needs a shared call state: set CALL_STATE_BACKEND to sqlite or redis")
+        logger.info(f"Starting server on {settings.SERVER_PORT} port with {args.workers} workers")
+        command = [
+            sys.executable, "-m", "uvicorn", "manage:app",
+            "--host", settings.SERVER_HOST,
+            "--port", str(settings.SERVER_PORT),
+            "--workers", str(args.workers),
+            "--proxy-headers",
+        ]
+        if settings.SERVER_LIMIT_CONCURRENCY:
+            command += ["--limit-concurrency", str(settings.SERVER_LIMIT_CONCURRENCY)]
+        # Hand over to the uvicorn CLI: spawned workers re-import the main module, and with this
+        # file as main each worker would import the whole app twice and miss its first health check
+        os.execv(sys.executable, command)